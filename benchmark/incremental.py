@@ -0,0 +1,81 @@
+"""
+This file is part of WSQL-SDK
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__author__ = "@bg"
+
+# the latency of keystrokes in the procedures of synthetic workspace, each keystroke is followed by the request
+# of the returns, the errors and the read-only flag of the edited procedures,
+# usage: python benchmark/incremental.py [COUNT ...]
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark.model_memory import generate  # noqa: E402
+from wsql_sdk.grammar import SQLTokenizer  # noqa: E402
+from wsql_sdk.incremental import IncrementalTokenizer  # noqa: E402
+
+# the typed text, it is inserted into the condition of select, so the procedure stays valid
+_TYPED = " AND `name` IS NOT NULL"
+
+
+def keystrokes(tokenizer, offset):
+    """type the text char by char at offset, get the latencies in seconds"""
+    latencies = []
+    for i, char in enumerate(_TYPED):
+        start = time.time()
+        for name in tokenizer.edit(offset + i, offset + i, char):
+            procedure = tokenizer._procedures[name]
+            tokenizer.returns(procedure)
+            tokenizer.errors(procedure)
+            tokenizer.is_read_only(procedure)
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def measure(count):
+    """get the time of the initial parse, the mean and the max latency of keystroke and the time of full parse"""
+    text = generate(count)
+    start = time.time()
+    tokenizer = IncrementalTokenizer()
+    tokenizer.parse(text)
+    tokenizer.call_graph()
+    initial = time.time() - start
+
+    latencies = []
+    # the helper, that is called by many procedures, and the ordinary procedure in the middle
+    for name in (next(iter(tokenizer._procedures)), list(tokenizer._procedures)[count // 2]):
+        start, end = tokenizer.span(tokenizer._procedures[name])
+        latencies.extend(keystrokes(tokenizer, tokenizer.text.index(" WHERE `id` = id", start, end) + 16))
+
+    start = time.time()
+    full = SQLTokenizer()
+    full.parse(tokenizer.text)
+    for procedure in full.procedures():
+        full.is_read_only(procedure)
+    return initial, sum(latencies) / len(latencies), max(latencies), time.time() - start
+
+
+def main(counts):
+    print('%10s %10s %12s %12s %10s' % ('count', 'initial', 'mean', 'max', 'full'))
+    for count in counts:
+        initial, mean, worst, full = measure(count)
+        print('%10d %9.2fs %10.2fms %10.2fms %9.2fs' % (count, initial, mean * 1000, worst * 1000, full))
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or [1000, 10000])
@@ -0,0 +1,106 @@
+"""
+This file is part of WSQL-SDK
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__author__ = "@bg"
+
+# the memory of the parsed model of synthetic procedures, the model of parser and the descriptions of wsql-codegen,
+# the memory per procedure, that is added between the smallest and the largest count, is compared with the budget
+# in bytes, so the fixed memory, e.g. of the grammar, is not counted,
+# usage: python benchmark/model_memory.py [BUDGET_BYTES [COUNT ...]]
+
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from wsql_sdk.codegen import Procedure  # noqa: E402
+from wsql_sdk.grammar import SQLTokenizer  # noqa: E402
+
+_PROCEDURE = """\
+CREATE PROCEDURE `table{t}.{action}_item{i}` (IN id BIGINT, IN name VARCHAR(255), OUT total DECIMAL(10, 2)){comment}
+BEGIN
+  SELECT `id`, `name`, `value`, COUNT(*) AS cnt FROM table{t} WHERE `id` = id; -- > object
+  SELECT `id`, `name` FROM table{t} WHERE `name` = name; -- > items: array
+  UPDATE table{t} SET `value` = total WHERE `id` = id;
+  INSERT INTO table{t}_log (`id`, `name`) VALUES (id, name);
+  IF total < 0 THEN
+    CALL __throw('InvalidAmount', 'the total should be positive');
+  END IF;
+  CALL `table{t}.__check_item{c}`(id);
+END$$
+"""
+
+_HELPER = """\
+CREATE PROCEDURE `table{t}.__check_item{i}` (IN id BIGINT)
+BEGIN
+  SELECT COUNT(*) AS found FROM table{t} WHERE `id` = id;
+  CALL __throw('NotFound', 'the item is not found');
+END$$
+"""
+
+
+def generate(count):
+    """generate the text of count procedures, the tenth of them are the helpers and the tenth have the hints"""
+    helpers = max(count // 10, 1)
+    parts = [_HELPER.format(t=i % 100, i=i) for i in range(helpers)]
+    parts.extend(_PROCEDURE.format(t=i % 100, i=i, c=i % helpers, action=('get', 'set', 'update')[i % 3],
+                                   comment='' if i % 10 else '\n COMMENT "items (item_id BIGINT, amount INT); returns union"')
+                 for i in range(count - helpers))
+    return ''.join(parts)
+
+
+def measure(count):
+    """parse the procedures and get the memory of the model and of the descriptions in megabytes"""
+    text = generate(count)
+    gc.collect()
+    tracemalloc.start()
+    # the model does not depend on the engine, the fast one keeps the run short
+    tokenizer = SQLTokenizer('fast')
+    tokenizer.parse(text)
+    gc.collect()
+    model = tracemalloc.get_traced_memory()[0]
+
+    procedures = []
+    for p in tokenizer.procedures():
+        module, _, name = p.name.partition('.')
+        procedures.append(Procedure(module, name, p, tokenizer.is_read_only(p), sorted(tokenizer.errors(p)),
+                                    tokenizer.returns(p)))
+    gc.collect()
+    descriptions = tracemalloc.get_traced_memory()[0] - model
+    tracemalloc.stop()
+    return model / (1 << 20), descriptions / (1 << 20)
+
+
+def main(budget, counts):
+    print('%10s %12s %14s %12s' % ('count', 'model', 'descriptions', 'per item'))
+    totals = []
+    for count in sorted(counts):
+        model, descriptions = measure(count)
+        totals.append((count, (model + descriptions) * (1 << 20)))
+        print('%10d %10.1fMB %12.1fMB %11.0fB' % (count, model, descriptions, totals[-1][1] / count))
+
+    if len(totals) > 1:
+        per_item = (totals[-1][1] - totals[0][1]) / (totals[-1][0] - totals[0][0])
+    else:
+        per_item = totals[0][1] / totals[0][0]
+    print('%10s %38.0fB%s' % ('added', per_item, ' over budget' if per_item > budget else ''))
+    if per_item > budget:
+        sys.exit('the memory per procedure is over the budget of %dB' % budget)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 4096, [int(x) for x in sys.argv[2:]] or [1000, 10000, 100000])
@@ -0,0 +1,80 @@
+"""
+This file is part of WSQL-SDK
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__author__ = "@bg"
+
+# the cold start of the modules and of wsql-trans and wsql-codegen on the small input,
+# the best time of several runs of the new interpreter is compared with the budget in seconds,
+# usage: python benchmark/startup.py [BUDGET]
+
+import os
+import subprocess
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_REPEAT = 5
+
+_SOURCE = """\
+#define STATUS "active"
+CREATE PROCEDURE `items.get` (IN id BIGINT)
+BEGIN
+  SELECT `id`, `name` FROM items WHERE `id` = id AND `status` = $STATUS; -- > object
+END$$
+"""
+
+_RUNNER = """\
+import sys
+from wsql_sdk.{0} import main
+main(sys.argv[1:])
+"""
+
+
+def measure(code, *args):
+    """run the code by the new interpreter, get the best time in seconds"""
+    best = None
+    for _ in range(_REPEAT):
+        start = time.time()
+        subprocess.run([sys.executable, '-c', code] + list(args), cwd=_ROOT,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(budget):
+    with TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, 'source.sql')
+        output = os.path.join(workdir, 'output.sql')
+        with open(source, 'w') as stream:
+            stream.write(_SOURCE)
+        results = [
+            ('python', measure('pass')),
+            ('import grammar', measure('import wsql_sdk.grammar')),
+            ('import translator', measure('import wsql_sdk.translator')),
+            ('import codegen', measure('import wsql_sdk.codegen')),
+            ('wsql-trans', measure(_RUNNER.format('translator'), source, output)),
+            ('wsql-codegen', measure(_RUNNER.format('codegen'), '-l', 'python3', '-o', workdir, output)),
+        ]
+    for name, elapsed in results:
+        print('%20s %8.3fs%s' % (name, elapsed, ' over budget' if elapsed > budget else ''))
+    if any(elapsed > budget for _, elapsed in results):
+        sys.exit('the cold start is over the budget of %.3fs' % budget)
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 0.25)
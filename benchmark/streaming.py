@@ -0,0 +1,93 @@
+"""
+This file is part of WSQL-SDK
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__author__ = "@bg"
+
+# the peak memory of wsql-trans and wsql-codegen for the seed files of growing size,
+# the growth of the peak memory in the streaming mode from the smallest to the largest file
+# is compared with the tolerance in megabytes,
+# usage: python benchmark/streaming.py [TOLERANCE_MB [SIZE_MB ...]]
+
+import os
+import subprocess
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the memory of the streaming mode does not depend on the engine, the fast engines keep the run short
+_ENGINE = ('--engine', 'fast')
+
+# runs the tool and prints its peak RSS in kilobytes to stderr
+_RUNNER = """\
+import resource, sys
+from wsql_sdk.{0} import main
+main(sys.argv[1:])
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, file=sys.stderr)
+"""
+
+
+def generate(filename, size):
+    """write the procedures and the seed rows of size in megabytes"""
+    with open(os.path.join(_ROOT, 'test', 'test.sql')) as stream:
+        procedures = stream.read()
+    with open(filename, 'w') as stream:
+        stream.write('#define STATE "active"\n')
+        stream.write(procedures)
+        row = 0
+        while stream.tell() < size << 20:
+            stream.write(''.join("INSERT INTO seed VALUES (%d, 'name %d', $STATE);  -- the row\n" % (row + i, row + i)
+                                 for i in range(1000)))
+            row += 1000
+
+
+def measure(tool, *args):
+    """run the tool, get the peak RSS in megabytes and the time in seconds"""
+    start = time.time()
+    result = subprocess.run([sys.executable, '-c', _RUNNER.format(tool)] + list(args + _ENGINE), cwd=_ROOT,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return int(result.stderr.split()[-1]) / 1024, time.time() - start
+
+
+def main(tolerance, sizes):
+    names = ('trans', 'trans --stream', 'codegen', 'codegen --stream')
+    print('%8s %16s %16s %16s %16s' % (('MB',) + names))
+    table = []
+    with TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, 'seed.sql')
+        output = os.path.join(workdir, 'out.sql')
+        for size in sorted(sizes):
+            generate(source, size)
+            results = [
+                measure('translator', source, output),
+                measure('translator', source, output, '--stream'),
+                measure('codegen', '-l', 'python3', '-o', workdir, output),
+                measure('codegen', '-l', 'python3', '-o', workdir, '--stream', output),
+            ]
+            table.append(results)
+            print('%8d %16s %16s %16s %16s' % ((size,) + tuple('%.1fMB %.1fs' % x for x in results)))
+
+    failed = False
+    for column in (1, 3):
+        growth = table[-1][column][0] - table[0][column][0]
+        print('%20s %8.1fMB%s' % (names[column], growth, ' over tolerance' if growth > tolerance else ''))
+        failed = failed or growth > tolerance
+    if failed:
+        sys.exit('the peak memory of the streaming mode grows with the input size over %.1fMB' % tolerance)
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 8.0, [int(x) for x in sys.argv[2:]] or [1, 4, 16])
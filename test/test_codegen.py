@@ -15,10 +15,18 @@ SOFTWARE.
 
 __author__ = "@bg"
 
+from collections import OrderedDict
 from unittest import TestCase, mock
 from io import BytesIO, StringIO
+from itertools import product
+import json
+from mmap import mmap
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
 from warnings import catch_warnings
 from wsql_sdk import codegen
+from wsql_sdk.cache import Cache
 
 try:
     from test.codegen_data import TEST_DATA
@@ -54,16 +62,22 @@ class TestCodeGen(TestCase):
         self.assertEqual("build", args.outdir)
         self.assertEqual("python3_aio", args.language)
         self.assertEqual("::", args.sep)
+        self.assertEqual("pyparsing", args.engine)
+        self.assertEqual("fast", codegen.parse_arguments(["-l", "python3", "--engine", "fast"]).engine)
+        self.assertIsNone(args.cache_dir)
+        self.assertEqual("c", codegen.parse_arguments(["-l", "python3", "--cache-dir", "c"]).cache_dir)
 
     def test_syntax(self):
         """ test generate result with different templates """
         for data in TEST_DATA:
-            for lang in ("python3_aio", "python3"):
+            # the cache is shared, so the procedures are parsed once for the languages
+            for lang, engine, cache in product(("python3_aio", "python3"), codegen.SQLTokenizer.engines, (None, Cache())):
                 args = Dummy()
                 args.input = StringIO(data["sql"])
                 args.language = lang
                 args.outdir = ""
                 args.sep = '.'
+                args.engine = engine
 
                 opened_files = dict()
 
@@ -73,7 +87,7 @@ class TestCodeGen(TestCase):
                     return r
 
                 with mock.patch('builtins.open', lambda f, *a, **kw: _open_mock(f)):
-                    codegen.process(args)
+                    codegen.process(args, cache)
 
                 filename = data.get("filename", "__init__.py")
 
@@ -93,6 +107,122 @@ class TestCodeGen(TestCase):
                     else:
                         self.assertNotIn(fn, opened_files)
 
+    def test_stream(self):
+        """ test the input is read by chunks """
+        data = "SELECT '\u0444\u0444';\n" * 10
+        self.assertEqual(data, "".join(codegen.read_input(BytesIO(data.encode("utf8")), 5)))
+        self.assertEqual(data, "".join(codegen.read_input(StringIO(data), 7)))
+        self.assertTrue(codegen.parse_arguments(["-l", "python3", "--stream", "test.sql"]).stream)
+        self.assertEqual(4, codegen.parse_arguments(["-l", "python3", "-j", "4", "test.sql"]).jobs)
+        args = Dummy()
+        args.input = StringIO(TEST_DATA[0]["sql"])
+        args.language = "python3"
+        args.outdir = ""
+        args.sep = '.'
+        args.stream = True
+        opened_files = dict()
+
+        def _open_mock(fname):
+            r = opened_files[fname] = StringIO()
+            r.close = lambda: None
+            return r
+
+        with mock.patch('builtins.open', lambda f, *a, **kw: _open_mock(f)):
+            codegen.process(args)
+        opened_files["__init__.py"].seek(0)
+        self.assertIn(TEST_DATA[0]["python3"], opened_files["__init__.py"].read())
+
+    def test_map_input(self):
+        """ test the input file is mapped to memory """
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        source = path.join(directory, "source.sql")
+        with open(source, "wb") as stream:
+            pass
+        with codegen.map_input(source) as buffer:
+            self.assertEqual(b"", buffer)
+        with open(source, "wb") as stream:
+            stream.write(TEST_DATA[0]["sql"].replace("\n", "\r\n").encode("utf8"))
+        with codegen.map_input(source) as buffer:
+            self.assertIsInstance(buffer, mmap)
+        args = codegen.parse_arguments(["-o", directory, "-l", "python3", source])
+        codegen.process(args)
+        with open(path.join(directory, "__init__.py")) as stream:
+            self.assertIn(TEST_DATA[0]["python3"], stream.read())
+
+    def test_profile(self):
+        """ test the profile of grammar is written as json """
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        source, profile = path.join(directory, "source.sql"), path.join(directory, "profile.json")
+        with open(source, "w") as stream:
+            stream.write(TEST_DATA[0]["sql"])
+        args = codegen.parse_arguments(["-o", directory, "-l", "python3", "--engine", "pyparsing",
+                                        "--profile-json", profile, source])
+        codegen.process(args)
+        with open(profile) as stream:
+            stats = json.load(stream)
+        self.assertLess(0, stats["CREATE_PROCEDURE"]["matches"])
+        self.assertLessEqual(stats["SELECT_EXPR"]["matches"], stats["SELECT_EXPR"]["attempts"])
+        self.assertEqual(["attempts", "matches", "time"], sorted(stats["SELECT_EXPR"]))
+        with mock.patch('sys.stderr', StringIO()):
+            self.assertRaises(SystemExit, codegen.parse_arguments, ["-l", "python3", "--profile", "-j", "2"])
+
+    def test_registry(self):
+        """ test the registry of tables, read-only flags and result columns of procedures """
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        source = path.join(directory, "source.sql")
+        with open(source, "w") as stream:
+            stream.write("CREATE PROCEDURE `items.get` (IN id BIGINT)\nBEGIN\n"
+                         "  SELECT `id`, `name` FROM items WHERE `id` = id; -- > object\n"
+                         "  SELECT `tag` FROM `tags`; -- > tags: array\nEND$$\n"
+                         "CREATE PROCEDURE `items.put` (IN id BIGINT)\nBEGIN\n"
+                         "  INSERT INTO items VALUES (id);\n  UPDATE stats SET n = n + 1;\n"
+                         "  CALL `items.get`(id);\nEND$$\n"
+                         "CREATE PROCEDURE `_items.clear` ()\nBEGIN\n  DELETE FROM items;\nEND$$\n"
+                         "CREATE PROCEDURE `ping` ()\nBEGIN\nEND$$\n")
+        self.assertFalse(codegen.parse_arguments(["-l", "python3", source]).registry)
+        codegen.process(codegen.parse_arguments(["-o", directory, "-l", "python3", "--registry", source]))
+        scope = dict()
+        with open(path.join(directory, "registry.py")) as stream:
+            source = stream.read()
+        exec(source, scope)
+        registry = scope["PROCEDURES"]
+        # the entries are written sorted by the name and keep the order on any version of python
+        self.assertEqual(["items.get", "items.put", "ping"], [x.split("'")[1] for x in source.splitlines()
+                                                              if x.startswith("    ('")])
+        self.assertEqual(["items.get", "items.put", "ping"], list(registry))
+        self.assertEqual((frozenset(("items", "tags")), frozenset(), True, ("id", "name", "tags.tag")),
+                         registry["items.get"])
+        self.assertEqual(frozenset(("items", "stats")), registry["items.put"].written_tables)
+        self.assertFalse(registry["items.put"].read_only)
+        self.assertEqual(registry["items.get"].read_tables, registry["items.put"].read_tables)
+        self.assertEqual((), registry["ping"].columns)
+        with self.assertRaises(TypeError):
+            registry["ping"] = None
+
+    def test_depfile(self):
+        """ test the dependencies rule lists the generated files """
+        args = codegen.parse_arguments(["-o", "build", "-l", "python3", "-MF", "deps.d", "test.sql"])
+        # the files in the order they are opened
+        opened_files = OrderedDict()
+
+        def _open_mock(fname, mode='r'):
+            if mode == 'rb':
+                return BytesIO(TEST_DATA[0]["sql"].encode("utf8"))
+            r = opened_files[fname] = StringIO()
+            r.close = lambda: None
+            return r
+
+        with mock.patch('builtins.open', lambda f, *a, **kw: _open_mock(f, *a)):
+            codegen.process(args)
+
+        opened_files["deps.d"].seek(0)
+        rule = opened_files.pop("deps.d").read()
+        self.assertEqual("build/__init__.py build/exceptions.py: \\\n test.sql\n", rule)
+        self.assertEqual(["build/__init__.py", "build/exceptions.py"], list(opened_files))
+
     def test_duplicate_fields(self):
         """test the duplicated field fire warning"""
         r1 = Dummy()
@@ -132,3 +262,17 @@ class TestCodeGen(TestCase):
             codegen.Procedure(proc.name, "", proc, True, [], proc.returns)
             self.assertGreater(len(log), 0)
             self.assertIn("test has duplicated fields: c", str(log[0]))
+
+    def test_compact_description(self):
+        """test the descriptions of procedures are slotted and do not keep the parsed procedure"""
+        tokenizer = codegen.SQLTokenizer()
+        tokenizer.parse(TEST_DATA[0]["sql"])
+        for p in tokenizer.procedures():
+            procedure = codegen.Procedure("", p.name, p, tokenizer.is_read_only(p), sorted(tokenizer.errors(p)),
+                                          tokenizer.returns(p))
+            self.assertFalse(hasattr(procedure, "__dict__"))
+            self.assertEqual(p.name, procedure.fullname)
+            self.assertEqual(p.return_mod, procedure.return_mod)
+            for argument, expected in zip(procedure.arguments, p.arguments):
+                self.assertFalse(hasattr(argument, "__dict__"))
+                self.assertEqual(tuple(expected), (argument.direction, argument.name, argument.type))
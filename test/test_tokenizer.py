@@ -15,8 +15,22 @@ SOFTWARE.
 
 __author__ = "@bg"
 
-from unittest import TestCase
-from wsql_sdk import grammar
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO, StringIO, TextIOWrapper
+import json
+from os import path
+from random import Random
+from shutil import rmtree
+import subprocess
+import sys
+from sys import intern
+from tempfile import mkdtemp
+from unittest import TestCase, mock
+from test.codegen_data import TEST_DATA
+from wsql_sdk import grammar, incremental
+from wsql_sdk.cache import Cache
+from wsql_sdk.callgraph import CallGraph
+from wsql_sdk.incremental import IncrementalTokenizer
 
 
 _TEST_PROCEDURE1 = """
@@ -120,6 +134,17 @@ BEGIN
 END$$
 """
 
+_TEST_PROCEDURE7 = """
+CREATE PROCEDURE `test_procedure7` ()
+BEGIN
+    SELECT a FROM b; -- the comment
+    SELECT a FROM b; -- CALL __test_procedure3(1,
+    2);
+    SELECT a FROM b;
+    -- > array
+END$$
+"""
+
 _TEST_PROCEDURE_INVALID1 = """
 CREATE PROCEDURE `test_invalid1` ()
  COMMENT "args (c1 INT, c2 BINARY(255)); returns merge"
@@ -234,3 +259,506 @@ class TestTokenizer(TestCase):
             "DECIMAL(32,16)",
             self.tokenizer._procedures["test_procedure6"].arguments[0].type
         )
+
+    def test_compact_model(self):
+        """ test the model keeps the slotted objects, the interned strings and no pyparsing results """
+        text = _TEST_PROCEDURE1 + _TEST_PROCEDURE2 + _TEST_PROCEDURE3 + _TEST_PROCEDURE5 + _TEST_PROCEDURE6 + \
+            _TEST_PROCEDURE_INVALID2.partition("END$$")[0] + "END$$"
+        for engine in grammar.SQLTokenizer.engines:
+            tokenizer = grammar.SQLTokenizer(engine)
+            tokenizer.parse(text)
+            values = []
+            for procedure in tokenizer.procedures():
+                self.assertFalse(hasattr(procedure, "__dict__"))
+                values.extend((procedure.name, procedure.return_mod, procedure.temptable))
+                values.extend(procedure.children)
+                values.extend(procedure.errors)
+                values.extend(procedure.arguments)
+                values.extend(procedure.queries)
+                values.extend(procedure.modifiers)
+                values.extend(procedure.returns)
+            while values:
+                value = values.pop()
+                if isinstance(value, tuple):
+                    values.extend(value)
+                elif value is not None:
+                    self.assertIs(str, type(value))
+                    self.assertIs(value, intern(value))
+            p1, p2, p5 = (tokenizer._procedures[x] for x in ("test_procedure1", "test_procedure2", "test_procedure5"))
+            self.assertIs(p1.queries[0].columns, p1.returns[0].fields)
+            self.assertEqual((), p2.modifiers[0].columns)
+            self.assertIs(p1.returns[0].type, p5.returns[0].type)
+
+    def test_parse_chunks(self):
+        """ test the text parsed by chunks gives the same result """
+        text = _TEST_PROCEDURE1 + _TEST_PROCEDURE2 + _TEST_PROCEDURE3 + _TEST_PROCEDURE4 + _TEST_PROCEDURE5 + \
+            _TEST_PROCEDURE7
+        self.tokenizer.parse(text)
+        for size in (1, 7, 64):
+            tokenizer = grammar.SQLTokenizer()
+            tokenizer.parse_chunks(text[i:i + size] for i in range(0, len(text), size))
+            self.assertEqual(set(self.tokenizer._procedures), set(tokenizer._procedures))
+            for name, expected in self.tokenizer._procedures.items():
+                actual = tokenizer._procedures[name]
+                self.assertEqual(expected.returns, actual.returns)
+                self.assertEqual(expected.children, actual.children)
+                self.assertEqual(len(expected.queries), len(actual.queries))
+                self.assertEqual(len(expected.modifiers), len(actual.modifiers))
+                self.assertEqual(self.tokenizer.errors(expected), tokenizer.errors(actual))
+        procedure = self.tokenizer._procedures["test_procedure7"]
+        self.assertEqual(["__test_procedure3"], procedure.children)
+        self.assertEqual("array", procedure.returns[-1].type)
+
+    def test_parse_parallel(self):
+        """ test the procedures parsed in parallel gives the same result """
+        text = "-- CONSTANT A 1\n" + "".join(
+            x.replace("test_procedure", "test%d_procedure" % i) for i in range(4)
+            for x in (_TEST_PROCEDURE1, _TEST_PROCEDURE2, _TEST_PROCEDURE3, _TEST_PROCEDURE4, _TEST_PROCEDURE7))
+        self.assertLess(1, len(grammar.SQLTokenizer._split(text, 8)))
+        self.assertEqual(text, "".join(grammar.SQLTokenizer._split(text, 8)))
+        self.tokenizer.parse(text)
+        tokenizer = grammar.SQLTokenizer()
+        tokenizer.parse(text, 2)
+        self.assertEqual(list(self.tokenizer._procedures), list(tokenizer._procedures))
+        self.assertEqual(self.tokenizer.constants(), tokenizer.constants())
+        for name, expected in self.tokenizer._procedures.items():
+            actual = tokenizer._procedures[name]
+            self.assertEqual(expected.returns, actual.returns)
+            self.assertEqual(expected.children, actual.children)
+            self.assertEqual(expected.arguments, actual.arguments)
+            self.assertEqual(len(expected.queries), len(actual.queries))
+            self.assertEqual(self.tokenizer.errors(expected), tokenizer.errors(actual))
+        self.assertIsNone(tokenizer._current)
+
+        duplicates = text + text.replace("test1_", "test5_")
+        with self.assertRaises(ValueError) as expected:
+            grammar.SQLTokenizer().parse(duplicates)
+        self.assertRaisesRegex(ValueError, str(expected.exception), grammar.SQLTokenizer().parse, duplicates, 2)
+        # the part, that ends inside the procedure, depends on the previous part
+        split = text.index("SELECT 1;")
+        tokenizer = grammar.SQLTokenizer()
+        with mock.patch.object(grammar.SQLTokenizer, "_split", return_value=[text[:split], text[split:]]):
+            tokenizer.parse(text, 2)
+        self.assertEqual(len(self.tokenizer._procedures["test0_procedure1"].queries),
+                         len(tokenizer._procedures["test0_procedure1"].queries))
+
+    def test_parse_cache(self):
+        """ test the unchanged procedures are loaded from the cache """
+        directory = mkdtemp()
+        self.addCleanup(rmtree, directory)
+        text = "-- CONSTANT A 1\n" + _TEST_PROCEDURE1 + _TEST_PROCEDURE2 + _TEST_PROCEDURE3 + _TEST_PROCEDURE7
+        for source, parsed in ((text, 5), (text, 0), (text.replace("SELECT 1;", "SELECT 2;"), 1)):
+            self.tokenizer = grammar.SQLTokenizer()
+            self.tokenizer.parse(source)
+            tokenizer = grammar.SQLTokenizer(cache=Cache(directory))
+            with mock.patch.object(grammar, "_parse_part", wraps=grammar._parse_part) as parse_part:
+                tokenizer.parse(source)
+            self.assertEqual(parsed, parse_part.call_count)
+            self.assertEqual(self.tokenizer.constants(), tokenizer.constants())
+            self.assertEqual(list(self.tokenizer._procedures), list(tokenizer._procedures))
+            for name, expected in self.tokenizer._procedures.items():
+                actual = tokenizer._procedures[name]
+                for attr in ("arguments", "queries", "modifiers", "children", "errors", "returns", "temptable", "return_mod"):
+                    self.assertEqual(getattr(expected, attr), getattr(actual, attr))
+                self.assertEqual(self.tokenizer.is_read_only(expected), tokenizer.is_read_only(actual))
+        self.assertEqual(("", "", ("2",)), tokenizer._procedures["test_procedure1"].queries[0])
+
+        # the cached procedures are not shared between the tokenizers
+        cache = Cache(directory)
+        tokenizer = grammar.SQLTokenizer(cache=cache)
+        tokenizer.parse(_TEST_PROCEDURE3)
+        tokenizer._procedures["test_procedure3"].read_only = True
+        tokenizer = grammar.SQLTokenizer(cache=cache)
+        tokenizer.parse(_TEST_PROCEDURE3)
+        self.assertFalse(tokenizer.is_read_only(tokenizer._procedures["test_procedure3"]))
+        # the failed part is not cached
+        for _ in range(2):
+            self.assertRaisesRegex(ValueError, "SyntaxError: procedure test_invalid1",
+                                   grammar.SQLTokenizer(cache=cache).parse, _TEST_PROCEDURE_INVALID1)
+
+
+_STATEMENTS = [
+    "SELECT a, b AS c, COUNT(*) AS n, (SELECT 1) AS s FROM `t` WHERE x = 1;", "SELECT COUNT(*), `t`.a FROM t;  -- > array",
+    "SELECT a INTO @x FROM t;", "SELECT 1 AS `a`;\n-- > r: object", "INSERT INTO t VALUES (1, ';');", "UPDATE `t` SET a = 1;",
+    "DELETE FROM t WHERE a;", "CALL __throw('E1', 'msg');", 'CALL `__throw`("E2", CONCAT("a", "b"));', "CALL x.y(1, 2);",
+    "CALL `q`();", "-- BEGIN INLINE q.r\nSELECT 2 AS z;\n-- END INLINE", "DECLARE c CURSOR FOR SELECT a FROM t;",
+    "IF a THEN CALL __throw('E3'); END IF;", "SELECT f(g(x)) AS k, `cnt`(x, y) FROM t;", "SELECT a\n  FROM t\n  WHERE b;\n  -- > ARRAY"
+]
+
+_HEADERS = [
+    "CREATE PROCEDURE `p%d` ()", "CREATE DEFINER = `root` PROCEDURE p%d (IN a INT, OUT b VARCHAR(10))",
+    "create procedure q.p%d (inner DECIMAL(10, 2), INOUT `c` TEXT)\nCOMMENT 'returns union'",
+    "CREATE PROCEDURE p%d (a INT) COMMENT \"t (x INT, y BINARY(2)); returns union\"", "CREATE PROCEDURE p%d(\n  a INT,\n  b INT\n)"
+]
+
+_PIECES = [
+    "(", ")", ",", ";", "\n", "\t", "'", '"', "`", "-- ", "-- > array", "END$$", "SELECT ", "1CALL x;", "xselect a", "(( 1 ))",
+    "CALL __throw()", "-- CONSTANT B\t2 \r\n", "CREATE TABLE IF NOT EXISTS `u` (c ENUM('z'))", "DECIMAL( 10 ,2 )", "ſelect 1;"
+]
+
+
+class TestEngines(TestCase):
+    """
+    the differential test, the fast engine should produce same results as the pyparsing engine
+    """
+    @staticmethod
+    def model(text, engine, size=None):
+        """ the parsed model or the error, the text is parsed from the encoded buffer by parts if size is specified """
+        tokenizer = grammar.SQLTokenizer(engine)
+        try:
+            if size is None:
+                tokenizer.parse(text)
+            else:
+                tokenizer.parse_buffer(text, size=size)
+        except ValueError as e:
+            return str(e)
+        return ([(p.name, p.arguments, p.queries, p.modifiers, p.children, sorted(p.errors), p.temptable, p.returns,
+                  p.return_mod) for p in tokenizer.procedures()], tokenizer.constants(), tokenizer._structures)
+
+    @staticmethod
+    def synthetic(seed, count):
+        """ generate the procedures and break them randomly """
+        random = Random(seed)
+        for i in range(count):
+            out = ["-- CONSTANT K%d %d\n" % (i, i)]
+            for j in range(random.randint(1, 4)):
+                out.append(random.choice(_HEADERS) % j + "\nBEGIN\n")
+                out.extend("  " + random.choice(_STATEMENTS) + "\n" for _ in range(random.randint(0, 6)))
+                out.append("END$$\n\n")
+            text = "".join(out)
+            for _ in range(random.randint(0, 4)):
+                pos = random.randint(0, len(text))
+                if random.random() < 0.5:
+                    text = text[:pos] + random.choice(_PIECES) + text[pos:]
+                else:
+                    text = text[:pos] + text[pos + random.randint(1, 5):]
+            yield text
+
+    def assertSameModel(self, text):
+        self.assertEqual(self.model(text, "pyparsing"), self.model(text, "fast"), text)
+
+    @staticmethod
+    def corpus():
+        """ the test procedures """
+        with open(path.join(path.dirname(__file__), "test.sql")) as stream:
+            corpus = [stream.read()]
+        corpus.extend(x["sql"] for x in TEST_DATA)
+        corpus.extend(v for k, v in sorted(globals().items()) if k.startswith("_TEST_PROCEDURE"))
+        return corpus
+
+    def test_engines(self):
+        """ test the engines give the same model """
+        for text in self.corpus():
+            self.assertSameModel(text)
+
+    def test_engines_synthetic(self):
+        """ test the engines give the same model on the synthetic corpus """
+        for text in self.synthetic(17, 150):
+            self.assertSameModel(text)
+
+    def test_parse_buffer(self):
+        """ test the encoded buffer parsed by parts gives the same model """
+        corpus = self.corpus()
+        buffer = corpus[0].replace("\n", "\r\n").encode("utf8")
+        self.assertLess(1, len(list(grammar.SQLTokenizer._split_buffer(buffer, 1))))
+        self.assertEqual(corpus[0], "".join(grammar.SQLTokenizer._split_buffer(buffer, 1)))
+        for text in corpus + list(self.synthetic(23, 60)):
+            buffer = text.replace("\n", "\r\n").encode("utf8")
+            # the line ends are translated like in the file opened in the text mode
+            expected = self.model(TextIOWrapper(BytesIO(buffer), encoding="utf8").read(), "fast")
+            for size in (1, 256):
+                self.assertEqual(expected, self.model(buffer, "fast", size), text)
+
+    def test_parse_buffer_jobs(self):
+        """ test the parts of buffer are parsed by the same process pool """
+        text = "".join(x.replace("test_procedure", "test%d_procedure" % i) for i in range(8)
+                       for x in (_TEST_PROCEDURE1, _TEST_PROCEDURE2, _TEST_PROCEDURE3, _TEST_PROCEDURE4))
+        buffer = text.encode("utf8")
+        self.assertLess(2, len(list(grammar.SQLTokenizer._split_buffer(buffer, 1024))))
+        tokenizer = grammar.SQLTokenizer()
+        with mock.patch("concurrent.futures.ProcessPoolExecutor", wraps=ProcessPoolExecutor) as executor:
+            tokenizer.parse_buffer(buffer, 2, 1024)
+        self.assertEqual(1, executor.call_count)
+        self.assertIsNone(tokenizer._executor)
+        expected = grammar.SQLTokenizer()
+        expected.parse(text)
+        self.assertEqual(list(expected._procedures), list(tokenizer._procedures))
+        for name, procedure in expected._procedures.items():
+            self.assertEqual(procedure.returns, tokenizer._procedures[name].returns)
+            self.assertEqual(expected.errors(procedure), tokenizer.errors(tokenizer._procedures[name]))
+
+    def test_unknown_engine(self):
+        """ test the unknown engine is rejected """
+        self.assertRaisesRegex(ValueError, "unknown engine", grammar.SQLTokenizer, "lex")
+        self.assertEqual("pyparsing", grammar.SQLTokenizer().engine)
+        self.assertEqual("fast", grammar.SQLTokenizer("fast").engine)
+
+    def test_lazy_grammar(self):
+        """ test the grammar is not built on import, and it is built once for all tokenizers and threads """
+        code = "import sys, wsql_sdk.codegen, wsql_sdk.translator; sys.exit('pyparsing' in sys.modules)"
+        self.assertEqual(0, subprocess.call([sys.executable, "-c", code], cwd=path.dirname(path.dirname(__file__))))
+
+        with mock.patch.object(grammar, "_ELEMENTS", None), \
+                mock.patch.object(grammar, "_build_elements", wraps=grammar._build_elements) as build:
+            with ThreadPoolExecutor(8) as executor:
+                elements = set(map(id, executor.map(lambda _: grammar._elements(), range(32))))
+            self.assertEqual(1, build.call_count)
+            self.assertEqual(1, len(elements))
+
+    def test_shared_grammar_threads(self):
+        """ test the tokenizers parse in the threads by the shared grammar """
+        corpus = list(self.synthetic(21, 40))
+        expected = [self.model(text, engine) for text in corpus for engine in grammar.SQLTokenizer.engines]
+        with ThreadPoolExecutor(8) as executor:
+            actual = list(executor.map(lambda x: self.model(*x),
+                                       ((text, engine) for text in corpus for engine in grammar.SQLTokenizer.engines)))
+        self.assertEqual(expected, actual)
+
+    def test_profile(self):
+        """ test the profile counts the named elements of grammar and restores the grammar after stop """
+        text = TEST_DATA[0]["sql"]
+        with grammar.GrammarProfile() as profile:
+            self.assertRaisesRegex(ValueError, "already profiled", grammar.GrammarProfile().start)
+            self.assertEqual(self.model(text, "fast"), self.model(text, "pyparsing"))
+            tokenizer = grammar.MacrosTokenizer("pyparsing")
+            tokenizer.parse(["#define F(x) $x\n", "SELECT $F(1), $F(2);\n"])
+        self.assertIsNone(grammar.GrammarProfile.active)
+        self.assertFalse(any(x.debug for x in grammar._elements().rules))
+
+        stats = profile.stats()
+        self.assertEqual(2, stats["EXPAND_FUNC"][1])
+        self.assertEqual(1, stats["DEFINE_FUNCTION"][1])
+        self.assertEqual(stats["STATEMENTS"][0], stats["CREATE_PROCEDURE"][0])
+        self.assertEqual(text.count("CREATE PROCEDURE"), stats["CREATE_PROCEDURE"][1])
+        for attempts, matches, elapsed in stats.values():
+            self.assertLessEqual(matches, attempts)
+            self.assertGreaterEqual(elapsed, 0)
+
+        stream = StringIO()
+        profile.report(stream)
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(stats) + 1, len(lines))
+        self.assertEqual("STATEMENTS", lines[1].split()[0])
+        stream = StringIO()
+        profile.dump(stream)
+        dump = json.loads(stream.getvalue())
+        self.assertEqual(list(stats["EXPAND_FUNC"]), [dump["EXPAND_FUNC"][x] for x in ("attempts", "matches", "time")])
+
+
+class TestCallGraph(TestCase):
+    """
+    the closures of call graph should be computed once for each procedure
+    """
+    @staticmethod
+    def parse(calls):
+        """parse the procedures, that call the others"""
+        tokenizer = grammar.SQLTokenizer()
+        tokenizer.parse("".join(
+            "CREATE PROCEDURE %s ()\nBEGIN\n  SELECT a FROM %s;\n%s  CALL __throw('E_%s');\nEND$$\n" %
+            (name, name, "".join("  CALL %s(1);\n" % x for x in children), name)
+            for name, children in calls))
+        return tokenizer
+
+    def test_diamonds(self):
+        """ test the procedure, that reaches the same procedures by many paths """
+        depth = 64
+        tokenizer = self.parse([("p%d" % i, ("p%d" % (i + 1), "p%d" % (i + 1))) for i in range(depth)] +
+                               [("p%d" % depth, ())])
+        procedure = tokenizer._procedures["p0"]
+        self.assertEqual({"E_p%d" % i for i in range(depth + 1)}, tokenizer.errors(procedure))
+        self.assertTrue(tokenizer.is_read_only(procedure))
+        self.assertEqual(3, len(tokenizer.queries(tokenizer._procedures["p%d" % (depth - 1)])))
+        self.assertEqual(2 ** 11 - 1, len(tokenizer.returns(tokenizer._procedures["p%d" % (depth - 10)])))
+        self.assertEqual([], tokenizer.call_graph().cycles)
+
+    def test_chain(self):
+        """ test the long chain of calls does not exceed the recursion limit """
+        depth = 2000
+        tokenizer = self.parse([("p%d" % i, ("p%d" % (i + 1),)) for i in range(depth)] + [("p%d" % depth, ())])
+        procedure = tokenizer._procedures["p0"]
+        self.assertEqual(depth + 1, len(tokenizer.errors(procedure)))
+        self.assertEqual(depth + 1, len(tokenizer.returns(procedure)))
+
+    def test_cycles(self):
+        """ test the recursive calls are reported with the path """
+        tokenizer = self.parse([("a", ("b",)), ("b", ("c", "d")), ("c", ("a",)), ("d", ("d",)), ("e", ("b",)), ("f", ())])
+        self.assertEqual([["d", "d"], ["a", "b", "c", "a"]], tokenizer.call_graph().cycles)
+        self.assertEqual({"E_a", "E_b", "E_c", "E_d"}, tokenizer.errors(tokenizer._procedures["c"]))
+        self.assertEqual({"E_a", "E_b", "E_c", "E_d", "E_e"}, tokenizer.errors(tokenizer._procedures["e"]))
+        self.assertTrue(tokenizer.is_read_only(tokenizer._procedures["e"]))
+        self.assertEqual((set("abcde"), set()), tokenizer.tables(tokenizer._procedures["e"]))
+        self.assertRaisesRegex(ValueError, "The procedure a has recursive call a -> b -> c -> a",
+                               tokenizer.returns, tokenizer._procedures["e"])
+        self.assertRaisesRegex(ValueError, "The procedure d has recursive call d -> d",
+                               tokenizer.queries, tokenizer._procedures["d"])
+        self.assertEqual(1, len(tokenizer.returns(tokenizer._procedures["f"])))
+
+    def test_update(self):
+        """ test the closures are computed again for the changed procedures and their callers only """
+        calls = [("a", ("b",)), ("b", ("c", "d")), ("c", ("a",)), ("d", ()), ("e", ("d",)), ("f", ())]
+        tokenizer = self.parse(calls)
+        graph = tokenizer.call_graph()
+        errors = graph._errors["f"]
+        # the cycle is broken and the undefined procedure is called
+        tokenizer._procedures.update(self.parse([("c", ("g",)), ("d", ("f",))])._procedures)
+        graph.update(["c", "d"])
+        self.assertIs(errors, graph._errors["f"])
+        self.assertEqual([], graph.cycles)
+        fresh = CallGraph(dict(tokenizer._procedures))
+        for name in "abcdef":
+            for method in ("errors", "is_read_only", "tables", "queries", "returns"):
+                try:
+                    expected = getattr(fresh, method)(name)
+                except ValueError as e:
+                    self.assertRaisesRegex(ValueError, str(e), getattr(graph, method), name)
+                else:
+                    self.assertEqual(expected, getattr(graph, method)(name))
+        self.assertRaisesRegex(ValueError, "The procedure c calls undefined procedure g", graph.errors, "a")
+        self.assertEqual({"E_d", "E_e", "E_f"}, graph.errors("e"))
+
+    def test_undefined(self):
+        """ test the call of undefined procedure """
+        tokenizer = self.parse([("a", ("b",)), ("b", ("c",)), ("d", ())])
+        for method in (tokenizer.errors, tokenizer.returns, tokenizer.queries, tokenizer.is_read_only,
+                       tokenizer.tables):
+            self.assertRaisesRegex(ValueError, "The procedure b calls undefined procedure c",
+                                   method, tokenizer._procedures["a"])
+        self.assertEqual({"E_d"}, tokenizer.errors(tokenizer._procedures["d"]))
+        tokenizer.parse("CREATE PROCEDURE e ()\nBEGIN\n  CALL c(1);\n  DELETE FROM t;\nEND$$\n")
+        # the procedure modifies the data, so the undefined procedure does not matter
+        self.assertFalse(tokenizer.is_read_only(tokenizer._procedures["e"]))
+        # the graph is built again after the parse
+        tokenizer.parse("CREATE PROCEDURE c ()\nBEGIN\n  UPDATE t SET a = 1;\nEND$$\n")
+        self.assertEqual({"E_a", "E_b"}, tokenizer.errors(tokenizer._procedures["a"]))
+        self.assertFalse(tokenizer.is_read_only(tokenizer._procedures["a"]))
+        self.assertEqual(({"a", "b"}, {"t"}), tokenizer.tables(tokenizer._procedures["a"]))
+
+
+class TestIncremental(TestCase):
+    """
+    the edited text should give the same model as the text parsed at once
+    """
+    @staticmethod
+    def model(tokenizer):
+        """ the procedures with their closures, the constants and the structures """
+        procedures = []
+        for p in sorted(tokenizer.procedures(), key=lambda x: x.name):
+            closures = []
+            for method in (tokenizer.errors, tokenizer.is_read_only, tokenizer.queries, tokenizer.returns):
+                try:
+                    closures.append(method(p))
+                except ValueError as e:
+                    closures.append(str(e))
+            procedures.append((p.name, p.arguments, p.queries, p.children, sorted(p.errors), p.returns, closures))
+        return procedures, tokenizer.constants(), tokenizer.structures("t")
+
+    def assertSameModel(self, tokenizer):
+        expected = grammar.SQLTokenizer()
+        expected.parse(tokenizer.text)
+        self.assertEqual(self.model(expected), self.model(tokenizer))
+
+    def test_edit(self):
+        """ test the edit parses the touched blocks only """
+        text = _TEST_PROCEDURE1 + _TEST_PROCEDURE4 + _TEST_PROCEDURE2 + _TEST_PROCEDURE3
+        tokenizer = IncrementalTokenizer()
+        tokenizer.parse(text)
+        self.assertEqual(text, tokenizer.text)
+        self.assertSameModel(tokenizer)
+        self.assertTrue(tokenizer.is_read_only(tokenizer._procedures["test_procedure4"]))
+
+        start, end = tokenizer.span(tokenizer._procedures["test_procedure4"])
+        self.assertTrue(text[start:end].startswith("CREATE PROCEDURE `test_procedure4`"))
+        self.assertEqual([tokenizer._procedures["test_procedure4"]], tokenizer.procedures_at(start + 20))
+        offset = text.index("SELECT a FROM b; -- > name:object")
+        with mock.patch.object(incremental, "_parse_part", wraps=incremental._parse_part) as parse_part:
+            self.assertEqual({"test_procedure4"}, tokenizer.edit(offset, offset, "DELETE FROM b;\n    "))
+        # the previous block is split again, but its text is not changed, so it is not parsed
+        self.assertEqual(1, parse_part.call_count)
+        self.assertFalse(tokenizer.is_read_only(tokenizer._procedures["test_procedure4"]))
+        self.assertSameModel(tokenizer)
+
+        # the procedure is not finished, so it continues to the next one
+        offset = tokenizer.text.index("END$$", tokenizer.text.index("test_procedure2"))
+        self.assertEqual({"test_procedure2", "test_procedure3"}, tokenizer.edit(offset, offset + 5, ""))
+        self.assertSameModel(tokenizer)
+        self.assertEqual({"test_procedure2", "test_procedure3"}, tokenizer.edit(offset, offset, "END$$"))
+        self.assertSameModel(tokenizer)
+        self.assertRaisesRegex(ValueError, "out of the text", tokenizer.edit, 0, len(tokenizer.text) + 1, "")
+
+    def test_call_graph(self):
+        """ test the closures of procedures, that do not call the changed ones, are kept """
+        tokenizer = IncrementalTokenizer()
+        tokenizer.parse(_TEST_PROCEDURE4 + _TEST_PROCEDURE5 + _TEST_PROCEDURE3)
+        graph = tokenizer.call_graph()
+        self.assertEqual(["__test_procedure3", "__test_procedure3"], tokenizer._procedures["test_procedure3"].children)
+        errors = graph._errors["test_procedure5"]
+        offset = tokenizer.text.index("TestError2")
+        self.assertEqual({"__test_procedure3"}, tokenizer.edit(offset, offset + 10, "TestError3"))
+        self.assertIs(graph, tokenizer.call_graph())
+        self.assertIs(errors, graph._errors["test_procedure5"])
+        self.assertEqual({"TestError1", "TestError3"}, tokenizer.errors(tokenizer._procedures["test_procedure3"]))
+        self.assertSameModel(tokenizer)
+
+        offset = tokenizer.text.index("CREATE PROCEDURE `__test_procedure3`")
+        # the text is joined with the previous procedure
+        self.assertEqual({"test_procedure3", "__test_procedure3"},
+                         tokenizer.edit(offset, offset + 16, "CREATE FUNCTION "))
+        self.assertRaisesRegex(ValueError, "calls undefined procedure __test_procedure3",
+                               tokenizer.errors, tokenizer._procedures["test_procedure3"])
+        self.assertSameModel(tokenizer)
+
+    def test_diagnostics(self):
+        """ test the errors do not stop the parse """
+        tokenizer = IncrementalTokenizer()
+        tokenizer.parse(_TEST_PROCEDURE_INVALID1 + _TEST_PROCEDURE4 + _TEST_PROCEDURE4)
+        self.assertEqual({"test_procedure4"}, set(tokenizer._procedures))
+        diagnostics = tokenizer.diagnostics()
+        self.assertEqual(2, len(diagnostics))
+        self.assertEqual((1, len(_TEST_PROCEDURE_INVALID1) + 1), diagnostics[0][:2])
+        self.assertIn("SyntaxError: procedure test_invalid1", diagnostics[0][2])
+        self.assertEqual("The procedure test_procedure4 already defined!", diagnostics[1][2])
+        self.assertEqual(len(tokenizer.text), diagnostics[1][1])
+        # the first definition wins
+        start, _ = tokenizer.span(tokenizer._procedures["test_procedure4"])
+        self.assertEqual(len(_TEST_PROCEDURE_INVALID1) + 1, start)
+        tokenizer.edit(0, len(_TEST_PROCEDURE_INVALID1) + len(_TEST_PROCEDURE4), "")
+        self.assertEqual([], tokenizer.diagnostics())
+        self.assertEqual((1, len(tokenizer.text)), tokenizer.span(tokenizer._procedures["test_procedure4"]))
+
+    def test_paste_duplicate(self):
+        """ test the pasted copy of procedure is the separate block, that is reported as the duplicate """
+        tokenizer = IncrementalTokenizer()
+        tokenizer.parse(_TEST_PROCEDURE4)
+        end = len(tokenizer.text)
+        tokenizer.edit(end, end, _TEST_PROCEDURE4[1:])
+        expected = IncrementalTokenizer()
+        expected.parse(tokenizer.text)
+        self.assertEqual(1, len(expected.diagnostics()))
+        self.assertEqual(expected.diagnostics(), tokenizer.diagnostics())
+        self.assertEqual(len(tokenizer._blocks), len(set(map(id, tokenizer._blocks))))
+
+        offset = tokenizer.text.index("SELECT a FROM b")
+        self.assertEqual({"test_procedure4"}, tokenizer.edit(offset, offset, "DELETE FROM b;\n    "))
+        expected = IncrementalTokenizer()
+        expected.parse(tokenizer.text)
+        self.assertEqual(expected.diagnostics(), tokenizer.diagnostics())
+        # the first definition is edited
+        self.assertFalse(tokenizer.is_read_only(tokenizer._procedures["test_procedure4"]))
+
+    def test_random_edits(self):
+        """ test the random edits of the synthetic procedures """
+        random = Random(29)
+        corpus = list(TestEngines.synthetic(29, 40))
+        for text in corpus:
+            tokenizer = IncrementalTokenizer()
+            tokenizer.parse(text)
+            tokenizer.call_graph()
+            for _ in range(4):
+                start = random.randint(0, len(tokenizer.text))
+                end = min(start + random.choice((0, 1, 10)), len(tokenizer.text))
+                expected = tokenizer.text[:start] + random.choice(corpus)[:random.randint(0, 80)] + \
+                    tokenizer.text[end:]
+                tokenizer.edit(start, end, expected[start:len(expected) - len(tokenizer.text) + end])
+                self.assertEqual(expected, tokenizer.text)
+                if not tokenizer.diagnostics():
+                    self.assertSameModel(tokenizer)
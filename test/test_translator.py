@@ -16,9 +16,14 @@ SOFTWARE.
 __author__ = "@bg"
 
 from unittest import TestCase, mock
-from io import StringIO
-from warnings import catch_warnings
-from wsql_sdk import translator
+from io import BytesIO, StringIO
+from tempfile import TemporaryDirectory
+from warnings import catch_warnings, simplefilter
+from zipfile import ZipFile
+from wsql_sdk import depfile, grammar, inliner, minifier, shaker, translator
+from wsql_sdk.cache import Cache
+from wsql_sdk.loaders import DictLoader, DirectoryLoader, ZipLoader
+import os
 
 
 _TEST_FILES = {
@@ -53,6 +58,11 @@ $f3("a", "b c");
 """
 }
 
+_GLOB_FILES = {
+    "./glob.sql": '#include "parts/*.sql"\n$_x select $_p;\n',
+    "./parts/p1.sql": "#define _p 2\n",
+}
+
 _EXPECTED = """\
 select "var1" from 'var2' where `var3`;
 select MAX(*) from `test2`;
@@ -206,6 +216,88 @@ class TestTranslator(TestCase):
         self.assertEqual("test.sql", args.input[0])
         self.assertIsNone(args.output)
 
+    def test_depends(self):
+        """test the dependencies rule contains the resolved includes and the listed directories"""
+        with mock.patch('builtins.open', lambda f, *args, **kwargs: _open_mock(f)):
+            with mock.patch('os.listdir', _listdir_mock):
+                self.trans.compile('main.sql')
+                with catch_warnings(record=True):
+                    self.trans.on_include('common/*.sql')
+        self.assertEqual(['./common/func.sql', './common/vars.sql', './main.sql', './common'], self.trans.depends())
+        self.assertEqual("out\\ 1.sql: \\\n main.sql \\\n common/$$a\\#.sql\n\nmain.sql:\n\ncommon/$$a\\#.sql:\n",
+                         depfile.format_rule(['out 1.sql'], ['./main.sql', 'common/$a#.sql'], True))
+        args = translator.parse_arguments(["test.sql", "-MF", "test.d", "-MT", "all", "-MP"])
+        self.assertEqual(("test.d", "all", True), (args.depfile, args.deptarget, args.phony))
+        self.assertEqual("-", translator.parse_arguments(["test.sql", "-M"]).depfile)
+
+    def test_loops(self):
+        """test the loop directives"""
+        self.trans.parse(StringIO('#define f(a, b) select $a from $b;\n'
+                                  '#for i in range(1, 3)\n'
+                                  '#foreach t in (a, b)\n'
+                                  '$f($i, $t)\n'
+                                  '#endfor\n'
+                                  '#endfor\n'))
+        self.assertEqual("select 1 from a;select 1 from b;select 2 from a;select 2 from b;", self.output.getvalue())
+        self.assertNotIn('i', self.trans.variables)
+        self.assertRaisesRegex(ValueError, "0: mismatch for/endfor", self.trans.parse, StringIO('#for i in (1)\n'))
+        self.assertRaisesRegex(ValueError, "0: mismatch for/endfor", self.trans.parse, StringIO('#endfor\n'))
+        self.assertRaisesRegex(ValueError, "0: invalid loop", self.trans.parse, StringIO('#for i in range(a)\n#endfor'))
+
+    def test_fold_constants(self):
+        """test the constant expressions are folded"""
+        self.trans.fold = True
+        self.trans.parse(StringIO("#define PAGE_SIZE 10 * 2\n"
+                                  "#define MAX_PAGES (PAGE + 1)\n"
+                                  "#define NAME 'a' 'b''c'\n"
+                                  "#define f(a, b) $a * $b\n"
+                                  "SELECT $NAME LIMIT $PAGE_SIZE * $f(2, 0.5) + 1;\n"
+                                  "SELECT $f(2, x), f($PAGE_SIZE - 1), '$PAGE_SIZE + 1', 1 + $PAGE_SIZE DIV 2;\n"
+                                  "SELECT ($PAGE_SIZE * 2), x - $PAGE_SIZE + 1, $PAGE_SIZE * 9223372036854775807;\n"))
+        self.assertEqual("10 * 2", self.trans.variables["PAGE_SIZE"])
+        self.assertEqual("(PAGE + 1)", self.trans.variables["MAX_PAGES"])
+        self.assertEqual("'a' 'b''c'", self.trans.variables["NAME"])
+        self.assertEqual("SELECT 'ab''c' LIMIT 21.0;\n"
+                         "SELECT 2 * x, f(19), '10 * 2 + 1', 1 + 10 * 2 DIV 2;\n"
+                         "SELECT (40), x - 10 * 2 + 1, 10 * 2 * 9223372036854775807;\n",
+                         self.output.getvalue().split('\n', 3)[-1])
+
+    def test_fold_constants_textual(self):
+        """test the folded value is same as the result of textual substitution"""
+        self.trans.fold = True
+        self.trans.parse(StringIO("#define D 2020-01-01\n"
+                                  "#define X 1 + 2\n"
+                                  "#define F(a) $a+1\n"
+                                  "SELECT '$D', $X * 2, $F(2) * 3, x * $X, 2 * ($X); -- $X * 2\n"))
+        self.assertEqual("2020-01-01", self.trans.variables["D"])
+        self.assertEqual("-- CONSTANT D 2020-01-01\n-- CONSTANT X 1 + 2\n"
+                         "SELECT '2020-01-01', 5, 5, x * 1 + 2, 6; -- 1 + 2 * 2\n",
+                         self.output.getvalue())
+
+    def test_fold_disabled(self):
+        """test the constant expressions are not folded by default, the division is never folded"""
+        source = "#define N 42\n#define PAGE ($N / 2)\nSELECT $N * 1.5 LIMIT $PAGE;\n"
+        self.trans.parse(StringIO(source))
+        self.assertEqual("SELECT 42 * 1.5 LIMIT (42 / 2);\n", self.output.getvalue().split('\n', 2)[-1])
+        self.assertFalse(translator.parse_arguments(["a.sql"]).fold)
+        self.assertTrue(translator.parse_arguments(["a.sql", "--fold"]).fold)
+        self.assertEqual("SELECT 63.0 LIMIT (42 / 2);\n",
+                         translator.translate("a.sql", DictLoader({"a.sql": source}), fold=True).split('\n', 2)[-1])
+
+    def test_unused(self):
+        """test the macros, that are never expanded, are reported"""
+        self.trans.parse(StringIO("#define PUBLIC 1\n"
+                                  "#define _PRIVATE 2\n"
+                                  "#define _FLAG 1\n"
+                                  "#define _ARG 3\n"
+                                  "#define _USED 4\n"
+                                  "#define f(a) $a\n"
+                                  "#define g(a) $a\n"
+                                  "#if _FLAG == '1'\n"
+                                  "SELECT $g($_ARG), $_USED;\n"
+                                  "#endif\n"))
+        self.assertEqual(["_PRIVATE", "f"], self.trans.unused())
+
     def test_global_defines(self):
         """test external defines"""
         self.trans.variables["DB_NAME"] = "test"
@@ -233,3 +325,667 @@ $f2(1, t);"""
         self.assertEqual(0, len(macros.body))
         self.output.seek(0)
         self.assertEqual('', self.output.read())
+
+
+_ENGINES_CORPUS = [
+    '#DEFINE a "1" ',
+    '#DEFINE b `12%&89qa@`',
+    "#DEFINE d '*'",
+    'select $var1; select $var1;',
+    '#DEFINE f1(a) select * \\ \nfrom $a',
+    '#define f1(a) select * from $a\n$f1(b);\n#undef f1',
+    '#define _v 1\nselect $_v from a;\n#undef _v',
+    '#undef v\n',
+    '#DEFINE f1(a) select * \\ \nfrom $a\n$f1(`table1`);',
+    '#DEFINE f2(a,b) select * \\ \nfrom $a\n$f2(`table1`);',
+    '#DEFINE v 1\n#DEFINE f(a) select $a\n$f($v);',
+    '#define var4 1\n#if var4 == 0\nselect $var4 from t1;\n#define var5 2\n#include "./var1.sql"\n#else\n'
+    'select $var4 from t2;\n#endif',
+    "#if defined('VAR')\nselect TRUE\n#else\nselect FALSE\n#endif\n",
+    '#define var4 1\n#define var4 2\n',
+    '#define f(a) 1\n#define f(a) 2\n',
+    'use `$DB_NAME`;',
+    '#define _G a\n#define _K $_G\n#define f1(t, g) $t WHERE $g\n#define f2(v, t) SELECT $v FROM $f1($t, $_K)\n$f2(1, t);',
+    '#DEFINE f1(a)\n$f1(1)\n',
+    # the corner cases
+    '# define a 1\n #define b 2\nselect $a, $ b, $$a, $a.b;\n\tselect $a, $b;\n',
+    '#define f (a, b) x $a\n#define g(a)x\n#define X (1+2)\nselect $X, $f (1, 2), $f(a,,b);\nselect $f(\t1, 2);\n',
+    '#define f(a, b) [$a|$b]\n$f(MAX(x), "a b") $f(\'c\', d e) $f(CONCAT(a, f(b)), "a""b") $f() $f(a)(b)\n',
+    '#define f(a) <$a>\n$f((a))\n',
+    '#define q(a) <$a>\n$q(a\n',
+    '#if 1\n#if 0\nselect 1;\n#else\nselect 2;\n#endif\nselect 3;\n#else\nselect 4;\n#endif\nselect 5;\n',
+    '#if 0\n#define a 1\n#include "x.sql"\nselect $a;\n#else  \nselect 2;\n#endif\n',
+    '#if 0\nselect 1;\n#else x\nselect 2;\n#endif\nselect 3;\n',
+    '#ifdef x\n#endif\n',
+    '#define a 1\r\n#else\r\nselect $a\r\n',
+    '#if\n',
+    '#endif\n',
+    '#undef $a\n#undefine a\n#define\n',
+    "#include 'x.sql' $a\n",
+    '$a \\\n\n$b\n',
+    'END$$ $ \n',
+    '#define N 2\n#for i in range($N)\n#foreach x in (a, "b c", $N)\nselect $x, $i;\n#endfor\n#if i == "1"\nselect 1;\n'
+    '#endif\n#endfor\nselect $i;\n',
+    '#if 0\n#for i in range(2)\nselect $i;\n#else\nselect 2;\n#endfor\n#endif\n',
+    '#FOREACH x IN ()\nselect $x;\n#ENDFOR\n#for x in range(a)\n#endfor\n',
+    '#for i in\n#endfor\n#for i in range(1)\n',
+    '#endfor\n',
+    '#define N 2\n#define M $N * (3 - 1.5)\n#define f(a) $a + $N\nselect $N * $M + 1, -$f(1) * 2, ($N), x - $N + 1;\n'
+    'select \'$N + 1\', $N * 2 -- $N + 1\n',
+]
+
+
+class TestEngines(TestCase):
+    """the differential test, the fast engine should produce same results as the pyparsing engine"""
+
+    @staticmethod
+    def _translate(engine, source, fold=False):
+        output = StringIO()
+        trans = translator.Translator(output, engine=engine, fold=fold)
+        trans.variables["var1"] = "`12%&89qa@`"
+        trans.variables["DB_NAME"] = "test"
+        with catch_warnings(record=True) as log:
+            simplefilter("always")
+            with mock.patch('builtins.open', lambda f, *args, **kwargs: _open_mock(f)):
+                with mock.patch('os.listdir', _listdir_mock):
+                    try:
+                        if source in _TEST_FILES:
+                            trans.compile(source)
+                        else:
+                            trans.parse(StringIO(source))
+                        error = None
+                    except Exception as e:
+                        error = (type(e), str(e))
+
+        return (
+            output.getvalue(),
+            error,
+            [str(x.message) for x in log],
+            trans.variables,
+            {k: (list(v.args), v.body) for k, v in trans.functions.items()},
+            trans.conditions_stack,
+            trans.suppress
+        )
+
+    def test_engines(self):
+        """test the fast engine produces exactly the same results as the pyparsing engine"""
+        for source in _ENGINES_CORPUS + sorted(_TEST_FILES):
+            for fold in (False, True):
+                self.assertEqual(self._translate("pyparsing", source, fold), self._translate("fast", source, fold),
+                                 source)
+
+    def test_unknown_engine(self):
+        """test the unknown engine is rejected"""
+        self.assertRaisesRegex(ValueError, "unknown engine", translator.Translator, StringIO(), engine="unknown")
+        self.assertEqual("pyparsing", translator.parse_arguments(["test.sql"]).engine)
+        self.assertEqual("fast", translator.parse_arguments(["test.sql", "--engine", "fast"]).engine)
+
+
+class TestLoaders(TestCase):
+    """the sources can be loaded without the file system"""
+
+    def _check(self, loader):
+        self.assertEqual(_EXPECTED, translator.translate("main.sql", loader).strip())
+        self.assertEqual(_EXPECTED, translator.translate("main.sql", loader, cache=Cache()).strip())
+        output = StringIO()
+        self.assertIs(output, translator.translate("glob.sql", loader, output, {"_x": "1"}))
+        self.assertEqual("1 select 2;", output.getvalue().strip())
+        self.assertRaises(FileNotFoundError, translator.translate, "missing.sql", loader)
+        self.assertRaises(FileNotFoundError, translator.translate, "missing/*.sql", loader)
+
+    def test_dict(self):
+        """test the in-memory loader"""
+        self._check(DictLoader(dict(_TEST_FILES, **_GLOB_FILES)))
+
+    def test_zip(self):
+        """test the zip archive loader"""
+        archive = BytesIO()
+        with ZipFile(archive, 'w') as z:
+            for name, content in dict(_TEST_FILES, **_GLOB_FILES).items():
+                z.writestr(name[2:], content)
+        archive.seek(0)
+        self._check(ZipLoader(archive))
+
+    def test_directory(self):
+        """test the directory loader"""
+        with TemporaryDirectory() as root:
+            for name, content in dict(_TEST_FILES, **_GLOB_FILES).items():
+                os.makedirs(os.path.dirname(os.path.join(root, name)), exist_ok=True)
+                with open(os.path.join(root, name), 'w') as stream:
+                    stream.write(content)
+            self._check(DirectoryLoader(root))
+
+
+class TestPrelude(TestCase):
+    """the saved prelude should replace the processing of the prelude files"""
+
+    def test_prelude(self):
+        """test save and load the prelude"""
+        files = dict(_TEST_FILES, **{"./common/func.sql": '#define c 1\n' + _TEST_FILES["./common/func.sql"]})
+        loader = DictLoader(files)
+        prelude = translator.Translator(StringIO(), loader=loader)
+        prelude.compile("common/func.sql")
+        snapshot = BytesIO()
+        prelude.save(snapshot, {}, prelude.output.getvalue())
+
+        snapshot.seek(0)
+        output = StringIO()
+        trans = translator.Translator(output, loader=loader)
+        trans.load(snapshot)
+        self.assertEqual({'./common/func.sql', './common/vars.sql'}, trans.includes)
+        with catch_warnings(record=True) as log:
+            simplefilter("always")
+            trans.compile("main.sql")
+        self.assertEqual([], log)
+        self.assertEqual(translator.translate("main.sql", loader), output.getvalue())
+        self.assertIn("-- CONSTANT c 1", output.getvalue())
+        # the build, that loads the prelude, knows the macros of prelude like the build, that parses it
+        expected = translator.Translator(StringIO(), loader=loader)
+        expected.compile("main.sql")
+        self.assertEqual(expected.defined, trans.defined)
+        self.assertEqual(expected.used, trans.used)
+        self.assertEqual(expected.unused(), trans.unused())
+        self.assertIn("_var4", trans.unused())
+
+        snapshot.seek(0)
+        trans = translator.Translator(StringIO(), loader=loader)
+        trans.variables["a"] = "1"
+        self.assertRaisesRegex(ValueError, "other defines", trans.load, snapshot)
+        snapshot.seek(0)
+        trans = translator.Translator(StringIO(), loader=loader, inline=True)
+        self.assertRaisesRegex(ValueError, "other options", trans.load, snapshot)
+        snapshot.seek(0)
+        loader.files["common/vars.sql"] += "\n"
+        self.assertRaisesRegex(ValueError, "vars.sql was changed", translator.Translator(StringIO(), loader=loader).load,
+                               snapshot)
+        self.assertRaisesRegex(ValueError, "invalid prelude", translator.Translator(StringIO()).load, BytesIO(b"x"))
+        args = translator.parse_arguments(["test.sql", "--prelude", "a.pch", "--save-prelude", "b.pch"])
+        self.assertEqual(("a.pch", "b.pch"), (args.prelude, args.save_prelude))
+
+    def test_save_prelude_output(self):
+        """test the output is written to the standard output, when only the prelude is saved"""
+        with TemporaryDirectory() as workdir:
+            source, prelude = os.path.join(workdir, "a.sql"), os.path.join(workdir, "a.pch")
+            with open(source, "w") as stream:
+                stream.write("#define N 1\nSELECT $N;\n")
+            args = translator.parse_arguments([source, "--save-prelude", prelude])
+            with mock.patch('sys.stdout', StringIO()) as stdout:
+                translator.build(args, translator.create_translator(args))
+            self.assertEqual("-- CONSTANT N 1\nSELECT 1;\n", stdout.getvalue())
+            self.assertTrue(os.path.exists(prelude))
+
+
+class _BracketTranslator(translator.Translator):
+    """the translator, that changes the expansions of functions"""
+
+    def on_function(self, name, value):
+        super().on_function(name, '[%s]' % value)
+
+
+class TestIncludeCache(TestCase):
+    """the cached includes should produce same results as the regular includes"""
+
+    def setUp(self):
+        self.tempdir = TemporaryDirectory()
+        self.workdir = self.tempdir.name
+        for name, content in _TEST_FILES.items():
+            self._write(name, content)
+        self._write("./glob.sql", '#include "parts/*.sql"\nselect $p1, $p2;\n')
+        self._write("./parts/p1.sql", '#define p1 1\n')
+        self.cache = Cache(os.path.join(self.workdir, '.cache'))
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _write(self, name, content):
+        filename = os.path.join(self.workdir, name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w') as stream:
+            stream.write(content)
+
+    def _compile(self, filename, cache=None, jobs=1, cls=translator.Translator):
+        output = StringIO()
+        trans = cls(output, cache=cache, jobs=jobs)
+        trans.workdir = self.workdir
+        with catch_warnings(record=True) as log:
+            simplefilter("always")
+            trans.compile(filename)
+        return output.getvalue(), [(str(x.message), x.filename, x.lineno) for x in log], trans.variables, \
+            sorted(trans.functions)
+
+    def test_replay(self):
+        """test the unchanged includes are replayed instead of parsing"""
+        for filename in ("main.sql", "recursive.sql", "glob.sql"):
+            expected = self._compile(filename)
+            self.assertEqual(expected, self._compile(filename, self.cache))
+            with mock.patch.object(translator.Translator, 'parse') as parse:
+                self.assertEqual(expected, self._compile(filename, Cache(self.cache.directory)))
+                self.assertFalse(parse.called)
+
+    def test_invalidation(self):
+        """test the changes in the nested includes and directories are detected"""
+        self._compile("main.sql", self.cache)
+        self._write("./common/vars.sql", '#define _var1 "changed"\n#define _var2 t\n#define _var3 1\n')
+        expected = self._compile("main.sql")
+        self.assertIn('select "changed" from t where 1;', expected[0])
+        self.assertEqual(expected, self._compile("main.sql", Cache(self.cache.directory)))
+
+        self._compile("glob.sql", self.cache)
+        self._write("./parts/p2.sql", '#define p2 2\n')
+        os.utime(os.path.join(self.workdir, "parts"), ns=(0, 0))
+        expected = self._compile("glob.sql")
+        self.assertIn('select 1, 2;', expected[0])
+        self.assertEqual(expected, self._compile("glob.sql", Cache(self.cache.directory)))
+
+    def test_error(self):
+        """test the failed include is not cached"""
+        self.assertRaisesRegex(ValueError, "mismatch if/endif", self._compile, "invalid_if.sql", self.cache)
+        self.assertRaisesRegex(ValueError, "mismatch if/endif", self._compile, "invalid_if.sql", self.cache)
+        self.assertEqual('c', translator.parse_arguments(["test.sql", "--cache-dir", "c"]).cache_dir)
+
+    def test_parallel(self):
+        """test the parallel preprocessing produces same results as the sequential one"""
+        self._write("./glob.sql", '#define f(a) <$a>\n#include "parts/*.sql"\nselect $p1, $p2;\n')
+        for i in range(20):
+            self._write("./parts/p%02d.sql" % i, '$f(%d) $f($p1)\n' % i)
+        self._write("./parts/p10.sql", '#define p2 2\n')
+        self._write("./parts/p17.sql", '$undefined\n')
+        expected = self._compile("glob.sql")
+        self.assertEqual(expected, self._compile("glob.sql", jobs=2))
+        self.assertEqual(expected, self._compile("glob.sql", self.cache, jobs=2))
+        self.assertEqual(expected, self._compile("glob.sql", Cache(self.cache.directory), jobs=2))
+        self.assertIn(("Undefined variable: undefined", grammar.__file__), [x[:2] for x in expected[1]])
+        expected = self._compile("glob.sql", cls=_BracketTranslator)
+        self.assertIn("[<0>]", expected[0])
+        self.assertEqual(expected, self._compile("glob.sql", jobs=2, cls=_BracketTranslator))
+        self._write("./parts/p15.sql", '$f()\n')
+        self.assertRaisesRegex(ValueError, "invalid number of parameters", self._compile, "glob.sql", jobs=2)
+        self.assertEqual(4, translator.parse_arguments(["test.sql", "-j", "4"]).jobs)
+
+    def test_watch(self):
+        """test the watcher reparses only the changed files and the files after changed macros"""
+        self._write("./glob.sql", ''.join('#include "parts/p%d.sql"\n' % i for i in range(5)) + 'select $p1;\n')
+        for i in range(5):
+            self._write("./parts/p%d.sql" % i, 'select %d;\n' % i)
+        self._write("./parts/p1.sql", '#define p1 1\n')
+        output = os.path.join(self.workdir, "out.sql")
+        args = translator.parse_arguments([os.path.join(self.workdir, "glob.sql"), output, "--watch"])
+        watcher = translator.Watcher(args)
+        messages = []
+
+        def poll(name=None, content=None):
+            if name:
+                self._write(name, content)
+                os.utime(os.path.join(self.workdir, name), ns=(0, 0))
+            with mock.patch.object(translator.Translator, 'parse', autospec=True,
+                                   side_effect=translator.Translator.parse) as parse:
+                with catch_warnings(record=True) as log:
+                    simplefilter('always')
+                    rebuilt = watcher.poll()
+            messages[:] = [str(x.message) for x in log]
+            with open(output) as stream:
+                return rebuilt, parse.call_count, stream.read()
+
+        self.assertEqual((True, 6, 'select 0;\n-- CONSTANT p1 1\nselect 2;\nselect 3;\nselect 4;\nselect 1;\n'), poll())
+        self.assertEqual(False, poll()[0])
+        self.assertEqual((True, 2, 'select 0;\n-- CONSTANT p1 1\nselect 2;\nselect 3;\nselect 5;\nselect 1;\n'),
+                         poll("./parts/p4.sql", 'select 5;\n'))
+        self.assertEqual((True, 5, 'select 0;\n-- CONSTANT p1 2\nselect 2;\nselect 3;\nselect 5;\nselect 2;\n'),
+                         poll("./parts/p1.sql", '#define p1 2\n'))
+        # the failed build does not change the output
+        self.assertEqual((True, 5, 'select 0;\n-- CONSTANT p1 2\nselect 2;\nselect 3;\nselect 5;\nselect 2;\n'),
+                         poll("./parts/p1.sql", '#if 1\n'))
+        self.assertIn("ValueError: mismatch if/endif", messages)
+        self.assertFalse(os.path.exists(output + ".tmp"))
+        self.assertEqual((True, 1, 'select 0;\n-- CONSTANT p1 2\nselect 2;\nselect 3;\nselect 5;\nselect 2;\n'),
+                         poll("./parts/p1.sql", '#define p1 2\n'))
+        self.assertRaises(SystemExit, translator.parse_arguments, ["test.sql", "--watch"])
+
+    def test_watch_failed(self):
+        """test the failed build keeps the output and watches the input, the cache keeps the latest records only"""
+        output = os.path.join(self.workdir, "out.sql")
+        self._write("./main.sql", '#include "part.sql"\n#if 1\n')
+        self._write("./part.sql", 'select 1;\n')
+        self._write("./out.sql", 'select 0;\n')
+        watcher = translator.Watcher(translator.parse_arguments([os.path.join(self.workdir, "main.sql"), output,
+                                                                 "--watch"]))
+
+        stamps = iter(range(100))
+
+        def poll(name=None, content=None):
+            if name:
+                self._write(name, content)
+                stamp = next(stamps)
+                os.utime(os.path.join(self.workdir, name), ns=(stamp, stamp))
+            with catch_warnings(record=True) as log:
+                simplefilter('always')
+                rebuilt = watcher.poll()
+            with open(output) as stream:
+                return rebuilt, stream.read(), [str(x.message) for x in log if x.category is not DeprecationWarning]
+
+        self.assertEqual((True, 'select 0;\n', ["ValueError: mismatch if/endif"]), poll())
+        self.assertIn(os.path.join(self.workdir, "main.sql"), watcher.stats)
+        self.assertEqual((False, 'select 0;\n', []), poll())
+        self.assertEqual((True, 'select 1;\n', []), poll("./main.sql", '#include "part.sql"\n'))
+        size = len(watcher.cache.memory)
+        for i in range(2, 5):
+            self.assertEqual((True, 'select %d;\n' % i, []), poll("./part.sql", 'select %d;\n' % i))
+            self.assertEqual(size, len(watcher.cache.memory))
+
+    def test_watch_prelude(self):
+        """test the watcher rebuilds the output, when the prelude or the files included by it are changed"""
+        prelude, output = os.path.join(self.workdir, "p.pch"), os.path.join(self.workdir, "out.sql")
+        self._write("./prelude.sql", '#include "parts/p1.sql"\n')
+        self._write("./parts/p1.sql", '#define p1 1\n')
+        self._write("./main.sql", 'select $p1;\n')
+
+        def save_prelude(mtime):
+            args = translator.parse_arguments([os.path.join(self.workdir, "prelude.sql"), "--save-prelude", prelude])
+            with mock.patch('sys.stdout', StringIO()):
+                translator.build(args, translator.create_translator(args))
+            os.utime(prelude, ns=(mtime, mtime))
+
+        def poll():
+            with mock.patch('sys.stderr', StringIO()) as stderr:
+                rebuilt = watcher.poll()
+            with open(output) as stream:
+                return rebuilt, stream.read(), stderr.getvalue()
+
+        save_prelude(0)
+        args = translator.parse_arguments([os.path.join(self.workdir, "main.sql"), output, "--watch",
+                                           "--prelude", prelude])
+        watcher = translator.Watcher(args)
+        self.assertEqual((True, '-- CONSTANT p1 1\nselect 1;\n', ''), poll())
+        self.assertIn(prelude, watcher.stats)
+        self.assertIn(os.path.join(self.workdir, "parts/p1.sql"), watcher.stats)
+        self.assertEqual(False, poll()[0])
+
+        self._write("./parts/p1.sql", '#define p1 2\n')
+        os.utime(os.path.join(self.workdir, "parts/p1.sql"), ns=(0, 0))
+        rebuilt, _, error = poll()
+        self.assertTrue(rebuilt)
+        self.assertRegex(error, "the prelude is out of date")
+        self.assertEqual(False, poll()[0])
+        save_prelude(1)
+        self.assertEqual((True, '-- CONSTANT p1 2\nselect 2;\n', ''), poll())
+
+
+_VARIANT_FILES = {
+    "./main.sql": """\
+#define _t tbl_$SHARD
+#define f(a) select $a from $_t
+#include "parts/*.sql"
+#if ENV == "prod"
+#define g(a) $a
+#include "prod.sql"
+#else
+#define g(a) -$a
+#endif
+$g(1) $f($ENV) $f(x);
+""",
+    "./parts/p1.sql": "select $SHARD, $f(1);\n#undef _t\n",
+    "./parts/p2.sql": "#if defined('SHARD')\n#define _t other\n#endif\nselect $_t;\n",
+    "./prod.sql": "#include \"parts/p1.sql\"\nselect $ENV;\n",
+    "./parts/p3.sql": "select $SHARD * 2 + 1;\n",
+}
+
+
+class TestVariants(TestCase):
+    """the variants should produce same results as the separate builds"""
+
+    def test_variants(self):
+        """test the variant builds"""
+        loader = DictLoader(_VARIANT_FILES)
+        variants = [{"ENV": e, "SHARD": s} for e in ("dev", "prod") for s in ("1", "2")] + [{"ENV": "dev"}]
+        for fold in (False, True):
+            expected = list()
+            with catch_warnings(record=True) as log:
+                simplefilter("always")
+                for v in variants:
+                    expected.append(translator.translate("main.sql", loader, defines=v, fold=fold))
+            messages = set(str(x.message) for x in log)
+
+            outputs = [StringIO() for _ in variants]
+            trans = translator.VariantTranslator(outputs, variants, loader=loader, fold=fold)
+            with catch_warnings(record=True) as log:
+                simplefilter("always")
+                trans.compile("main.sql")
+            self.assertEqual(expected, [x.getvalue() for x in outputs])
+            self.assertEqual(messages, set(str(x.message) for x in log))
+        self.assertIn("select 3;", expected[0])
+        self.assertRaisesRegex(ValueError, "depends on the matrix names",
+                               translator.VariantTranslator([StringIO(), StringIO()], [{"N": "1"}, {"N": "2"}],
+                                                            loader=DictLoader({"a.sql": "#for i in range($N)\n#endfor\n"})).compile,
+                               "a.sql")
+        self.assertRaisesRegex(ValueError, "expected 2 variants", translator.VariantTranslator, outputs[:2], variants)
+
+    def test_matrix(self):
+        """test the matrix arguments"""
+        args = translator.parse_arguments(["a.sql", "{ENV}-{SHARD}.sql", "-m", "ENV:dev,prod", "-m", "SHARD:1,2"])
+        self.assertEqual(["dev-1.sql", "dev-2.sql", "prod-1.sql", "prod-2.sql"], translator.get_targets(args))
+        self.assertEqual({"ENV": "prod", "SHARD": "1"}, translator.get_variants(args)[2])
+        with mock.patch('sys.stderr', StringIO()):
+            self.assertRaises(SystemExit, translator.parse_arguments, ["a.sql", "{ENV}.sql", "-m", "ENV:1", "-m", "X:1,2"])
+            self.assertRaises(SystemExit, translator.parse_arguments, ["a.sql", "{Y}.sql", "-m", "ENV:1"])
+            self.assertRaises(SystemExit, translator.parse_arguments, ["a.sql", "{ENV}.sql", "-m", "ENV"])
+
+
+_INLINE_SOURCE = """\
+DELIMITER $$
+#inline
+CREATE PROCEDURE `acc.__check` (IN `login` VARCHAR(255), OUT found BOOLEAN)
+leave_proc: BEGIN
+  SELECT COUNT(*) INTO @n FROM accounts WHERE accounts.login = login;
+  IF @n = 0 THEN
+    CALL __throw('NotFound', 'CALL acc.__check(a, b);');
+    LEAVE leave_proc;
+  END IF;
+  SET found = TRUE;
+END$$
+CREATE PROCEDURE `acc.__touch` ()
+BEGIN
+  UPDATE accounts SET ts = NOW();
+END$$
+CREATE PROCEDURE `acc.get` (login VARCHAR(255))
+BEGIN
+  DECLARE f BOOLEAN;
+  CALL acc.__check(CONCAT(login, ','), f);
+  CALL acc.__touch();
+  SELECT a FROM accounts WHERE accounts.login = login; -- > object
+END$$
+DELIMITER ;
+"""
+
+
+class TestInline(TestCase):
+    @staticmethod
+    def _metadata(text):
+        tokenizer = grammar.SQLTokenizer()
+        tokenizer.parse(text)
+        return [(p.name, p.children, tokenizer.errors(p), tokenizer.returns(p), tokenizer.queries(p),
+                 tokenizer.is_read_only(p)) for p in tokenizer.procedures()]
+
+    def test_inline(self):
+        """test the calls of marked procedures are replaced by their bodies"""
+        self.assertNotIn(inliner.MARKER, translator.translate("a.sql", DictLoader({"a.sql": _INLINE_SOURCE})))
+        source = translator.translate("a.sql", DictLoader({"a.sql": _INLINE_SOURCE}), inline=True)
+        self.assertIn(inliner.MARKER, source)
+        output = inliner.inline(source)
+        self.assertNotIn(inliner.MARKER, output)
+        self.assertNotIn("CALL acc.__check(CONCAT", output)
+        self.assertEqual(2, output.count("CALL __throw('NotFound', 'CALL acc.__check(a, b);');"))
+        self.assertIn("    DECLARE __inline1_login VARCHAR(255) DEFAULT CONCAT(login, ',');\n"
+                      "    DECLARE __inline1_found BOOLEAN;\n"
+                      "    BEGIN\n"
+                      "      DECLARE login VARCHAR(255) DEFAULT __inline1_login;\n"
+                      "      DECLARE found BOOLEAN;\n"
+                      "      __inline1: BEGIN\n", output)
+        self.assertIn("        LEAVE __inline1;\n", output)
+        self.assertIn("      SET __inline1_found = found;\n    END;\n    SET f = __inline1_found;\n", output)
+        self.assertIn("CALL acc.__touch();", output)
+        self.assertNotIn("CALL acc.__touch();", inliner.inline(source, 1))
+        self.assertEqual(self._metadata(source), self._metadata(output))
+        self.assertEqual(self._metadata(source), self._metadata(inliner.inline(source, 1)))
+
+    def test_inline_cache(self):
+        """test the cached includes keep the inline marker, only if the inlining is requested"""
+        cache, loader = Cache(), DictLoader({"a.sql": '#include "b.sql"\n', "b.sql": _INLINE_SOURCE})
+        self.assertNotIn(inliner.MARKER, translator.translate("a.sql", loader, cache=cache))
+        self.assertIn(inliner.MARKER, translator.translate("a.sql", loader, cache=cache, inline=True))
+        self.assertNotIn(inliner.MARKER, translator.translate("a.sql", loader, cache=cache))
+
+    def test_arguments(self):
+        """test the inline command line argument"""
+        self.assertFalse(translator.parse_arguments(["a.sql"]).inline)
+        self.assertTrue(translator.parse_arguments(["a.sql", "--inline"]).inline)
+        args = translator.parse_arguments(["--inline", "a.sql", "b.sql"])
+        self.assertEqual((True, ["a.sql"], "b.sql", None), (args.inline, args.input, args.output, args.inline_max))
+        self.assertEqual(3, translator.parse_arguments(["a.sql", "--inline", "--inline-max", "3"]).inline_max)
+        with mock.patch('sys.stderr', StringIO()):
+            self.assertRaises(SystemExit, translator.parse_arguments, ["a.sql", "--inline-max", "3"])
+            self.assertRaises(SystemExit, translator.parse_arguments, ["a.sql", "{A}.sql", "-m", "A:1", "--inline"])
+
+
+class TestShake(TestCase):
+    def test_shake(self):
+        """test the unreachable internal procedures are removed"""
+        source = translator.translate("a.sql", DictLoader({"a.sql": _INLINE_SOURCE + """\
+DELIMITER $$
+DROP PROCEDURE IF EXISTS `__unused`$$
+CREATE PROCEDURE `__unused` ()
+BEGIN
+  CALL acc.__touch();
+END$$
+CREATE PROCEDURE `__dynamic` ()
+BEGIN
+END$$
+DELIMITER ;
+SET @p = '__dynamic';
+"""}), inline=True)
+        output = shaker.shake(source)
+        self.assertNotIn("CREATE PROCEDURE `__unused`", output)
+        self.assertIn("DROP PROCEDURE IF EXISTS `__unused`$$\nCREATE PROCEDURE `__dynamic`", output)
+        self.assertIn("CREATE PROCEDURE `acc.__check`", output)
+        self.assertIn("CREATE PROCEDURE `acc.__touch`", output)
+        self.assertEqual({"acc.get", "acc.__check", "acc.__touch", "__dynamic"}, shaker.reachable(source))
+        self.assertEqual(TestInline._metadata(source)[1:3], TestInline._metadata(output)[1:3])
+        inlined = inliner.inline(source, 1)
+        self.assertEqual(TestInline._metadata(inlined)[1:3], TestInline._metadata(shaker.shake(inlined))[1:3])
+
+    def test_arguments(self):
+        """test the shake command line arguments"""
+        self.assertFalse(translator.parse_arguments(["a.sql"]).shake)
+        self.assertTrue(translator.parse_arguments(["a.sql", "--shake", "--unused"]).unused)
+        with mock.patch('sys.stderr', StringIO()):
+            self.assertRaises(SystemExit, translator.parse_arguments, ["a.sql", "{A}.sql", "-m", "A:1", "--shake"])
+
+
+class TestStream(TestCase):
+    def test_arguments(self):
+        """test the stream command line argument"""
+        self.assertTrue(translator.parse_arguments(["a.sql", "b.sql", "--stream"]).stream)
+        with mock.patch('sys.stderr', StringIO()):
+            for option in (["--minify"], ["--inline"], ["--cache-dir", "c"], ["--save-prelude", "a.pch"]):
+                self.assertRaises(SystemExit, translator.parse_arguments, ["a.sql", "b.sql", "--stream"] + option)
+
+    def test_stream(self):
+        """test the output is written through the large buffer"""
+        with TemporaryDirectory() as workdir:
+            source, output = os.path.join(workdir, "a.sql"), os.path.join(workdir, "b.sql")
+            with open(source, "w") as stream:
+                stream.write("#define N 1\n" + "INSERT INTO t VALUES ($N);\n" * 100)
+            args = translator.parse_arguments([source, output, "--stream"])
+            with mock.patch('builtins.open', wraps=open) as opener:
+                builder = translator.create_translator(args)
+            opener.assert_called_once_with(output, 'w', buffering=translator.STREAM_BUFFER_SIZE)
+            translator.build(args, builder)
+            with open(output) as stream:
+                self.assertEqual("-- CONSTANT N 1\n" + "INSERT INTO t VALUES (1);\n" * 100, stream.read())
+
+
+class TestProfile(TestCase):
+    def test_profile(self):
+        """test the profile of grammar is written after the build"""
+        with TemporaryDirectory() as workdir:
+            source, output = os.path.join(workdir, "a.sql"), os.path.join(workdir, "b.sql")
+            with open(source, "w") as stream:
+                stream.write("#define F(x) $x + 1\nSELECT $F(2);\n")
+            args = translator.parse_arguments([source, output, "--engine", "pyparsing", "--profile"])
+            with mock.patch('sys.stderr', StringIO()) as stderr:
+                translator.build(args, translator.create_translator(args))
+            self.assertRegex(stderr.getvalue(), r"\nEXPAND_FUNC +\d+ +1 ")
+            self.assertIsNone(grammar.GrammarProfile.active)
+            with open(output) as stream:
+                self.assertEqual("SELECT 2 + 1;\n", stream.read())
+
+    def test_arguments(self):
+        """test the profile command line arguments"""
+        self.assertIsNone(translator.parse_arguments(["a.sql"]).profile)
+        self.assertEqual("-", translator.parse_arguments(["a.sql", "--profile"]).profile)
+        self.assertEqual("p.json", translator.parse_arguments(["a.sql", "--profile-json", "p.json"]).profile)
+        with mock.patch('sys.stderr', StringIO()):
+            self.assertRaises(SystemExit, translator.parse_arguments, ["a.sql", "--profile", "-j", "2"])
+
+class TestMinify(TestCase):
+    def test_minify(self):
+        """test the comments and the whitespaces are removed, the codegen metadata is kept"""
+        source = """\
+-- the accounts
+DELIMITER $$
+-- CONSTANT LIMIT 10
+  -- CONSTANT INDENTED 1
+CREATE PROCEDURE `acc.get` (login VARCHAR(255), -- the login
+                            n DECIMAL(10,  2))
+BEGIN
+  /* the account */
+  SELECT   COUNT(  a ), 'a  -- b
+  c' FROM accounts; -- > array
+
+  # the comment
+  SELECT a FROM accounts; /* the comment */
+  -- > object
+  /*! SET @a = 1 */;
+END$$
+DELIMITER ;
+"""
+        output = minifier.minify(source)
+        self.assertEqual("DELIMITER $$\n"
+                         "-- CONSTANT LIMIT 10\n"
+                         " -- CONSTANT INDENTED 1\n"
+                         "CREATE PROCEDURE `acc.get` (login VARCHAR(255), -- the login\n"
+                         "                            n DECIMAL(10,  2))\n"
+                         "BEGIN\n"
+                         "SELECT COUNT(  a ), 'a  -- b\n"
+                         "  c' FROM accounts; -- > array\n"
+                         "SELECT a FROM accounts; /* the comment */\n"
+                         "-- > object\n"
+                         "/*! SET @a = 1 */;\n"
+                         "END$$\n"
+                         "DELIMITER ;\n", output)
+        self.assertEqual(repr(TestInline._metadata(source)), repr(TestInline._metadata(output)))
+        with open(os.path.join(os.path.dirname(__file__), "test.sql")) as stream:
+            source = stream.read()
+        output = minifier.minify(source)
+        self.assertLess(len(output), len(source))
+        self.assertEqual(repr(TestInline._metadata(source)), repr(TestInline._metadata(output)))
+
+    def test_minify_keyword_comment(self):
+        """test the comment is kept, when the keyword after the identifier characters begins the statement in it"""
+        for comment in ("-- xcall b.c", "# _select", "/* xselect */"):
+            source = "DELIMITER $$\nCREATE PROCEDURE p.x()\nBEGIN\n  SELECT a FROM t;\n  %s\n  (1);\nEND$$\n" % comment
+            output = minifier.minify(source)
+            self.assertIn(comment, output)
+            self.assertEqual(repr(self._model(source)), repr(self._model(output)))
+
+    @staticmethod
+    def _model(text):
+        tokenizer = grammar.SQLTokenizer()
+        tokenizer.parse(text)
+        return [(p.name, p.children, p.queries, p.returns) for p in tokenizer.procedures()]
+
+    def test_arguments(self):
+        """test the minify command line argument"""
+        self.assertFalse(translator.parse_arguments(["a.sql"]).minify)
+        self.assertTrue(translator.parse_arguments(["a.sql", "--minify"]).minify)
+        with mock.patch('sys.stderr', StringIO()):
+            self.assertRaises(SystemExit, translator.parse_arguments, ["a.sql", "{A}.sql", "-m", "A:1", "--minify"])
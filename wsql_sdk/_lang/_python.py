@@ -26,6 +26,12 @@ include_for_union = "from wsql.converters import ObjectDict"
 
 include_local_exceptions = "\nfrom . import exceptions"""
 
+includes_for_registry = """
+from collections import namedtuple, OrderedDict
+from types import MappingProxyType
+
+Procedure = namedtuple('Procedure', ('read_tables', 'written_tables', 'read_only', 'columns'))"""
+
 
 def doc_open():
     """start doc-string"""
@@ -148,3 +154,26 @@ class {0}(set):
     @property
     def value(self):
         return self.__value""".format(name, ", ".join(map(repr, fields)))
+
+
+def _frozenset(values):
+    """format the frozen set of the sorted values"""
+    if values:
+        return 'frozenset({0!r})'.format(tuple(values))
+    return 'frozenset()'
+
+
+def registry_open():
+    """open the registry of procedures"""
+    return "PROCEDURES = MappingProxyType(OrderedDict(("
+
+
+def registry_item(name, read_tables, written_tables, read_only, columns):
+    """the entry of registry of procedures"""
+    return "    ({0!r}, Procedure({1}, {2}, {3!r}, {4!r})),".format(
+        name, _frozenset(read_tables), _frozenset(written_tables), read_only, tuple(columns))
+
+
+def registry_close():
+    """close the registry of procedures"""
+    return ")))"
@@ -0,0 +1,93 @@
+"""
+This file is part of WSQL-SDK
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__author__ = "@bg"
+
+import hashlib
+import os
+import pickle
+import tempfile
+
+
+class Cache:
+    """The key-value storage, that keeps values in memory and optionally in the directory"""
+
+    # the format version, change it to invalidate the stored entries
+    version = 6
+
+    def __init__(self, directory=None):
+        """constructor"""
+        self.directory = directory
+        self.memory = dict()
+        self.touched = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def digest(cls, *parts):
+        """make the stable key from the parts"""
+        return hashlib.sha1(repr((cls.version,) + parts).encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        """get the file name for key"""
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key, default=None):
+        """get the value by key"""
+        if self.touched is not None:
+            self.touched.add(key)
+        if key in self.memory:
+            return self.memory[key]
+        if not self.directory:
+            return default
+        try:
+            with open(self._path(key), 'rb') as stream:
+                value = pickle.load(stream)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return default
+        self.memory[key] = value
+        return value
+
+    def put(self, key, value):
+        """store the value by key"""
+        self.memory[key] = value
+        if self.touched is not None:
+            self.touched.add(key)
+        if not self.directory:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as stream:
+                pickle.dump(value, stream, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+
+    def clear(self):
+        """forget the in-memory values"""
+        self.memory.clear()
+
+    def track(self):
+        """start to record the keys, that are used, see evict"""
+        self.touched = set()
+
+    def evict(self):
+        """forget the in-memory values, that are not used since track"""
+        if self.touched is not None:
+            self.memory = {k: v for k, v in self.memory.items() if k in self.touched}
+            self.touched = None
@@ -0,0 +1,295 @@
+"""
+This file is part of WSQL-SDK
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__author__ = "@bg"
+
+from collections import defaultdict
+from itertools import count
+
+
+class CallGraph:
+    """
+    The graph of procedure calls, the procedures are visited once in the topological order,
+    so the closures of children are ready before the parent.
+    The errors and the read-only flags are computed for all procedures, the queries and the returns are
+    computed on request, because their lists grow with the number of paths, and each of them is computed once.
+    The tables are computed on request too, because only the registry of codegen requires them.
+    The recursive procedures share the errors, the read-only flag and the tables,
+    but their queries and returns are not finite, so they cannot be requested.
+    After the procedures are changed, only the closures of changed procedures and of their callers are computed again.
+    """
+
+    def __init__(self, procedures):
+        """
+        constructor
+        :param procedures: the dict of procedures by name
+        """
+        self.procedures = procedures
+        # the list of cycles, each cycle is the list of names, that starts and ends with the same procedure
+        self.cycles = list()
+        self._errors = dict()
+        self._read_only = dict()
+        self._tables = dict()
+        self._queries = dict()
+        self._returns = dict()
+        # the topological order of procedures, that have the finite queries and returns
+        self._order = dict()
+        self._counter = count()
+        # the reason why the closure of procedure is not available
+        self._problems = dict()
+        # the children of procedures, when the closures were computed, and the reverse edges
+        self._children = dict()
+        self._callers = defaultdict(set)
+        for name, procedure in procedures.items():
+            self._link(name, procedure.children)
+        self._build(self.procedures)
+
+    def _link(self, name, children):
+        """add the edges from the procedure to its children"""
+        self._children[name] = children
+        for child in children:
+            self._callers[child].add(name)
+
+    def _closed(self, name):
+        """check the closure of procedure is computed, it has either errors or problem"""
+        return name in self._errors or name in self._problems
+
+    def update(self, names):
+        """
+        compute the closures of procedures, that are added, changed or removed in the dict of procedures,
+        and of the procedures, that call them, the other closures are kept
+        :param names: the names of changed procedures
+        """
+        names = set(names)
+        affected = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in affected:
+                affected.add(name)
+                pending.extend(self._callers.get(name, ()))
+
+        for name in names:
+            for child in self._children.pop(name, ()):
+                self._callers[child].discard(name)
+            if name in self.procedures:
+                self._link(name, self.procedures[name].children)
+
+        for closures in (self._errors, self._read_only, self._tables, self._queries, self._returns, self._order,
+                         self._problems):
+            for name in affected:
+                closures.pop(name, None)
+        # the procedures of cycle call each other, so all of them are affected
+        self.cycles = [x for x in self.cycles if x[0] not in affected]
+        self._build(sorted(x for x in affected if x in self.procedures))
+
+    def _build(self, roots):
+        """
+        find the strongly connected components by Tarjan, the components are found from the leaves to the roots,
+        the procedures, that have the closures, are not visited
+        """
+        index = dict()
+        low = dict()
+        stack = list()
+        position = dict()
+        for root in roots:
+            if root in index or self._closed(root):
+                continue
+            index[root] = low[root] = len(index)
+            position[root] = len(stack)
+            stack.append(root)
+            path = [(root, iter(self.procedures[root].children))]
+            while path:
+                name, children = path[-1]
+                for child in children:
+                    if child not in self.procedures or self._closed(child):
+                        continue
+                    if child not in index:
+                        index[child] = low[child] = len(index)
+                        position[child] = len(stack)
+                        stack.append(child)
+                        path.append((child, iter(self.procedures[child].children)))
+                        break
+                    if child in low:
+                        low[name] = min(low[name], index[child])
+                else:
+                    path.pop()
+                    if path:
+                        parent = path[-1][0]
+                        low[parent] = min(low[parent], low[name])
+                    if low[name] == index[name]:
+                        component = stack[position[name]:]
+                        del stack[position[name]:]
+                        for x in component:
+                            # the finished procedures are not on the stack
+                            del low[x]
+                        # the order of members depends on the visited procedures, so it is fixed by the names,
+                        # the problems are reported the same way after the update
+                        self._close(sorted(component))
+
+    def _close(self, component):
+        """compute the closures of the strongly connected component, the components of children are ready"""
+        members = set(component)
+        children = [c for x in component for c in self.procedures[x].children if c not in members]
+        problem = next(('The procedure %s calls undefined procedure %s' % (x, c)
+                        for x in component for c in self.procedures[x].children if c not in self.procedures), None)
+        problem = problem or next((self._problems[c] for c in children if c not in self._errors), None)
+        if problem is None:
+            errors = set()
+            for x in component:
+                errors |= self.procedures[x].errors
+            for c in children:
+                errors |= self._errors[c]
+            for x in component:
+                self._errors[x] = errors
+        # the procedure, that modifies data, is not read-only regardless of the unknown procedures
+        if any(self.procedures[x].read_only is False for x in component) or \
+                any(self._read_only.get(c) is False for c in children):
+            read_only = False
+        else:
+            read_only = True if problem is None else None
+        if read_only is not None:
+            for x in component:
+                self._read_only[x] = read_only
+
+        name = component[0]
+        procedure = self.procedures[name]
+        if len(component) > 1 or name in procedure.children:
+            cycle = self._cycle(component)
+            self.cycles.append(cycle)
+            problem = problem or 'The procedure %s has recursive call %s' % (name, ' -> '.join(cycle))
+        else:
+            problem = problem or next((self._problems[c] for c in children if c in self._problems), None)
+            if problem is None:
+                self._order[name] = next(self._counter)
+
+        if problem is not None:
+            for x in component:
+                self._problems[x] = problem
+
+    def _cycle(self, component):
+        """find the path from the first procedure of component to itself"""
+        start = component[0]
+        members = set(component)
+        parents = dict()
+        queue = [start]
+        for name in queue:
+            for child in self.procedures[name].children:
+                if child == start:
+                    path = [start]
+                    while name != start:
+                        path.append(name)
+                        name = parents[name]
+                    path.append(start)
+                    path.reverse()
+                    return path
+                if child in members and child not in parents:
+                    parents[child] = name
+                    queue.append(child)
+
+    def _closure(self, closures, name):
+        """get the closure of procedure or raise the error, if it is not available"""
+        if name not in closures:
+            raise ValueError(self._problems[name])
+        return closures[name]
+
+    def _expand(self, name):
+        """compute the queries and the returns of procedure and of the called procedures, that are not computed yet"""
+        if name in self._returns or name not in self._order:
+            return
+        found = {name}
+        pending = [name]
+        for x in pending:
+            for child in self.procedures[x].children:
+                if child not in found and child not in self._returns:
+                    found.add(child)
+                    pending.append(child)
+        for x in sorted(found, key=self._order.__getitem__):
+            procedure = self.procedures[x]
+            queries = list(procedure.queries)
+            returns = list(procedure.returns)
+            for child in procedure.children:
+                queries.extend(self._queries[child])
+                returns.extend(self._returns[child])
+            self._queries[x] = queries
+            self._returns[x] = returns
+
+    def _collect(self, name):
+        """compute the tables of the component of procedure and of the components, that it calls"""
+        pending = [name]
+        while pending:
+            # the members of component share the set of errors, each of them is reachable from the others
+            errors = self._errors[pending[-1]]
+            component = [pending[-1]]
+            members = set(component)
+            for x in component:
+                for c in self.procedures[x].children:
+                    if c not in members and self._errors[c] is errors:
+                        members.add(c)
+                        component.append(c)
+            children = [c for x in component for c in self.procedures[x].children
+                        if c not in self._tables and c not in members]
+            if children:
+                pending.extend(children)
+                continue
+            pending.pop()
+            if component[0] in self._tables:
+                continue
+            reads, writes = set(), set()
+            for x in component:
+                procedure = self.procedures[x]
+                reads.update(q.table for q in procedure.queries if q.table)
+                writes.update(m.table for m in procedure.modifiers)
+                for c in procedure.children:
+                    if c not in members:
+                        reads |= self._tables[c][0]
+                        writes |= self._tables[c][1]
+            tables = frozenset(reads), frozenset(writes)
+            for x in component:
+                self._tables[x] = tables
+
+    def errors(self, name):
+        """
+        :return: the set of errors, that the procedure and the procedures called from it raise
+        """
+        return set(self._closure(self._errors, name))
+
+    def is_read_only(self, name):
+        """
+        :return: True if neither the procedure nor the procedures called from it modify the data
+        """
+        return self._closure(self._read_only, name)
+
+    def tables(self, name):
+        """
+        :return: the tuple of sets of tables, that the procedure and the procedures called from it read and modify
+        """
+        if name not in self._tables and name in self._errors:
+            self._collect(name)
+        return self._closure(self._tables, name)
+
+    def queries(self, name):
+        """
+        :return: the list of queries of the procedure and the procedures called from it in the call order
+        """
+        self._expand(name)
+        return list(self._closure(self._queries, name))
+
+    def returns(self, name):
+        """
+        :return: the list of results of the procedure and the procedures called from it in the call order
+        """
+        self._expand(name)
+        return list(self._closure(self._returns, name))
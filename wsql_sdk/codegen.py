@@ -15,33 +15,43 @@ SOFTWARE.
 
 __author__ = "@bg"
 
+import codecs
+import mmap
 import os
 import sys
 import warnings
 import itertools
 
 from collections import defaultdict
+from contextlib import contextmanager
 from datetime import datetime
 from functools import reduce
 from importlib import machinery
+from sys import intern
 from textwrap import TextWrapper
+from .cache import Cache
 from .grammar import SQLTokenizer
+from . import depfile, profiling
 
 _THIS_DIR = os.path.dirname(__file__)
+# the size of chunk to read the input in the streaming mode
+CHUNK_SIZE = 1 << 20
 
 
 class Argument:
     """The procedure argument description"""
-    def __init__(self, argument):
-        self.__argument = argument
-        self.brief = 'the ' + ' of '.join(reversed(argument.name.split('_'))) + '({0.type}, {0.direction})'.format(argument)
+    __slots__ = ('direction', 'name', 'type', 'brief')
 
-    def __getattr__(self, item):
-        return getattr(self.__argument, item)
+    def __init__(self, argument):
+        self.direction, self.name, self.type = argument
+        self.brief = intern(
+            'the ' + ' of '.join(reversed(argument.name.split('_'))) + '({0.type}, {0.direction})'.format(argument))
 
 
 class TempTable:
     """The temporary table description"""
+    __slots__ = ('name', 'brief', 'columns')
+
     def __init__(self, temptable):
         self.name = temptable.name
         self.brief = 'list of {' + ','.join('{0.name}({0.type})'.format(x) for x in temptable.columns) + '}'
@@ -49,17 +59,22 @@ class TempTable:
 
 
 class Procedure:
-    """The procedure description"""
-    def __init__(self, module, name, proc, read_only, errors, returns):
+    """The procedure description, it keeps only the values, that are used by the builders"""
+    __slots__ = ('module', 'name', 'fullname', 'read_only', 'errors', 'returns', 'return_mod', 'arguments',
+                 'temptable', 'brief', 'result_columns', 'tables')
+
+    def __init__(self, module, name, proc, read_only, errors, returns, tables=None):
         self.module, self.name = module, name
-        self.__proc = proc
+        self.fullname = proc.name
         self.read_only = read_only
         self.errors = errors
         self.returns = returns
+        # the read and the modified tables, they are required only for the registry
+        self.tables = tables
+        self.return_mod = proc.return_mod
 
         self.arguments = [Argument(x) for x in proc.arguments]
-        if proc.temptable:
-            self.temptable = TempTable(proc.temptable)
+        self.temptable = proc.temptable and TempTable(proc.temptable)
 
         action, *subject = self.name.split('_')
         if subject:
@@ -80,9 +95,9 @@ class Procedure:
                     result.append(kind(tuple(sorted(ret.fields))))
                 else:
                     named.add(ret.name)
-                    result.append(tuple('.'.join((ret.name, x)) for x in sorted(ret.fields)))
+                    result.append(tuple(intern('.'.join((ret.name, x))) for x in sorted(ret.fields)))
 
-            if self.__proc.return_mod == "union":
+            if self.return_mod == "union":
                 columns_set = reduce(lambda x, y: x | set(y), result, set())
                 if len(columns_set) != reduce(lambda x, y: x + len(y), result, 0) or len(columns_set & named) != 0:
                     duplicates = set()
@@ -93,7 +108,7 @@ class Procedure:
                         else:
                             duplicates.add(i)
 
-                    warnings.warn("%s has duplicated fields: %s" % (self.__proc.name, ', '.join(sorted(duplicates))))
+                    warnings.warn("%s has duplicated fields: %s" % (self.fullname, ', '.join(sorted(duplicates))))
                 self.result_columns = tuple(sorted(columns_set))
             else:
                 if len(result) == 1:
@@ -103,18 +118,17 @@ class Procedure:
         else:
             self.result_columns = None
 
-    @property
-    def fullname(self):
-        return self.__proc.name
-
-    def __getattr__(self, item):
-        return getattr(self.__proc, item)
-
 
 class Builder:
     def __init__(self, syntax):
         self.syntax = syntax
         self.stream = None
+        self.outputs = list()
+
+    def _open(self, filename, **kwargs):
+        """open the output file"""
+        self.outputs.append(filename)
+        return open(filename, "w", **kwargs)
 
     def write(self, text, eol="\n"):
         """write text to output stream"""
@@ -181,7 +195,7 @@ class Builder:
 
     def create_api_output(self, path, module, structures, has_union):
         """open new file to write procedures"""
-        self.stream = open(os.path.join(path, module + self.syntax.file_ext), "w")
+        self.stream = self._open(os.path.join(path, module + self.syntax.file_ext))
         self.write(self.syntax.file_header.format(timestamp=datetime.now()))
         self.write(self.syntax.includes_for_api)
         if has_union:
@@ -198,16 +212,36 @@ class Builder:
 
     def create_exceptions_output(self, path):
         """open a new file to write exceptions"""
-        self.stream = open(os.path.join(path, "exceptions" + self.syntax.file_ext), "w", encoding="utf8")
+        self.stream = self._open(os.path.join(path, "exceptions" + self.syntax.file_ext), encoding="utf8")
         self.write(self.syntax.file_header.format(timestamp=datetime.now()))
         self.write(self.syntax.includes_for_exceptions)
         return self
 
     def create_constants_output(self, path):
-        self.stream = open(os.path.join(path, "constants" + self.syntax.file_ext), "w", encoding="utf8")
+        self.stream = self._open(os.path.join(path, "constants" + self.syntax.file_ext), encoding="utf8")
+        self.write(self.syntax.file_header.format(timestamp=datetime.now()))
+        return self
+
+    def create_registry_output(self, path):
+        """open a new file to write the registry of procedures"""
+        self.stream = self._open(os.path.join(path, "registry" + self.syntax.file_ext), encoding="utf8")
         self.write(self.syntax.file_header.format(timestamp=datetime.now()))
+        self.write(self.syntax.includes_for_registry)
         return self
 
+    def write_registry(self, procedures):
+        """write the tables, the read-only flag and the result columns of each procedure, sorted by the name"""
+        self.write("", eol="\n" * self.syntax.break_lines)
+        self.write(self.syntax.registry_open())
+        for procedure in sorted(procedures, key=lambda x: x.fullname):
+            columns = set()
+            for ret in procedure.returns:
+                columns.update('.'.join((ret.name, x)) if ret.name else x for x in ret.fields)
+            read_tables, written_tables = procedure.tables
+            self.write(self.syntax.registry_item(procedure.fullname, sorted(read_tables), sorted(written_tables),
+                                                 procedure.read_only, sorted(columns)))
+        self.write(self.syntax.registry_close())
+
     @staticmethod
     def validate(procedure):
         """validate procedure description"""
@@ -275,6 +309,38 @@ def load_input(source):
         return data
 
 
+@contextmanager
+def map_input(source):
+    """map the input file to memory, the empty files and the files, that cannot be mapped, are read"""
+    with open(source, 'rb') as stream:
+        try:
+            buffer = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            yield stream.read()
+            return
+        with buffer:
+            yield buffer
+
+
+def read_input(source, size=CHUNK_SIZE):
+    """read the input by chunks"""
+    if isinstance(source, str):  # pragma: no cover
+        with open(source, 'r', encoding='utf8') as stream:
+            yield from read_input(stream, size)
+        return
+    decoder = None
+    while True:
+        data = source.read(size)
+        if not data:
+            break
+        if isinstance(data, bytes):
+            decoder = decoder or codecs.getincrementaldecoder('utf8')()
+            data = decoder.decode(data)
+        yield data
+    if decoder is not None:
+        yield decoder.decode(b'', True)
+
+
 def parse_arguments(argv=None):
     from argparse import ArgumentParser
 
@@ -285,19 +351,44 @@ def parse_arguments(argv=None):
     parser.add_argument('-o', '--outdir', help='output dir', default=os.curdir)
     parser.add_argument('-l', '--language', help='the language', choices=available_language, required=True)
     parser.add_argument('--sep', help='the module separator', default='.', choices=['.', '::'])
-    return parser.parse_args(argv)
-
-
-def process(args):
+    parser.add_argument('-j', '--jobs', help='the number of parallel jobs', type=int, default=1)
+    parser.add_argument('--engine', help='the parser engine', choices=SQLTokenizer.engines, default='pyparsing')
+    parser.add_argument('--stream', help='read the input by chunks, the memory does not depend on the input size',
+                        action='store_true')
+    parser.add_argument('--cache-dir', help='the directory to cache the parsed procedures')
+    parser.add_argument('--registry', action='store_true',
+                        help='write the registry of the read and the modified tables, the read-only flags '
+                             'and the result columns of procedures')
+    depfile.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.profile and args.jobs > 1:
+        parser.error('the --profile cannot be used with --jobs, the parallel jobs are not profiled')
+    return args
+
+
+def process(args, cache=None):
     """generate code according to specified parameters"""
 
-    tokenizer = SQLTokenizer()
-    tokenizer.parse(load_input(args.input))
+    if cache is None and getattr(args, 'cache_dir', None):
+        cache = Cache(args.cache_dir)
+    tokenizer = SQLTokenizer(getattr(args, 'engine', 'pyparsing'), cache)
+    jobs = getattr(args, 'jobs', 1)
+    with profiling.profile(args):
+        if getattr(args, 'stream', False):
+            tokenizer.parse_chunks(read_input(args.input), jobs)
+        elif isinstance(args.input, str):
+            # only the procedures, that are parsed, are decoded
+            with map_input(args.input) as buffer:
+                tokenizer.parse_buffer(buffer, jobs, CHUNK_SIZE * jobs)
+        else:
+            tokenizer.parse(load_input(args.input), jobs)
 
     builder = create_builder(args.language)
 
     modules = defaultdict(list)
     module_needs_union = set()
+    registry = getattr(args, 'registry', False)
     for p in tokenizer.procedures():
         module, _, name = p.name.partition(args.sep)
         if len(name) == 0:
@@ -308,8 +399,8 @@ def process(args):
             continue
 
         builder.validate(p)
-        procedure = Procedure(module, name, p, tokenizer.is_read_only(p),
-                              sorted(tokenizer.errors(p)), tokenizer.returns(p))
+        procedure = Procedure(module, name, p, tokenizer.is_read_only(p), sorted(tokenizer.errors(p)),
+                              tokenizer.returns(p), tokenizer.tables(p) if registry else None)
 
         module_name = procedure.module or "__init__"
         modules[module_name].append(procedure)
@@ -317,7 +408,8 @@ def process(args):
             module_needs_union.add(module_name)
 
     count = 0
-    for module_name in modules:
+    # the modules are written in the sorted order, so the outputs of dependencies rule do not depend on dict order
+    for module_name in sorted(modules):
         with builder.create_api_output(
                 args.outdir, module_name, tokenizer.structures(module_name),
                 module_name in module_needs_union):
@@ -337,6 +429,12 @@ def process(args):
             for n, v in sorted(constants):
                 builder.write_constant(n, v)
 
+    if registry:
+        with builder.create_registry_output(args.outdir):
+            builder.write_registry(itertools.chain(*modules.values()))
+
+    if getattr(args, 'depfile', None):
+        depfile.write(args, builder.outputs or [args.outdir], [args.input] if isinstance(args.input, str) else [])
     return count
 
 
@@ -0,0 +1,58 @@
+"""
+This file is part of WSQL-SDK
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__author__ = "@bg"
+
+import os
+
+
+def escape(path):
+    """escape the path for make rule"""
+    path = os.path.normpath(path)
+    for c in ' #':
+        path = path.replace(c, '\\' + c)
+    return path.replace('$', '$$')
+
+
+def format_rule(targets, dependencies, phony=False):
+    """format the make rule, the phony targets for dependencies allow to remove them without errors"""
+    lines = [' '.join(escape(x) for x in targets) + ':']
+    lines.extend(' ' + escape(x) for x in dependencies)
+    rule = ' \\\n'.join(lines) + '\n'
+    if phony:
+        rule += ''.join('\n%s:\n' % escape(x) for x in dependencies)
+    return rule
+
+
+def add_arguments(parser):
+    """add the dependency options to the command line parser"""
+    parser.add_argument('-M', dest='depfile', action='store_const', const='-',
+                        help='write the dependencies rule to the standard output')
+    parser.add_argument('-MF', dest='depfile', help='write the dependencies rule to the file')
+    parser.add_argument('-MT', dest='deptarget', help='the target name of the dependencies rule')
+    parser.add_argument('-MP', dest='phony', action='store_true', help='add the phony target for each dependency')
+
+
+def write(args, targets, dependencies):
+    """write the dependencies rule according to the command line arguments"""
+    if args.deptarget:
+        targets = [args.deptarget]
+    rule = format_rule(targets, dependencies, args.phony)
+    if args.depfile == '-':
+        import sys
+        sys.stdout.write(rule)
+    else:
+        with open(args.depfile, 'w') as stream:
+            stream.write(rule)
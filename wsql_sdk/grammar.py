@@ -15,196 +15,1084 @@ SOFTWARE.
 __author__ = "@bg"
 
 from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from decimal import Decimal, Inexact, localcontext
 from functools import reduce
-from pyparsing import alphanums, CaselessKeyword, Combine, delimitedList, Group, Keyword, Literal, \
-    lineEnd, lineStart, MatchFirst, nestedExpr, nums, oneOf, Optional, Regex, Suppress, Word, \
-    quotedString, SkipTo, Forward, White
+import mmap
+import re
+from string import ascii_letters, digits
+from sys import intern
+import threading
+from time import perf_counter
+from types import SimpleNamespace
 import warnings
+from .callgraph import CallGraph
+
+
+# the begin of procedure, the text may be split before it to parse the parts in parallel
+_PROCEDURE_START = re.compile(r'^[ \t]*CREATE\s+(?:DEFINER\s*=\s*\S+\s+)?PROCEDURE\b', re.IGNORECASE | re.MULTILINE)
+# the same in the utf8 encoded text, it finds the candidates to split, that are checked after decode
+_PROCEDURE_START_BYTES = re.compile(_PROCEDURE_START.pattern.encode(), re.IGNORECASE | re.MULTILINE)
+# the beginnings of expressions of tokenizer, that may continue on the next lines
+_STATEMENT_START = re.compile(r'(?:SELECT|INSERT|UPDATE|DELETE|CALL|DECLARE|CREATE|INLINE)\b', re.IGNORECASE)
+
+# the end of line after the statement, the expressions of tokenizer do not cross it,
+# unless the next line is the hint of select or the comment after statement looks like a statement
+_STATEMENT_END = re.compile(r';[ \t\r]*(?:\n(?=\s*(?!--[ \t]*>)\S)|(?:--[ \t]|#)(?:(?!\$\$|(?:SELECT|INSERT|UPDATE|'
+                            r'DELETE|CALL|CREATE|END|DECLARE|CONSTANT|INLINE)\b)[^\n])*\n)', re.IGNORECASE)
+
+
+# the tokenizer, that parses the text by the pyparsing grammar in the current thread
+_ACTIVE = threading.local()
+_ELEMENTS = None
+_ELEMENTS_LOCK = threading.Lock()
+
+
+def _action(name):
+    """the parse action, that calls the handler of active tokenizer,
+    it accepts all arguments, so pyparsing does not probe its signature on the first call"""
+    def action(s, loc, tokens):
+        return getattr(_ACTIVE.tokenizer, name)(tokens)
+    return action
+
+
+def _name_rules(scope, element_class):
+    """name the elements by the upper case names of variables, the first name of element wins,
+    the elements of pyparsing are not named, because they are shared with other grammars"""
+    for name, value in scope.items():
+        name = name.lstrip('_')
+        if name.isupper() and isinstance(value, element_class) and not hasattr(value, 'rule'):
+            value.rule = name
+
+
+def _collect_rules(roots):
+    """get the named elements, that are reachable from the roots"""
+    rules = []
+    seen = set()
+    pending = list(roots)
+    while pending:
+        expr = pending.pop()
+        if expr is None or isinstance(expr, str) or id(expr) in seen:
+            continue
+        seen.add(id(expr))
+        if hasattr(expr, 'rule'):
+            rules.append(expr)
+        pending.extend(getattr(expr, 'exprs', ()))
+        pending.extend(expr.ignoreExprs)
+        for attribute in ('expr', 'ignoreExpr', 'failOn'):
+            pending.append(getattr(expr, attribute, None))
+    return rules
+
+
+def _build_elements():
+    """build the pyparsing grammar, it is the most of import time, so it is built on the first use"""
+    from pyparsing import alphanums, CaselessKeyword, Combine, delimitedList, Group, Keyword, Literal, \
+        lineEnd, lineStart, nestedExpr, nums, oneOf, Optional, Regex, Suppress, Word, \
+        quotedString, SkipTo, Forward, White, ParseException, ParserElement
+
+    def _sql_identifier(expr):
+        return Suppress(Optional('`')) + expr + Suppress(Optional('`'))
+
+    def _macros(expr):
+        return lineStart + Suppress(Literal("#")) + expr
+
+    def _sql_comment(expr):
+        return lineStart + Suppress(Literal("-- ")) + expr
+
+    def _select_hint(expr):
+        return Suppress(Literal("-- >")) + expr
+
+    # keywords
+    _DEFINE = _macros(CaselessKeyword("define"))
+    _UNDEF = _macros(CaselessKeyword("undef"))
+    _INCLUDE = _macros(CaselessKeyword("include"))
+    _IF = _macros(CaselessKeyword("if"))
+    _ELSE = _macros(CaselessKeyword("else"))
+    _ENDIF = _macros(CaselessKeyword("endif"))
+    _FOR = _macros(CaselessKeyword("foreach") | CaselessKeyword("for"))
+    _ENDFOR = _macros(CaselessKeyword("endfor"))
+    _INLINE = _macros(CaselessKeyword("inline"))
+    _IN = CaselessKeyword("in")
+
+    _AS = CaselessKeyword("AS")
+    _CALL = CaselessKeyword("CALL")
+    _COMMENT = CaselessKeyword("COMMENT")
+    _CREATE = CaselessKeyword("CREATE")
+    _DEFINER = CaselessKeyword("DEFINER")
+    _PROCEDURE = CaselessKeyword("PROCEDURE")
+    _TABLE = CaselessKeyword("TABLE")
+    _INTO = CaselessKeyword("INTO")
+    _FROM = CaselessKeyword("FROM")
+    _ENUM = CaselessKeyword("ENUM")
+    _SET = CaselessKeyword("SET")
+    _SELECT = CaselessKeyword("SELECT").setResultsName("command")
+    _DELETE = CaselessKeyword("DELETE").setResultsName("command")
+    _INSERT = CaselessKeyword("INSERT").setResultsName("command")
+    _UPDATE = CaselessKeyword("UPDATE").setResultsName("command")
+    IF_NOT_EXISTS = Group("IF") + CaselessKeyword("NOT") + CaselessKeyword("EXISTS")
+
+    _THROW = _sql_identifier(Keyword("__throw"))
+    _RETURNS = CaselessKeyword("returns")
+    _SQL_EOL = Literal(";")
+
+    _ID = Word(alphanums + "_.").setResultsName("name")
+    _ID_LIST = delimitedList(_ID, combine=False)
+    _VALUE = (Combine(_ID + Literal("(") + SkipTo(")", include=True)) |
+              Word(alphanums + "$!#%&*+-./:<=>?@[\]^_~`") | quotedString).setResultsName("value")
+    _VALUE_LIST = delimitedList(_VALUE, combine=False)
+
+    _SQL_DIRECTION = oneOf('INOUT IN OUT', caseless=True)
+    _SQL_TYPE = Combine(Word(alphanums + '_') + Optional('(' + delimitedList(Word(nums + ' '), combine=True) + ')'))
+    _SQL_ID = _sql_identifier(_ID)
+    _SQL_ID_LIST = delimitedList(_SQL_ID, combine=False)
+    _SKIP_TO_END = SkipTo(_SQL_EOL)
+    _PARENTHESES_EXPR = Forward()
+    _PARENTHESES_EXPR << Combine("(" + SkipTo(")", ignore=_PARENTHESES_EXPR, include=True))
+    _NESTED_SELECT = Combine("(" + _SELECT + SkipTo(")", include=True, ignore=_PARENTHESES_EXPR))
+    _NESTED_CALL = Combine(_SQL_ID + Literal("(") + SkipTo(Literal(")"), include=True))
+    _SELECT_COLUMN = (_NESTED_SELECT | _NESTED_CALL | _SQL_ID.setResultsName("name")) + \
+        Optional(_AS + _SQL_ID.setResultsName("alias"))
+
+    _TABLE_NAME = _SQL_ID.setResultsName("table")
+    _PROCEDURE_NAME = _sql_identifier(Word(alphanums + "_.:").setResultsName("name")).setResultsName('name')
+
+    _SELECT_COLUMN_LIST = delimitedList(Group(_SELECT_COLUMN), combine=False).setResultsName("columns")
+    _SQL_ARG = Optional(_SQL_DIRECTION, default='IN') + _SQL_ID + _SQL_TYPE
+    _SQL_ARGS = delimitedList(Group(_SQL_ARG), combine=False)
+
+    _RETURN_TYPE = oneOf("object array", caseless=True).setResultsName("type")
+
+    # expressions
+    _DEFINE_FUNCTION = _DEFINE + _ID + nestedExpr(content=_ID_LIST, ignoreExpr=None).setResultsName("args") + \
+        Suppress(White()) + Regex(".*$").setResultsName("body")
+
+    _DEFINE_VAR = _DEFINE + _ID + SkipTo(lineEnd, include=True).setResultsName("value")
+    _UNDEFINE = _UNDEF + _ID
+    _INCLUDE_FILE = _INCLUDE + quotedString.setResultsName("filename")
+    _EXPAND_VAR = Suppress('$') + _ID
+    _EXPAND_FUNC = Suppress('$') + _ID + nestedExpr(content=_VALUE_LIST, ignoreExpr=None).setResultsName("args")
+
+    _IF_EXPR = _IF + SkipTo(lineEnd, include=True).setResultsName("condition")
+    _ELSE_EXPR = _ELSE + lineEnd
+    _ENDIF_EXPR = _ENDIF + lineEnd
+    _FOR_EXPR = _FOR + _ID + Suppress(_IN) + SkipTo(lineEnd, include=True).setResultsName("value")
+    _ENDFOR_EXPR = _ENDFOR + lineEnd
+    _INLINE_EXPR = _INLINE + lineEnd
+
+    _RETURN_HINT_EXPR = _select_hint(Optional(_ID + Suppress(Literal(":"))) + _RETURN_TYPE).setResultsName("hint")
+    _TEMP_TABLE_EXPR = _SQL_ID.setResultsName('table') + \
+        nestedExpr(content=delimitedList(Group(_SQL_ID + _SQL_TYPE)), ignoreExpr=None).setResultsName('columns') +\
+        Suppress(Literal(';'))
+
+    _PROCEDURE_COMMENT_FORMAT = Optional(_TEMP_TABLE_EXPR) + Optional(_RETURNS + oneOf("union", caseless=True).setResultsName("mode")) + lineEnd
+
+    _CREATE_PROCEDURE = _CREATE + Optional(_DEFINER + '=' + _SQL_ID) + _PROCEDURE + _PROCEDURE_NAME + \
+        nestedExpr(content=_SQL_ARGS, ignoreExpr=None).setResultsName('args') + Optional(_COMMENT + quotedString.setResultsName("comment"))
+
+    _END_PROCEDURE = Regex('END\s*\$\$')
+
+    _DECLARE_CURSOR = CaselessKeyword('DECLARE') + _SQL_ID + CaselessKeyword('CURSOR') + CaselessKeyword('FOR') + _SKIP_TO_END
+    _SELECT_EXPR = _SELECT + _SELECT_COLUMN_LIST + Optional(Group(_INTO + _SQL_ID_LIST).setResultsName("into")) + \
+        Optional(_FROM + _TABLE_NAME) + _SKIP_TO_END + Suppress(_SQL_EOL) + Optional(_RETURN_HINT_EXPR)
+
+    _INSERT_EXPR = _INSERT + _INTO + _TABLE_NAME + _SKIP_TO_END
+    _UPDATE_EXPR = _UPDATE + _TABLE_NAME + _SKIP_TO_END
+    _DELETE_EXPR = _DELETE + _FROM + _TABLE_NAME + _SKIP_TO_END
+
+    _THROW_EXPR = _CALL + _THROW + nestedExpr(content=_VALUE_LIST, ignoreExpr=None).setResultsName("args")
+
+    _CALL_EXPR = _CALL + _PROCEDURE_NAME + _SKIP_TO_END
+
+    _INLINE_BEGIN = Suppress(Literal("-- ")) + Keyword("BEGIN") + Keyword("INLINE") + _PROCEDURE_NAME
+    _INLINE_END = Suppress(Literal("-- ")) + Keyword("END") + Keyword("INLINE")
+
+    _CONSTANT = _sql_comment(Keyword("CONSTANT")) + _ID + SkipTo(lineEnd, include=True).setResultsName("value")
+
+    _CREATE_TABLE = _CREATE + _TABLE + Suppress(Optional(IF_NOT_EXISTS)) + _SQL_ID.setResultsName('name') + \
+        SkipTo(";").setResultsName('body')
+
+    _DECLARE_OPTIONS = _SQL_ID.setResultsName('name') + (_ENUM | _SET).setResultsName('kind') + \
+        nestedExpr(content=delimitedList(quotedString, ',', combine=False), ignoreExpr=None).setResultsName('options')
+
+    # the copies, that set the results names and the actions, keep the names of the elements for the profile
+    _name_rules(locals(), ParserElement)
+
+    _MACROS_EXPAND = _EXPAND_FUNC.setResultsName("expand_function") | _EXPAND_VAR.setResultsName('expand_var')
+    _MACROS = \
+        _INCLUDE_FILE.setResultsName('include') | \
+        _DEFINE_FUNCTION.setResultsName('define') | \
+        _DEFINE_VAR.setResultsName('define') | \
+        _UNDEFINE.setResultsName('undefine') | \
+        _IF_EXPR.setResultsName('if') | \
+        _ELSE_EXPR.setResultsName('else') | \
+        _ENDIF_EXPR.setResultsName('endif') | \
+        _FOR_EXPR.setResultsName('for') | \
+        _ENDFOR_EXPR.setResultsName('endfor') | \
+        _INLINE_EXPR.setResultsName('inline') | \
+        _MACROS_EXPAND
+
+    # the statements of SQLTokenizer, the actions call the handlers of tokenizer, that parses in the current thread
+    _STATEMENTS = \
+        _CREATE_PROCEDURE.copy().setParseAction(_action('on_begin_procedure')) | \
+        _END_PROCEDURE.copy().setParseAction(_action('on_end_procedure')) | \
+        _DECLARE_CURSOR.copy() | \
+        _SELECT_EXPR.copy().setParseAction(_action('on_select')) | \
+        _INSERT_EXPR.copy().setParseAction(_action('on_insert')) | \
+        _UPDATE_EXPR.copy().setParseAction(_action('on_update')) | \
+        _DELETE_EXPR.copy().setParseAction(_action('on_delete')) | \
+        _THROW_EXPR.copy().setParseAction(_action('on_error')) | \
+        _CALL_EXPR.copy().setParseAction(_action('on_call')) | \
+        _INLINE_BEGIN.copy().setParseAction(_action('on_begin_inline')) | \
+        _INLINE_END.copy().setParseAction(_action('on_end_inline')) | \
+        _CONSTANT.copy().setParseAction(_action('on_constant')) | \
+        _CREATE_TABLE.copy().setParseAction(_action('on_table'))
+
+    # pyparsing prepares the expressions on the first parse, so they are prepared before they are shared by threads
+    for expr in (_MACROS, _STATEMENTS, _PROCEDURE_COMMENT_FORMAT, _DECLARE_OPTIONS):
+        expr.streamline()
+
+    _name_rules(locals(), ParserElement)
+    elements = SimpleNamespace(ParseException=ParseException)
+    for name, value in list(locals().items()):
+        if isinstance(value, ParserElement):
+            setattr(elements, name.lstrip('_'), value)
+    elements.rules = _collect_rules([_MACROS, _STATEMENTS, _PROCEDURE_COMMENT_FORMAT, _DECLARE_OPTIONS, _MACROS_EXPAND])
+    return elements
+
+
+def _elements():
+    """get the pyparsing grammar, it is built once and shared by all tokenizers and threads"""
+    global _ELEMENTS
+    if _ELEMENTS is None:
+        with _ELEMENTS_LOCK:
+            if _ELEMENTS is None:
+                _ELEMENTS = _build_elements()
+    return _ELEMENTS
+
+
+class GrammarProfile:
+    """
+    The profile of pyparsing grammar, it counts the attempts, the matches and the time of each named element,
+    e.g. SELECT_EXPR or EXPAND_FUNC, while it is active the elements of grammar are instrumented in all threads.
+    The time of element includes the time of nested elements and of the parse actions,
+    the elements, that pyparsing merges into the enclosing expressions, are not counted.
+    The fast engine uses the grammar only for the lines and the statements, that it cannot handle.
+    """
+
+    # the profile, that instruments the grammar now
+    active = None
 
+    def __init__(self):
+        """constructor"""
+        self._local = threading.local()
+        self._stats = []
+        self._lock = threading.Lock()
+        self._saved = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
+
+    def start(self):
+        """instrument the grammar"""
+        with _ELEMENTS_LOCK:
+            if GrammarProfile.active is not None:
+                raise ValueError('the grammar is already profiled')
+            GrammarProfile.active = self
+        rules = _elements().rules
+        self._saved = [(x, x.debug, x.debugActions) for x in rules]
+        for expr in rules:
+            expr.setDebugActions(self._on_start, self._on_success, self._on_failure)
+
+    def stop(self):
+        """restore the grammar"""
+        if GrammarProfile.active is not self:
+            return
+        for expr, debug, actions in self._saved:
+            expr.debug = debug
+            expr.debugActions = actions
+        self._saved = None
+        GrammarProfile.active = None
+
+    def _thread_stats(self):
+        """get the stack of started elements and the statistics of the current thread"""
+        try:
+            return self._local.stack, self._local.stats
+        except AttributeError:
+            self._local.stack = []
+            self._local.stats = defaultdict(lambda: [0, 0, 0.0])
+            with self._lock:
+                self._stats.append(self._local.stats)
+            return self._local.stack, self._local.stats
+
+    def _on_start(self, instring, loc, expr):
+        stack, stats = self._thread_stats()
+        stats[expr.rule][0] += 1
+        stack.append((expr, perf_counter()))
+
+    def _on_success(self, instring, start, end, expr, tokens):
+        self._finish(expr, 1)
+
+    def _on_failure(self, instring, loc, expr, exc):
+        self._finish(expr, 0)
+
+    def _finish(self, expr, matched):
+        """stop the element, the elements above it are abandoned by the exceptions of parse actions"""
+        end = perf_counter()
+        stack, stats = self._thread_stats()
+        while stack:
+            current, start = stack.pop()
+            if current is expr:
+                break
+        else:
+            return
+        stat = stats[expr.rule]
+        stat[1] += matched
+        # the time of recursive element is counted once
+        if not any(x.rule == expr.rule for x, _ in stack):
+            stat[2] += end - start
 
-def _sql_identifier(expr):
-    return Suppress(Optional('`')) + expr + Suppress(Optional('`'))
-
-
-def _macros(expr):
-    return lineStart + Suppress(Literal("#")) + expr
-
-
-def _sql_comment(expr):
-    return lineStart + Suppress(Literal("-- ")) + expr
-
-
-def _select_hint(expr):
-    return Suppress(Literal("-- >")) + expr
-
-# keywords
-_DEFINE = _macros(CaselessKeyword("define"))
-_UNDEF = _macros(CaselessKeyword("undef"))
-_INCLUDE = _macros(CaselessKeyword("include"))
-_IF = _macros(CaselessKeyword("if"))
-_ELSE = _macros(CaselessKeyword("else"))
-_ENDIF = _macros(CaselessKeyword("endif"))
-
-_AS = CaselessKeyword("AS")
-_CALL = CaselessKeyword("CALL")
-_COMMENT = CaselessKeyword("COMMENT")
-_CREATE = CaselessKeyword("CREATE")
-_DEFINER = CaselessKeyword("DEFINER")
-_PROCEDURE = CaselessKeyword("PROCEDURE")
-_TABLE = CaselessKeyword("TABLE")
-_INTO = CaselessKeyword("INTO")
-_FROM = CaselessKeyword("FROM")
-_ENUM = CaselessKeyword("ENUM")
-_SET = CaselessKeyword("SET")
-_SELECT = CaselessKeyword("SELECT").setResultsName("command")
-_DELETE = CaselessKeyword("DELETE").setResultsName("command")
-_INSERT = CaselessKeyword("INSERT").setResultsName("command")
-_UPDATE = CaselessKeyword("UPDATE").setResultsName("command")
-IF_NOT_EXISTS = Group("IF") + CaselessKeyword("NOT") + CaselessKeyword("EXISTS")
-
-_THROW = _sql_identifier(Keyword("__throw"))
-_RETURNS = CaselessKeyword("returns")
-_SQL_EOL = Literal(";")
-
-
-_ID = Word(alphanums + "_.").setResultsName("name")
-_ID_LIST = delimitedList(_ID, combine=False)
-_VALUE = (Combine(_ID + Literal("(") + SkipTo(")", include=True)) |
-          Word(alphanums + "$!#%&*+-./:<=>?@[\]^_~`") | quotedString).setResultsName("value")
-_VALUE_LIST = delimitedList(_VALUE, combine=False)
-
-_SQL_DIRECTION = oneOf('INOUT IN OUT', caseless=True)
-_SQL_TYPE = Combine(Word(alphanums + '_') + Optional('(' + delimitedList(Word(nums + ' '), combine=True) + ')'))
-_SQL_ID = _sql_identifier(_ID)
-_SQL_ID_LIST = delimitedList(_SQL_ID, combine=False)
-_SKIP_TO_END = SkipTo(_SQL_EOL)
-_PARENTHESES_EXPR = Forward()
-_PARENTHESES_EXPR << Combine("(" + SkipTo(")", ignore=_PARENTHESES_EXPR, include=True))
-_NESTED_SELECT = Combine("(" + _SELECT + SkipTo(")", include=True, ignore=_PARENTHESES_EXPR))
-_NESTED_CALL = Combine(_SQL_ID + Literal("(") + SkipTo(Literal(")"), include=True))
-_SELECT_COLUMN = (_NESTED_SELECT | _NESTED_CALL | _SQL_ID.setResultsName("name")) + \
-    Optional(_AS + _SQL_ID.setResultsName("alias"))
-
-_TABLE_NAME = _SQL_ID.setResultsName("table")
-_PROCEDURE_NAME = _sql_identifier(Word(alphanums + "_.:").setResultsName("name")).setResultsName('name')
-
-_SELECT_COLUMN_LIST = delimitedList(Group(_SELECT_COLUMN), combine=False).setResultsName("columns")
-_SQL_ARG = Optional(_SQL_DIRECTION, default='IN') + _SQL_ID + _SQL_TYPE
-_SQL_ARGS = delimitedList(Group(_SQL_ARG), combine=False)
-
-_RETURN_TYPE = oneOf("object array", caseless=True).setResultsName("type")
-
-# expressions
-_DEFINE_FUNCTION = _DEFINE + _ID + nestedExpr(content=_ID_LIST, ignoreExpr=None).setResultsName("args") + \
-    Suppress(White()) + Regex(".*$").setResultsName("body")
-
-_DEFINE_VAR = _DEFINE + _ID + SkipTo(lineEnd, include=True).setResultsName("value")
-_UNDEFINE = _UNDEF + _ID
-_INCLUDE_FILE = _INCLUDE + quotedString.setResultsName("filename")
-_EXPAND_VAR = Suppress('$') + _ID
-_EXPAND_FUNC = Suppress('$') + _ID + nestedExpr(content=_VALUE_LIST, ignoreExpr=None).setResultsName("args")
-
-_IF_EXPR = _IF + SkipTo(lineEnd, include=True).setResultsName("condition")
-_ELSE_EXPR = _ELSE + lineEnd
-_ENDIF_EXPR = _ENDIF + lineEnd
-
-_RETURN_HINT_EXPR = _select_hint(Optional(_ID + Suppress(Literal(":"))) + _RETURN_TYPE).setResultsName("hint")
-_TEMP_TABLE_EXPR = _SQL_ID.setResultsName('table') + \
-    nestedExpr(content=delimitedList(Group(_SQL_ID + _SQL_TYPE)), ignoreExpr=None).setResultsName('columns') +\
-    Suppress(Literal(';'))
-
-_PROCEDURE_COMMENT_FORMAT = Optional(_TEMP_TABLE_EXPR) + Optional(_RETURNS + oneOf("union", caseless=True).setResultsName("mode")) + lineEnd
-
-_CREATE_PROCEDURE = _CREATE + Optional(_DEFINER + '=' + _SQL_ID) + _PROCEDURE + _PROCEDURE_NAME + \
-    nestedExpr(content=_SQL_ARGS, ignoreExpr=None).setResultsName('args') + Optional(_COMMENT + quotedString.setResultsName("comment"))
-
-_END_PROCEDURE = Regex('END\s*\$\$')
-
-_DECLARE_CURSOR = CaselessKeyword('DECLARE') + _SQL_ID + CaselessKeyword('CURSOR') + CaselessKeyword('FOR') + _SKIP_TO_END
-_SELECT_EXPR = _SELECT + _SELECT_COLUMN_LIST + Optional(Group(_INTO + _SQL_ID_LIST).setResultsName("into")) + \
-    Optional(_FROM + _TABLE_NAME) + _SKIP_TO_END + Suppress(_SQL_EOL) + Optional(_RETURN_HINT_EXPR)
-
-_INSERT_EXPR = _INSERT + _INTO + _TABLE_NAME + _SKIP_TO_END
-_UPDATE_EXPR = _UPDATE + _TABLE_NAME + _SKIP_TO_END
-_DELETE_EXPR = _DELETE + _FROM + _TABLE_NAME + _SKIP_TO_END
-
-_THROW_EXPR = _CALL + _THROW + nestedExpr(content=_VALUE_LIST, ignoreExpr=None).setResultsName("args")
-
-_CALL_EXPR = _CALL + _PROCEDURE_NAME + _SKIP_TO_END
+    def stats(self):
+        """
+        :return: the dict of name: (attempts, matches, time in seconds)
+        """
+        result = dict()
+        with self._lock:
+            for stats in self._stats:
+                for name, (attempts, matches, elapsed) in list(stats.items()):
+                    total = result.get(name, (0, 0, 0.0))
+                    result[name] = (total[0] + attempts, total[1] + matches, total[2] + elapsed)
+        return result
+
+    def report(self, stream):
+        """write the table of elements sorted by the time"""
+        stats = sorted(self.stats().items(), key=lambda x: (-x[1][2], x[0]))
+        stream.write('%-26s %10s %10s %10s %12s\n' % ('element', 'attempts', 'matches', 'time, ms', 'per call, us'))
+        for name, (attempts, matches, elapsed) in stats:
+            stream.write('%-26s %10d %10d %10.2f %12.2f\n' %
+                         (name, attempts, matches, elapsed * 1000, elapsed * 1000000 / attempts))
+
+    def dump(self, stream):
+        """write the statistics as json"""
+        import json
+        json.dump({name: {'attempts': attempts, 'matches': matches, 'time': elapsed}
+                   for name, (attempts, matches, elapsed) in self.stats().items()}, stream, indent=2, sort_keys=True)
+
+
+# the fast lexer, it recognizes the canonical forms of macros only,
+# everything else is delegated to the pyparsing grammar line by line
+_FAST_FLAGS = re.IGNORECASE | re.ASCII
+_FAST_SPACES = re.compile(r'[ \r\n]*')
+_FAST_ID = re.compile(r'[A-Za-z0-9_.]+')
+_FAST_WORD = re.compile(r'[A-Za-z0-9$!#%&*+\-./:<=>?@\[\\\]^_~`]+')
+_FAST_QUOTED = {
+    '"': re.compile(r'"(?:[^"\n\r\\]|(?:"")|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*'),
+    "'": re.compile(r"'(?:[^'\n\r\\]|(?:'')|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*"),
+}
+_FAST_DIRECTIVE = re.compile(r'#[ \r\n]*(define|undef|include|if|else|endif|foreach|for|endfor|inline)(?![A-Za-z0-9_$])',
+                             _FAST_FLAGS)
+# the directives, that are handled in the suppressed blocks too
+_FAST_CONDITIONS = frozenset(('if', 'else', 'endif', 'foreach', 'for', 'endfor'))
+
+_LOOP_RANGE = re.compile(r'range *\((.*)\)\Z')
+_LOOP_VALUES = re.compile(r'\((.*)\)\Z')
+
+_Token = namedtuple('_Token', ('name', 'args', 'body', 'value', 'filename', 'condition'))
+_Token.__new__.__defaults__ = ('',) * len(_Token._fields)
+
+
+def _fast_names(text):
+    """split the list of names"""
+    if text:
+        return [x.strip() for x in text.split(',')]
+    return []
+
+
+_FAST_DIRECTIVES = {
+    'define': (
+        ('define', re.compile(r'#define +([A-Za-z0-9_.]+) *\( *([A-Za-z0-9_.]+(?: *, *[A-Za-z0-9_.]+)*)? *\)'
+                              r'(?: *\n| +(.+)\n)\Z', _FAST_FLAGS),
+         lambda m: _Token(name=m.group(1), args=(_fast_names(m.group(2)),), body=m.group(3) or '')),
+        ('define', re.compile(r'#define +([A-Za-z0-9_.]+)(?: *\n| +([^ (].*)\n)\Z', _FAST_FLAGS),
+         lambda m: _Token(name=m.group(1), value=m.group(2) or '')),
+    ),
+    'undef': (
+        ('undefine', re.compile(r'#undef +([A-Za-z0-9_.]+)', _FAST_FLAGS),
+         lambda m: _Token(name=m.group(1))),
+    ),
+    'include': (
+        ('include', re.compile(r'#include *("[^"\n\r\\]*"(?!")|\'[^\'\n\r\\]*\'(?!\'))', _FAST_FLAGS),
+         lambda m: _Token(filename=m.group(1))),
+    ),
+    'if': (
+        ('if', re.compile(r'#if +(.+)\n\Z', _FAST_FLAGS),
+         lambda m: _Token(condition=m.group(1))),
+    ),
+    'else': (
+        ('else', re.compile(r'#else\n\Z', _FAST_FLAGS),
+         lambda m: _Token()),
+    ),
+    'endif': (
+        ('endif', re.compile(r'#endif\n\Z', _FAST_FLAGS),
+         lambda m: _Token()),
+    ),
+    'for': (
+        ('for', re.compile(r'#for(?:each)? +([A-Za-z0-9_.]+) +in +(.+)\n\Z', _FAST_FLAGS),
+         lambda m: _Token(name=m.group(1), value=m.group(2))),
+    ),
+    'endfor': (
+        ('endfor', re.compile(r'#endfor\n\Z', _FAST_FLAGS),
+         lambda m: _Token()),
+    ),
+    'inline': (
+        ('inline', re.compile(r'#inline\n\Z', _FAST_FLAGS),
+         lambda m: _Token()),
+    ),
+}
+_FAST_DIRECTIVES['foreach'] = _FAST_DIRECTIVES['for']
+
+
+def _fast_value(text, pos):
+    """match the argument of macro function, returns the end of value or -1"""
+    match = _FAST_ID.match(text, pos)
+    if match and text.startswith('(', match.end()):
+        end = text.find(')', match.end() + 1)
+        if end != -1:
+            return end + 1
+    match = _FAST_WORD.match(text, pos)
+    if match:
+        return match.end()
+    quoted = _FAST_QUOTED.get(text[pos:pos + 1])
+    if quoted:
+        end = quoted.match(text, pos).end()
+        if text.startswith(text[pos], end):
+            return end + 1
+    return -1
+
+
+def _fast_arguments(text, pos):
+    """
+    match the arguments of macro function
+    :return: the tuple(arguments, end), the None if there is no arguments
+             or the False if arguments too complex to be handled by the fast lexer
+    """
+    args = []
+    pos += 1
+    while True:
+        pos = _FAST_SPACES.match(text, pos).end()
+        if text.startswith('(', pos):
+            return False
+        end = _fast_value(text, pos)
+        if end == -1:
+            break
+        args.append(text[pos:end])
+        pos = end
+        while True:
+            delimiter = _FAST_SPACES.match(text, pos).end()
+            if not text.startswith(',', delimiter):
+                break
+            start = _FAST_SPACES.match(text, delimiter + 1).end()
+            end = _fast_value(text, start)
+            if end == -1:
+                break
+            args.append(text[start:end])
+            pos = end
+
+    pos = _FAST_SPACES.match(text, pos).end()
+    if text.startswith(')', pos):
+        return args, pos + 1
+    return None
+
+
+def _fast_expand(text, pos, tokens):
+    """
+    scan the macros expansions
+    :return: False if the text too complex to be handled by the fast lexer
+    """
+    pos = text.find('$', pos)
+    while pos != -1:
+        match = _FAST_ID.match(text, _FAST_SPACES.match(text, pos + 1).end())
+        if match is None:
+            pos = text.find('$', pos + 1)
+            continue
+
+        start = _FAST_SPACES.match(text, match.end()).end()
+        args = _fast_arguments(text, start) if text.startswith('(', start) else None
+        if args is False:
+            return False
+        if args:
+            tokens.append(('expand_function', _Token(name=match.group(), args=(args[0],)), pos, args[1]))
+            pos = args[1]
+        else:
+            tokens.append(('expand_var', _Token(name=match.group()), pos, match.end()))
+            pos = match.end()
+        pos = text.find('$', pos)
+    return True
+
+
+# the fast scanner of SQLTokenizer, it follows the pyparsing grammar element by element without backtracking,
+# the statements, that it cannot handle exactly, are delegated to the pyparsing grammar
+_SCAN_SPACES = re.compile(r'[ \n\t\r]*')
+_SCAN_LINE_SPACES = re.compile(r'[ \t\r]*')
+_SCAN_ID = re.compile(r'[A-Za-z0-9_.]+')
+_SCAN_PROCEDURE_NAME = re.compile(r'[A-Za-z0-9_.:]+')
+_SCAN_TYPE = re.compile(r'[A-Za-z0-9_]+(?:\([0-9 ]+(?:,[0-9 ]+)*\))?')
+_SCAN_PARENTHESES = re.compile(r'[()]')
+# the first tokens of the expressions of SQLTokenizer, the keywords are not checked before them like in pyparsing,
+# the END is case sensitive and followed by the unicode spaces like in the pyparsing grammar, so it is checked after match
+_SCAN_STATEMENT = re.compile(r'(CREATE|DECLARE|SELECT|INSERT|UPDATE|DELETE|CALL)(?![A-Za-z0-9_$])|'
+                             r'(END)[\s\x1c-\x1f\x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]*\$\$|-- ',
+                             re.IGNORECASE | re.ASCII)
+# the characters, that become the ascii characters in upper case, so the keywords of pyparsing match them
+_SCAN_UNSAFE = re.compile('[\u00df\u0131\u0149\u017f\u01f0\u1e96-\u1e9a\ufb00-\ufb06]')
+_SCAN_KEYWORD_CHARS = frozenset(ascii_letters + digits + '_$')
+# the statement should be parsed by pyparsing grammar
+_UNKNOWN = object()
+
+
+def _scan_keyword(text, pos, keyword):
+    """match the caseless keyword"""
+    end = pos + len(keyword)
+    return text[pos:end].upper() == keyword and text[end:end + 1] not in _SCAN_KEYWORD_CHARS
+
+
+def _scan_exact_keyword(text, pos, keyword):
+    """match the keyword, it should be separated from the identifier characters at the both sides"""
+    end = pos + len(keyword)
+    return text.startswith(keyword, pos) and text[end:end + 1] not in _SCAN_KEYWORD_CHARS and \
+        (pos == 0 or text[pos - 1] not in _SCAN_KEYWORD_CHARS)
+
+
+def _scan_identifier(text, pos, expr=_SCAN_ID):
+    """match the identifier, that may be quoted, returns the tuple(name, end) or None"""
+    pos = _SCAN_SPACES.match(text, pos).end()
+    if text.startswith('`', pos):
+        pos = _SCAN_SPACES.match(text, pos + 1).end()
+    match = expr.match(text, pos)
+    if match is None:
+        return None
+    pos = _SCAN_SPACES.match(text, match.end()).end()
+    if text.startswith('`', pos):
+        pos += 1
+    return match.group(), pos
+
+
+def _scan_procedure_name(text, pos):
+    """match the name of procedure, returns the tuple(name, end) or None"""
+    return _scan_identifier(text, pos, _SCAN_PROCEDURE_NAME)
+
+
+def _scan_quoted(text, pos):
+    """match the quoted string, returns the end of string or -1"""
+    quoted = _FAST_QUOTED.get(text[pos:pos + 1])
+    if quoted:
+        end = quoted.match(text, pos).end()
+        if text.startswith(text[pos], end):
+            return end + 1
+    return -1
+
+
+def _scan_closing(text, pos):
+    """find the parenthesis, that closes the parenthesis before pos, returns -1 if it is not found"""
+    depth = 0
+    for match in _SCAN_PARENTHESES.finditer(text, pos):
+        if match.group() == '(':
+            depth += 1
+        elif depth:
+            depth -= 1
+        else:
+            return match.start()
+    return -1
+
+
+def _scan_list(text, pos, scan):
+    """match the items delimited by comma, returns the tuple(items, end) or None"""
+    item = scan(text, pos)
+    if item is None:
+        return None
+    items = [item[0]]
+    pos = item[1]
+    while True:
+        delimiter = _SCAN_SPACES.match(text, pos).end()
+        if not text.startswith(',', delimiter):
+            break
+        item = scan(text, delimiter + 1)
+        if item is None:
+            break
+        items.append(item[0])
+        pos = item[1]
+    return items, pos
+
+
+def _scan_nested(text, pos, scan):
+    """
+    match the items in parentheses
+    :return: the tuple(items, end), None or _UNKNOWN if the parentheses are nested
+    """
+    pos = _SCAN_SPACES.match(text, pos).end()
+    if not text.startswith('(', pos):
+        return None
+    items = []
+    pos += 1
+    while True:
+        pos = _SCAN_SPACES.match(text, pos).end()
+        if text.startswith('(', pos):
+            return _UNKNOWN
+        found = _scan_list(text, pos, scan)
+        if found is None:
+            break
+        items.extend(found[0])
+        pos = found[1]
+    if text.startswith(')', pos):
+        return items, pos + 1
+    return None
+
+
+def _scan_argument(text, pos):
+    """match the argument of procedure, returns the tuple(argument, end) or None"""
+    pos = _SCAN_SPACES.match(text, pos).end()
+    direction = 'IN'
+    for value in ('INOUT', 'IN', 'OUT'):
+        if text[pos:pos + len(value)].upper() == value:
+            direction = value
+            pos += len(value)
+            break
+    name = _scan_identifier(text, pos)
+    if name is None:
+        return None
+    match = _SCAN_TYPE.match(text, _SCAN_SPACES.match(text, name[1]).end())
+    if match is None:
+        return None
+    return (direction, name[0], match.group()), match.end()
+
+
+def _scan_value(text, pos):
+    """match the argument of call, returns the tuple(value, end) or None"""
+    pos = _SCAN_SPACES.match(text, pos).end()
+    end = _fast_value(text, pos)
+    if end == -1:
+        return None
+    return text[pos:end], end
+
+
+def _scan_column(text, pos):
+    """match the column of select, returns the tuple(name, end) or None"""
+    pos = _SCAN_SPACES.match(text, pos).end()
+    name = None
+    if text.startswith('(', pos) and _scan_keyword(text, pos + 1, 'SELECT'):
+        end = _scan_closing(text, pos + 7)
+        if end != -1:
+            # the column without name, it is named by the string representation of its tokens
+            name = '[%r]' % ('(SELECT' + text[pos + 7:end] + ')')
+            pos = end + 1
+    if name is None:
+        match = _SCAN_ID.match(text, pos + 1 if text.startswith('`', pos) else pos)
+        if match is not None:
+            end = match.end() + 1 if text.startswith('`', match.end()) else match.end()
+            close = text.find(')', end + 1) if text.startswith('(', end) else -1
+            if close != -1:
+                # the name of column is the first character of the function name
+                name = match.group()[0].rpartition('.')[-1]
+                pos = close + 1
+    if name is None:
+        identifier = _scan_identifier(text, pos)
+        if identifier is None:
+            return None
+        name = identifier[0].rpartition('.')[-1]
+        pos = identifier[1]
+
+    alias = _SCAN_SPACES.match(text, pos).end()
+    if _scan_keyword(text, alias, 'AS'):
+        identifier = _scan_identifier(text, alias + 2)
+        if identifier is not None:
+            return identifier
+    return name, alias
+
+
+# the constant folding, the numeric literals are folded with +, - and * only,
+# because the result of other operators depends on the types and the settings of server
+_FOLD_CHARS = frozenset('0123456789. +-*()')
+_FOLD_TOKEN = re.compile(r'\d+\.?\d*|\.\d+|\S')
+_FOLD_GLUE = re.compile(r'[0-9. +\-*()]*\Z')
+_FOLD_STRING = re.compile(r"\s*'((?:[^'\\]|\\.|'')*)'")
+_FOLD_OPERATOR = re.compile(r"[-+*']")
+_FOLD_WORD = re.compile(r'[A-Za-z0-9_]+')
+_FOLD_BEFORE = frozenset('(,;=<>&')
+_FOLD_AFTER = frozenset('),;=<>&')
+# the keywords, that bind the operands stronger than + and -
+_FOLD_KEYWORDS = frozenset(('DIV', 'MOD', 'BINARY', 'COLLATE'))
+_FOLD_EXPANSIONS = frozenset(('expand_var', 'expand_function'))
+_BIGINT = range(-2 ** 63, 2 ** 63)
+# the maximal number of digits in DECIMAL
+_DECIMAL_DIGITS = 65
+
+
+def _fold_checked(value):
+    """check that the integer does not overflow the BIGINT"""
+    if isinstance(value, int) and value not in _BIGINT:
+        raise OverflowError('out of BIGINT range')
+    return value
+
+
+def _fold_sum(tokens, pos):
+    """evaluate the sum of products"""
+    value, pos = _fold_product(tokens, pos)
+    while pos < len(tokens) and tokens[pos] in ('+', '-'):
+        operator = tokens[pos]
+        right, pos = _fold_product(tokens, pos + 1)
+        value = _fold_checked(value + right if operator == '+' else value - right)
+    return value, pos
+
+
+def _fold_product(tokens, pos):
+    """evaluate the product of operands"""
+    value, pos = _fold_unary(tokens, pos)
+    while pos < len(tokens) and tokens[pos] == '*':
+        right, pos = _fold_unary(tokens, pos + 1)
+        value = _fold_checked(value * right)
+    return value, pos
+
+
+def _fold_unary(tokens, pos):
+    """evaluate the literal, the parentheses or the unary operator"""
+    if pos == len(tokens):
+        raise ValueError('unexpected end of expression')
+    token = tokens[pos]
+    if token in ('+', '-'):
+        value, pos = _fold_unary(tokens, pos + 1)
+        return _fold_checked(-value) if token == '-' else value, pos
+    if token == '(':
+        value, pos = _fold_sum(tokens, pos + 1)
+        if pos == len(tokens) or tokens[pos] != ')':
+            raise ValueError('unbalanced parentheses')
+        return value, pos + 1
+    if token[-1].isdigit():
+        return Decimal(token) if '.' in token else _fold_checked(int(token)), pos + 1
+    raise ValueError('unexpected %s' % token)
+
+
+def _fold_strings(text):
+    """concatenate the adjacent string literals"""
+    parts = []
+    pos = 0
+    while pos < len(text):
+        match = _FOLD_STRING.match(text, pos)
+        if match is None:
+            return None
+        parts.append(match.group(1))
+        pos = match.end()
+    if len(parts) < 2:
+        return None
+    return "'%s'" % ''.join(parts)
+
+
+def _fold_constant(text):
+    """
+    evaluate the expression of numeric literals or the adjacent string literals
+    :return: the literal or None if the text is not constant expression or it is literal already
+    """
+    text = text.strip()
+    if text.startswith("'"):
+        return _fold_strings(text)
+    if not text or '--' in text or not _FOLD_CHARS.issuperset(text):
+        return None
+    tokens = _FOLD_TOKEN.findall(text)
+    if len(tokens) < 2:
+        return None
+    try:
+        with localcontext() as context:
+            context.prec = _DECIMAL_DIGITS
+            context.traps[Inexact] = True
+            value, pos = _fold_sum(tokens, 0)
+    except (ArithmeticError, ValueError):
+        return None
+    if pos != len(tokens):
+        return None
+    if isinstance(value, Decimal):
+        return format(value.copy_abs() if value.is_zero() else value, 'f')
+    return str(value)
+
+
+def _fold_balance(text):
+    """get the final and the lowest depth of parentheses in text"""
+    depth = lowest = 0
+    for c in text:
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            lowest = min(lowest, depth)
+    return depth, lowest
+
+
+def _fold_bounds(shape):
+    """
+    get the bounds of expression without the spaces, the unbalanced parentheses
+    and the parentheses around whole expression, None if the parentheses cannot be balanced
+    """
+    left, right = 0, len(shape)
+    while True:
+        while left < right and shape[left] == ' ':
+            left += 1
+        while left < right and shape[right - 1] == ' ':
+            right -= 1
+        depth, lowest = _fold_balance(shape[left:right])
+        if depth > 0 and shape.startswith('(', left):
+            left += 1
+        elif depth < 0 and shape.endswith(')', left, right):
+            right -= 1
+        elif depth or lowest:
+            return None
+        elif shape.startswith('(', left) and shape.endswith(')', left, right) and \
+                _fold_balance(shape[left + 1:right - 1]) == (0, 0):
+            left += 1
+            right -= 1
+        else:
+            return left, right
+
+
+def _fold_context(before, text, after):
+    """check that the expression is not the operand of stronger operator, the string or the comment"""
+    prefix = re.sub(r'\\.', '', before)
+    if any(prefix.count(x) % 2 for x in '\'"`') or '--' in prefix or '#' in prefix or '/*' in prefix:
+        return False
+
+    head = before.rstrip(' ')
+    if head and head[-1] not in _FOLD_BEFORE:
+        word = re.search(r'[A-Za-z0-9_]+\Z', head)
+        if word is None or head == before or text[0] in '+-' or word.group().upper() in _FOLD_KEYWORDS or \
+                head[word.start() - 1:word.start()] in ('$', '@', '.', '`'):
+            return False
+
+    tail = after.lstrip(' ')
+    if tail.strip() and tail[0] not in _FOLD_AFTER and not tail.startswith(('!=', '-- ', '--\n')):
+        word = _FOLD_WORD.match(tail)
+        if word is None or tail == after or word.group().upper() in _FOLD_KEYWORDS:
+            return False
+    return True
+
+
+class _Function(namedtuple('_Function', ('args', 'body', 'ast', 'template'))):
+    """
+    The macro function, that compiled to the flat template:
+    the ast contains the tuple(argument index, start, end) for each reference to argument in body,
+    the template contains the literal parts of body between references
+    """
+    __slots__ = ()
+
+    @classmethod
+    def compile(cls, args, body):
+        """compile the body of macro function"""
+        if not args:
+            return cls(args, body, (), (body,))
+
+        indexes = {x: i for i, x in enumerate(args)}
+        pattern = re.compile(r'(?<![A-Za-z0-9_$])\$(%s)(?![A-Za-z0-9_$])' %
+                             '|'.join(map(re.escape, sorted(indexes, key=len, reverse=True))))
+        ast = tuple((indexes[m.group(1)], m.start(), m.end()) for m in pattern.finditer(body))
+        template = []
+        start = 0
+        for _, begin, end in ast:
+            template.append(body[start:begin])
+            start = end
+        template.append(body[start:])
+        return cls(args, body, ast, tuple(template))
 
-_CONSTANT = _sql_comment(Keyword("CONSTANT")) + _ID + SkipTo(lineEnd, include=True).setResultsName("value")
-
-_CREATE_TABLE = _CREATE + _TABLE + Suppress(Optional(IF_NOT_EXISTS)) + _SQL_ID.setResultsName('name') + \
-    SkipTo(";").setResultsName('body')
-
-_DECLARE_OPTIONS = _SQL_ID.setResultsName('name') + (_ENUM | _SET).setResultsName('kind') + \
-    nestedExpr(content=delimitedList(quotedString, ',', combine=False), ignoreExpr=None).setResultsName('options')
+    def render(self, values):
+        """substitute the values of arguments"""
+        parts = [None] * (2 * len(self.ast) + 1)
+        parts[::2] = self.template
+        parts[1::2] = [values[x[0]] for x in self.ast]
+        return ''.join(parts)
 
 
 class MacrosTokenizer:
     """Preprocessor statements tokenizer"""
 
-    _expand = \
-        _EXPAND_FUNC.setResultsName("expand_function") | \
-        _EXPAND_VAR.setResultsName('expand_var')
+    @property
+    def _expand(self):
+        """the grammar of macros expansions"""
+        return _elements().MACROS_EXPAND
 
-    grammar = \
-        _INCLUDE_FILE.setResultsName('include') | \
-        _DEFINE_FUNCTION.setResultsName('define') | \
-        _DEFINE_VAR.setResultsName('define') | \
-        _UNDEFINE.setResultsName('undefine') | \
-        _IF_EXPR.setResultsName('if') | \
-        _ELSE_EXPR.setResultsName('else') | \
-        _ENDIF_EXPR.setResultsName('endif') | \
-        _expand
+    @property
+    def grammar(self):
+        """the grammar of macros directives and expansions"""
+        return _elements().MACROS
 
-    function_class = namedtuple('Function', ('args', 'body', 'ast'))
+    function_class = _Function
 
-    def __init__(self):
-        """constructor"""
+    # the maximal number of memorized expansions per macro function
+    expansions_limit = 4096
+
+    engines = ('fast', 'pyparsing')
+
+    def __init__(self, engine='fast', fold=False):
+        """
+        constructor
+        :param engine: the lexer engine
+        :param fold: replace the constant expressions of expansions by their values
+        """
+        if engine not in self.engines:
+            raise ValueError('unknown engine %s, expected one of %s' % (engine, ', '.join(self.engines)))
+        self.engine = engine
+        self.fold = fold
         self.suppress = False
         self.conditions_stack = list()
         self.functions = dict()
         self.variables = dict()
+        self.expansions = dict()
+        self.loops = list()
+        # the macros, that are defined by sources, the name to the flag is it function
+        self.defined = dict()
+        self.used = set()
 
     def reset(self):
         self.suppress = False
         self.conditions_stack.clear()
+        self.loops.clear()
         self.functions.clear()
         self.variables.clear()
+        self.expansions.clear()
+        self.defined.clear()
+        self.used.clear()
+
+    def unused(self):
+        """get the names of macros, that are defined by sources and never expanded, except the exported constants"""
+        return sorted(k for k, v in self.defined.items() if k not in self.used and (v or k.startswith('_')))
 
     def _expand_var(self, target):
         """expand the macros"""
         name = target.name
         if name in self.variables:
+            self.used.add(name)
             return self.variables[name]
         return '$' + name
 
-    def _expand_function(self, target):
+    def _expand_function(self, target, line=None):
         """expand the macro function"""
         macros = self.functions[target.name]
-        args = (x.startswith('$') and self.variables.get(x[1:], x) or x for x in target.args[0])
-        args = dict(zip(macros.args, args))
-        if len(args) != len(macros.args):
-            raise ValueError("invalid number of parameters for %s, expected %s" % (target.name, macros.args))
+        self.used.add(target.name)
+        args = target.args[0][:len(macros.args)]
+        self.used.update(x[1:] for x in args if x.startswith('$') and x[1:] in self.variables)
+        values = tuple(x.startswith('$') and self.variables.get(x[1:], x) or x for x in args)
+        if len(values) < len(macros.args) or len(set(macros.args)) != len(macros.args):
+            if line is None:
+                raise ValueError("invalid number of parameters for %s, expected %s" % (target.name, macros.args))
+            raise ValueError("%d: invalid number of parameters for %s, expected %s" % (line, target.name, macros.args))
+
+        expansions = self.expansions.setdefault(target.name, dict())
+        try:
+            return expansions[values]
+        except KeyError:
+            pass
 
-        start = 0
-        buffer = ''
-        for t in macros.ast:
-            buffer += macros.body[start:t[1]]
-            buffer += args[t[0].getName()]
-            start = t[2]
-        return buffer + macros.body[start:]
+        if len(expansions) >= self.expansions_limit:
+            expansions.clear()
+        value = expansions[values] = macros.render(values)
+        return value
+
+    def _fold_operand(self, line, name, token):
+        """get the value of expansion, None if it is unknown"""
+        if name == 'expand_var':
+            if token.name in self.variables:
+                self.used.add(token.name)
+            return self.variables.get(token.name)
+        if token.name in self.functions:
+            return self._expand_function(token, line)
+        return None
+
+    def _fold_span(self, line, current, tokens, first, last):
+        """fold the expression around the expansions from first to last, returns the token or None"""
+        limit = tokens[first - 1][3] if first else 0
+        start = tokens[first][2]
+        while start > limit and current[start - 1] in _FOLD_CHARS:
+            start -= 1
+        limit = tokens[last + 1][2] if last + 1 < len(tokens) else len(current)
+        stop = tokens[last][3]
+        while stop < limit and current[stop] in _FOLD_CHARS and not current.startswith('--', stop):
+            stop += 1
+
+        values = []
+        for name, token, _, _ in tokens[first:last + 1]:
+            value = self._fold_operand(line, name, token)
+            if value is None:
+                return None
+            values.append(value)
+        # nothing to evaluate, if neither the expression nor the values have operators or strings
+        if _FOLD_OPERATOR.search(current, start, stop) is None and not any(_FOLD_OPERATOR.search(x) for x in values):
+            return None
+
+        shape = [current[start:tokens[first][2]]]
+        for i in range(first, last):
+            shape.append('0')
+            shape.append(current[tokens[i][3]:tokens[i + 1][2]])
+        shape.append('0')
+        shape.append(current[tokens[last][3]:stop])
+        shape = ''.join(shape)
+        bounds = _fold_bounds(shape)
+        if bounds is None:
+            return None
+        stop -= len(shape) - bounds[1]
+        start += bounds[0]
+
+        before = current[:start]
+        after = current[stop:]
+        if before.rstrip(' ') and len(before.rstrip(' ')) <= (tokens[first - 1][3] if first else 0) or \
+                after.strip() and stop + len(after) - len(after.lstrip(' ')) >= limit < len(current) or \
+                not _fold_context(before, current[start:stop], after):
+            return None
+
+        text = []
+        pos = start
+        for (_, _, begin, end), value in zip(tokens[first:last + 1], values):
+            text.append(current[pos:begin])
+            text.append(value)
+            pos = end
+        text.append(current[pos:stop])
+        value = _fold_constant(''.join(text))
+        if value is None:
+            return None
+        return 'fold', value, start, stop
+
+    def _fold_expressions(self, line, current, tokens):
+        """replace the constant expressions of expansions and literals by their values"""
+        result = []
+        index = 0
+        while index < len(tokens):
+            last = index
+            if tokens[index][0] in _FOLD_EXPANSIONS:
+                while last + 1 < len(tokens) and tokens[last + 1][0] in _FOLD_EXPANSIONS and \
+                        _FOLD_GLUE.match(current, tokens[last][3], tokens[last + 1][2]):
+                    last += 1
+                folded = self._fold_span(line, current, tokens, index, last)
+                if folded is not None:
+                    result.append(folded)
+                    index = last + 1
+                    continue
+            result.append(tokens[index])
+            index += 1
+        return result
 
     def _recurisve_expand(self, value):
         """recursive expand macros"""
-        buffer = ''
+        tokens = []
+        if '\t' in value or '\r' in value or not _fast_expand(value, 0, tokens):
+            tokens = [(t[0].getName(), t[0], t[1], t[2]) for t in self._expand.scanString(value)]
+
+        if not tokens:
+            return value
+
+        buffer = []
         start = 0
-        for t in self._expand.scanString(value):
-            buffer += value[start:t[1]]
-            buffer += getattr(self, '_' + t[0].getName())(t[0])
-            start = t[2]
-        return buffer + value[start:]
+        for name, token, begin, end in tokens:
+            buffer.append(value[start:begin])
+            buffer.append(getattr(self, '_' + name)(token))
+            start = end
+        buffer.append(value[start:])
+        return ''.join(buffer)
 
     def _handle_define(self, line, token):
         """define macro function"""
@@ -212,18 +1100,19 @@ class MacrosTokenizer:
             return
 
         if token.args:
-            args = token.args[0]
-            keywords = MatchFirst([Keyword('$' + x).setResultsName(x) for x in args])
-            body = self._recurisve_expand(token.body)
-            macros = self.function_class(args, body, list(keywords.scanString(body)))
+            macros = self.function_class.compile(list(token.args[0]), self._recurisve_expand(token.body))
             if token.name in self.functions:
                 warnings.warn('%d: macros %s already defined!' % (line, token.name))
             self.functions[token.name] = macros
+            self.expansions.pop(token.name, None)
+            self.defined[token.name] = True
         else:
             if token.name in self.variables:
                 warnings.warn('%d: macros %s already defined!' % (line, token.name))
 
+            # the value is kept as is, it is folded in place of expansion, where the precedence is known
             value = self.variables[token.name] = self._recurisve_expand(token.value)
+            self.defined[token.name] = False
             if not token.name.startswith("_"):
                 self.on_constant(token.name, value)
 
@@ -236,6 +1125,7 @@ class MacrosTokenizer:
             del self.variables[token.name]
         elif token.name in self.functions:
             del self.functions[token.name]
+            self.expansions.pop(token.name, None)
         else:
             warnings.warn('%d: macros %s is not defined!' % (line, token.name))
 
@@ -245,25 +1135,32 @@ class MacrosTokenizer:
         if self.suppress:
             return
 
-        macros = self.functions[token.name]
-        if len(macros.body) == 0:
+        if len(self.functions[token.name].body) == 0:
+            self.used.add(token.name)
             return
-        expanded_args = (x.startswith('$') and self.variables.get(x[1:], x) or x for x in token.args[0])
-        args = dict(zip(macros.args, expanded_args))
-        if len(args) != len(macros.args):
-            raise ValueError("%d: invalid number of parameters for %s, expected %s" % (line, token.name, macros.args))
 
-        self.on_function(macros.ast, macros.body, args)
+        self.on_function(token.name, self._expand_function(token, line))
 
     def _handle_expand_var(self, _, token):
         """handle expand macro variable"""
         if not self.suppress:
             if token.name in self.variables:
+                self.used.add(token.name)
                 self.on_variable(token.name, self.variables[token.name])
             else:
                 warnings.warn("Undefined variable: %s" % token.name)
                 self.on_variable(token.name, "$" + token.name)
 
+    def _handle_fold(self, _, value):
+        """handle the folded expression"""
+        if not self.suppress:
+            self.nop(value)
+
+    def _handle_inline(self, *_):
+        """mark the next procedure to inline"""
+        if not self.suppress:
+            self.on_inline()
+
     def _handle_include(self, _, token):
         """include file"""
         if not self.suppress:
@@ -273,10 +1170,15 @@ class MacrosTokenizer:
         """main way of condition"""
         if not self.suppress:
             self.conditions_stack.append(self.suppress)
-            try:
-                self.suppress = not eval(token.condition, {'defined': lambda x: x in self.variables}, self.variables)
-            except Exception as e:
-                raise RuntimeError("Failed to evaluate expression: {0}, details: {1}".format(token.condition, e))
+            self.suppress = not self._evaluate(token.condition)
+
+    def _evaluate(self, condition):
+        """evaluate the condition expression"""
+        self.used.update(x for x in re.findall(r'[A-Za-z0-9_.]+', condition) if x in self.variables)
+        try:
+            return eval(condition, {'defined': lambda x: x in self.variables}, self.variables)
+        except Exception as e:
+            raise RuntimeError("Failed to evaluate expression: {0}, details: {1}".format(condition, e))
 
     def _handle_else(self, *_):
         """alternative way of condition"""
@@ -289,11 +1191,50 @@ class MacrosTokenizer:
         except IndexError:
             raise ValueError("%d: mismatch if/endif" % line) from None
 
+    def _handle_for(self, line, token):
+        """start to record the loop body"""
+        self.loops.append([line, token, 1, list()])
+
+    def _handle_endfor(self, line, _):
+        """end of loop without beginning"""
+        raise ValueError("%d: mismatch for/endfor" % line)
+
+    def _loop_values(self, line, token):
+        """get the values of loop variable"""
+        text = token.value.strip()
+        try:
+            match = _LOOP_RANGE.match(text)
+            if match:
+                return [str(x) for x in range(*(int(self._recurisve_expand(x)) for x in match.group(1).split(',')))]
+            match = _LOOP_VALUES.match(text)
+            if match:
+                return [self._recurisve_expand(x.strip()) for x in match.group(1).split(',') if x.strip()]
+        except (TypeError, ValueError) as e:
+            raise ValueError("%d: invalid loop %s: %s" % (line, text, e)) from None
+        raise ValueError("%d: invalid loop %s, expected range(...) or (value, ...)" % (line, text))
+
+    def _run_loop(self, line, token, records):
+        """expand the recorded loop body for each value, the suppressed loop body is handled once"""
+        name = token.name
+        values = [None] if self.suppress else self._loop_values(line, token)
+        previous = self.variables.get(name)
+        try:
+            for value in values:
+                if value is not None:
+                    self.variables[name] = value
+                for record in records:
+                    self._feed(*record)
+        finally:
+            if previous is None:
+                self.variables.pop(name, None)
+            else:
+                self.variables[name] = previous
+
     def on_constant(self, name, value):
         """callback to catch constants"""
         pass
 
-    def on_function(self, ast, body, args):
+    def on_function(self, name, value):
         """callback to catch function"""
         pass
 
@@ -305,38 +1246,123 @@ class MacrosTokenizer:
         """callback to catch include"""
         pass
 
+    def on_inline(self):
+        """callback to catch the inline marker"""
+        pass
+
     def nop(self, text):
         """do nothing"""
         pass
 
-    def parse(self, stream):
-        """parse the stream"""
-        current = ''
+    def _scan(self, current):
+        """scan the line by pyparsing grammar"""
+        return [(t[0].getName(), t[0], t[1], t[2]) for t in self.grammar.scanString(current)]
 
+    def _fast_scan(self, current):
+        """scan the line by fast lexer, the None means that line should be skipped"""
+        tokens = []
+        start = 0
+        suppress = self.suppress and not self.loops
+        if current[0] == '#':
+            directive = _FAST_DIRECTIVE.match(current)
+            if directive:
+                keyword = directive.group(1).lower()
+                if suppress and keyword not in _FAST_CONDITIONS:
+                    return None
+                if '\t' in current or '\r' in current:
+                    return self._scan(current)
+
+                for kind, expr, token in _FAST_DIRECTIVES[keyword]:
+                    match = expr.match(current)
+                    if match:
+                        tokens.append((kind, token(match), 0, match.end()))
+                        start = match.end()
+                        break
+                else:
+                    return self._scan(current)
+
+        if suppress:
+            return tokens or None
+
+        if '$' in current:
+            if '\t' in current or '\r' in current or not _fast_expand(current, start, tokens):
+                return self._scan(current)
+        return tokens
+
+    def _lines(self, stream):
+        """enumerate the logical lines, joins the lines that ends with \\"""
+        buffer = []
         for line, text in enumerate(map(lambda x: x.rstrip('\n '), stream)):
             if not text:
                 continue
 
             if text[-1] == '\\':
-                current += text[:-1]
+                buffer.append(text[:-1])
                 continue
 
-            current += text + '\n'
-            start = 0
-            tokens = self.grammar.scanString(current)
-            for token in tokens:
-                if not self.suppress:
-                    self.nop(current[start:token[1]])
-                getattr(self, '_handle_' + token[0].getName())(line, token[0])
-                start = token[2]
+            if buffer:
+                buffer.append(text)
+                text = ''.join(buffer)
+                buffer.clear()
+            yield line, text + '\n'
 
+    def _may_fold(self, current, tokens):
+        """check that the folding is enabled and the line may contain the constant expressions of expansions"""
+        return self.fold and tokens and all(x[0] in _FOLD_EXPANSIONS for x in tokens)
+
+    def _dispatch(self, line, current, tokens):
+        """call handlers for the tokens of line"""
+        if not self.suppress and self._may_fold(current, tokens):
+            tokens = self._fold_expressions(line, current, tokens)
+        start = 0
+        for name, token, begin, end in tokens:
             if not self.suppress:
-                self.nop(current[start:])
-            current = ''
+                self.nop(current[start:begin])
+            getattr(self, '_handle_' + name)(line, token)
+            start = end
+
+        if not self.suppress:
+            self.nop(current[start:])
+
+    def _feed(self, line, current, tokens):
+        """dispatch the tokens of line or record them to the body of loop"""
+        if not self.loops:
+            return self._dispatch(line, current, tokens)
+
+        loop = self.loops[-1]
+        for name, *_ in tokens:
+            if name == 'for':
+                loop[2] += 1
+            elif name == 'endfor':
+                loop[2] -= 1
+        if loop[2] == 0:
+            self.loops.pop()
+            self._run_loop(loop[0], loop[1], loop[3])
+        else:
+            loop[3].append((line, current, tokens))
+
+    def parse(self, stream):
+        """parse the stream"""
+        loops = len(self.loops)
+        if self.engine == 'fast':
+            for line, current in self._lines(stream):
+                tokens = self._fast_scan(current)
+                if tokens is not None:
+                    self._feed(line, current, tokens)
+        else:
+            for line, current in self._lines(stream):
+                self._feed(line, current, self._scan(current))
+        if len(self.loops) > loops:
+            line = self.loops[loops][0]
+            del self.loops[loops:]
+            raise ValueError("%d: mismatch for/endfor" % line)
 
 
 class _Procedure:
-    """Procedure abstraction"""
+    """Procedure abstraction, the names are interned, because the same tables, columns and types repeat"""
+
+    __slots__ = ('name', 'arguments', 'queries', 'modifiers', 'children', 'read_only', 'errors', 'temptable',
+                 'returns', 'return_mod')
 
     argument_class = namedtuple('Argument', ('direction', 'name', 'type'))
     command_class = namedtuple('Command', ('op', 'table', 'columns'))
@@ -345,8 +1371,8 @@ class _Procedure:
     returns_class = namedtuple('Return', ('name', 'type', 'fields'))
 
     def __init__(self, name, arguments, comment):
-        self.name = name
-        self.arguments = [self.argument_class(*x) for x in arguments if x]
+        self.name = intern(name)
+        self.arguments = [self.argument_class(*map(intern, x)) for x in arguments if x]
         self.queries = list()
         self.modifiers = list()
         self.children = list()
@@ -358,51 +1384,97 @@ class _Procedure:
 
         if comment:
             try:
-                hint = _PROCEDURE_COMMENT_FORMAT.parseString(comment.strip("'\""))
-                self.return_mod = hint.mode
+                hint = _elements().PROCEDURE_COMMENT_FORMAT.parseString(comment.strip("'\""))
+                self.return_mod = hint.mode and intern(hint.mode)
                 if hint.table:
-                    self.temptable = self.temptable_class(hint.name, tuple(self.column_class(*x) for x in hint.columns[0]))
+                    self.temptable = self.temptable_class(
+                        intern(hint.name), tuple(self.column_class(*map(intern, x)) for x in hint.columns[0]))
             except Exception as e:
                 raise ValueError('SyntaxError: procedure %s, comment %s: %s' % (name, comment, e))
 
-    def add_read_command(self, *args):
+    def add_read_command(self, op, table, columns):
         """handle new read command"""
-        self.queries.append(self.command_class(*args))
+        self.queries.append(self.command_class(intern(op), intern(table), tuple(columns)))
 
-    def add_write_command(self, *args):
+    def add_write_command(self, op, table, columns):
         """handle new write command"""
-        self.modifiers.append(self.command_class(*args))
+        self.modifiers.append(self.command_class(intern(op), intern(table), tuple(columns)))
         self.read_only = False
 
-    def add_return(self, *args):
-        self.returns.append(self.returns_class(*args))
+    def add_return(self, name, rtype, fields):
+        self.returns.append(self.returns_class(intern(name), intern(rtype), tuple(fields)))
+
+    def add_child(self, name):
+        """handle the call of procedure"""
+        self.children.append(intern(name))
 
     def __repr__(self):
         return self.name
 
 
+# the procedures are sent from the worker processes, so pickle should find the nested types
+for _name in ('argument_class', 'command_class', 'temptable_class', 'column_class', 'returns_class'):
+    getattr(_Procedure, _name).__qualname__ = '_Procedure.' + _name
+
+
+def _is_finished(text, start, end):
+    """check the statement before the procedure, that starts at end, is finished"""
+    # the statement is not finished, if it is not terminated by semicolon or the semicolon is inside of parentheses
+    return _STATEMENT_START.search(text, max(text.rfind(';', start, end), start), end) is None and \
+        text.count('(', start, end) == text.count(')', start, end)
+
+
+def _decode(data):
+    """decode the utf8 text and translate the line ends"""
+    return str(data, 'utf8').replace('\r\n', '\n').replace('\r', '\n')
+
+
+def _release(buffer, end):
+    """release the pages of memory mapped buffer before end, they are read from the file again if necessary"""
+    # the madvise is available since python 3.8
+    if hasattr(buffer, 'madvise'):
+        end -= end % mmap.PAGESIZE
+        if end:
+            buffer.madvise(mmap.MADV_DONTNEED, 0, end)
+
+
+def _parse_part(cls, engine, text):
+    """parse the part of text by the new tokenizer, the error is returned with the procedures found before it"""
+    tokenizer = cls(engine)
+    try:
+        tokenizer.parse(text)
+        error = None
+    except Exception as e:
+        error = e
+    return list(tokenizer._procedures.values()), tokenizer._constants, tokenizer._structures, \
+        tokenizer._current, tokenizer._inlined, error
+
+
 class SQLTokenizer:
     """The sql statement tokenizer"""
     procedure_class = _Procedure
 
-    def __init__(self):
-        self._grammar = \
-            _CREATE_PROCEDURE.copy().setParseAction(self.on_begin_procedure) | \
-            _END_PROCEDURE.copy().setParseAction(self.on_end_procedure) | \
-            _DECLARE_CURSOR.copy() | \
-            _SELECT_EXPR.copy().setParseAction(self.on_select) | \
-            _INSERT_EXPR.copy().setParseAction(self.on_insert) | \
-            _UPDATE_EXPR.copy().setParseAction(self.on_update) | \
-            _DELETE_EXPR.copy().setParseAction(self.on_delete) | \
-            _THROW_EXPR.copy().setParseAction(self.on_error) | \
-            _CALL_EXPR.copy().setParseAction(self.on_call) | \
-            _CONSTANT.copy().setParseAction(self.on_constant) | \
-            _CREATE_TABLE.copy().setParseAction(self.on_table)
+    engines = ('fast', 'pyparsing')
 
+    def __init__(self, engine='pyparsing', cache=None):
+        """
+        constructor
+        :param engine: the parser engine
+        :param cache: the Cache to keep the parsed procedures, the unchanged procedures are not parsed again
+        """
+        if engine not in self.engines:
+            raise ValueError('unknown engine %s, expected one of %s' % (engine, ', '.join(self.engines)))
+        self.engine = engine
+        self.cache = cache
         self._procedures = dict()
         self._constants = list()
         self._structures = dict()
         self._current = None
+        self._inlined = list()
+        self._graph = None
+        # the process pool, that is shared by the parts of buffer or of chunks
+        self._executor = None
+        self._sharing = False
 
     @staticmethod
     def _column_name(column):
@@ -414,14 +1486,13 @@ class SQLTokenizer:
 
     def reset(self):
         self._procedures.clear()
+        self._graph = None
         self._current = None
+        self._inlined.clear()
 
     def on_begin_procedure(self, tokens):
         """catch the begin of procedure"""
-        self._current = self.procedure_class(tokens.name[0], tokens.args[0], tokens.comment)
-        if self._current.name in self._procedures:
-            raise ValueError('The procedure %s already defined!' % self._current)
-        self._procedures[self._current.name] = self._current
+        self._begin_procedure(tokens.name[0], tokens.args[0], tokens.comment)
 
     def on_end_procedure(self, _):
         """catch the end of procedure"""
@@ -430,8 +1501,6 @@ class SQLTokenizer:
     def on_select(self, tokens):
         """catch the select statement"""
         if self._current and not tokens.into:
-            columns = tuple(self._column_name(x) for x in tokens.columns)
-            self._current.add_read_command(tokens.op, tokens.table and tokens.table[0], columns)
             return_hint = tokens.hint
             if return_hint:
                 name = return_hint.name
@@ -439,13 +1508,13 @@ class SQLTokenizer:
             else:
                 name = ""
                 rtype = ""
-
-            self._current.add_return(name, rtype or "object", columns)
+            self._add_select(tokens.op, tokens.table and tokens.table[0],
+                             tuple(self._column_name(x) for x in tokens.columns), name, rtype)
 
     def on_insert(self, tokens):
         """catch the modify statement"""
         if self._current:
-            self._current.add_write_command(tokens.op, tokens.table, [])
+            self._current.add_write_command(tokens.op, tokens.table[0], [])
 
     on_update = on_insert
     on_delete = on_insert
@@ -453,7 +1522,7 @@ class SQLTokenizer:
     def on_error(self, tokens):
         """catch the raising of the exception"""
         if self._current:
-            self._current.errors.add(tokens.args[0][0].strip("'\""))
+            self._current.errors.add(intern(tokens.args[0][0].strip("'\"")))
 
     def on_constant(self, token):
         """catch constants"""
@@ -461,27 +1530,459 @@ class SQLTokenizer:
 
     def on_table(self, tokens):
         """catch the table"""
-        table_name = tokens.name.name
+        self._add_table(tokens.name.name, tokens.body)
+
+    def on_call(self, tokens):
+        """catch the procedure call"""
+        if self._current:
+            self._current.add_child(tokens[1])
+
+    def on_begin_inline(self, tokens):
+        """catch the body of inlined procedure, it is handled as the call"""
+        self._begin_inline(tokens.name[0])
+
+    def on_end_inline(self, _):
+        """catch the end of inlined procedure body"""
+        if self._inlined:
+            self._current = self._inlined.pop()
+
+    def _begin_procedure(self, name, arguments, comment):
+        """start the procedure"""
+        self._current = self.procedure_class(name, arguments, comment)
+        if self._current.name in self._procedures:
+            raise ValueError('The procedure %s already defined!' % self._current)
+        self._procedures[self._current.name] = self._current
+
+    def _add_select(self, op, table, columns, name, rtype):
+        """add the query and its result to the current procedure"""
+        # the query and the result share the columns
+        columns = tuple(intern(x) for x in columns)
+        self._current.add_read_command(op, table, columns)
+        self._current.add_return(name, rtype or "object", columns)
+
+    def _add_table(self, name, body):
+        """add the enums and the sets of table"""
         structures = defaultdict(list)
-        for t in _DECLARE_OPTIONS.scanString(tokens.body):
+        for t in _elements().DECLARE_OPTIONS.scanString(body):
             t = t[0]
             structures[t.kind].append((t.name.name, sorted(x.strip('"\'') for x in t.options[0])))
 
         if len(structures) > 0:
-            self._structures[table_name] = structures
+            self._structures[name] = structures
 
-    def on_call(self, tokens):
-        """catch the procedure call"""
+    def _begin_inline(self, name):
+        """start the body of inlined procedure"""
         if self._current:
-            self._current.children.append(tokens[1])
+            self._current.add_child(name)
+        self._inlined.append(self._current)
+        self._current = None
 
-    def parse(self, text):
+    def parse(self, text, jobs=1):
         """
         parse the input text
         :param text: the sql statements
+        :param jobs: the number of processes to parse the procedures in parallel
         """
-        for _ in self._grammar.scanString(text):
-            pass
+        self._graph = None
+        # the parts are parsed independently, so the text should not continue the procedure
+        if self._current is None and not self._inlined:
+            if self.cache is not None:
+                self._parse_parts(self._split_blocks(text, 1), jobs)
+                return
+            if jobs > 1:
+                parts = self._split(text, jobs * 4)
+                if len(parts) > 1:
+                    self._parse_parts(parts, jobs)
+                    return
+        self._parse_text(text)
+
+    def _parse_text(self, text):
+        """parse the text by the selected engine, the actions of shared grammar call the handlers of this tokenizer"""
+        previous = getattr(_ACTIVE, 'tokenizer', None)
+        _ACTIVE.tokenizer = self
+        try:
+            if self.engine == 'fast':
+                self._scan(text)
+            else:
+                for _ in _elements().STATEMENTS.scanString(text):
+                    pass
+        finally:
+            _ACTIVE.tokenizer = previous
+
+    def _scan(self, text):
+        """scan the text by the fast scanner, the statements, that it cannot handle, are parsed by pyparsing grammar"""
+        # pyparsing expands the tabs before the scan
+        text = text.expandtabs()
+        if _SCAN_UNSAFE.search(text):
+            for _ in _elements().STATEMENTS.scanString(text):
+                pass
+            return
+
+        pos = 0
+        while True:
+            match = _SCAN_STATEMENT.search(text, pos)
+            if match is None:
+                break
+            keyword = match.group(1)
+            if keyword is not None:
+                end = getattr(self, '_scan_' + keyword.lower())(text, match.end())
+            elif match.group(2) is not None:
+                if match.group(2) == 'END':
+                    self._current = None
+                end = match.end()
+            else:
+                end = self._scan_comment(text, match.start())
+
+            if end is _UNKNOWN:
+                grammar = _elements()
+                try:
+                    end = grammar.STATEMENTS._parse(text, match.start(), True, False)[0]
+                except grammar.ParseException:
+                    end = None
+            pos = match.end() if end is None else end
+
+    def _scan_create(self, text, pos):
+        """match the procedure or the table"""
+        end = self._scan_procedure(text, pos)
+        if end is None:
+            end = self._scan_table(text, pos)
+        return end
+
+    def _scan_procedure(self, text, pos):
+        """match the begin of procedure"""
+        pos = _SCAN_SPACES.match(text, pos).end()
+        if _scan_keyword(text, pos, 'DEFINER'):
+            definer = _SCAN_SPACES.match(text, pos + 7).end()
+            definer = text.startswith('=', definer) and _scan_identifier(text, definer + 1)
+            if definer:
+                pos = _SCAN_SPACES.match(text, definer[1]).end()
+        if not _scan_keyword(text, pos, 'PROCEDURE'):
+            return None
+        name = _scan_procedure_name(text, pos + 9)
+        if name is None:
+            return None
+        arguments = _scan_nested(text, name[1], _scan_argument)
+        if arguments is None or arguments is _UNKNOWN:
+            return arguments
+
+        pos = arguments[1]
+        comment = ''
+        keyword = _SCAN_SPACES.match(text, pos).end()
+        if _scan_keyword(text, keyword, 'COMMENT'):
+            start = _SCAN_SPACES.match(text, keyword + 7).end()
+            end = _scan_quoted(text, start)
+            if end != -1:
+                comment = text[start:end]
+                pos = end
+        self._begin_procedure(name[0], arguments[0], comment)
+        return pos
+
+    def _scan_table(self, text, pos):
+        """match the table"""
+        pos = _SCAN_SPACES.match(text, pos).end()
+        if not _scan_keyword(text, pos, 'TABLE'):
+            return None
+        pos += 5
+        condition = _SCAN_SPACES.match(text, pos).end()
+        if text.startswith('IF', condition):
+            condition = _SCAN_SPACES.match(text, condition + 2).end()
+            if _scan_keyword(text, condition, 'NOT'):
+                condition = _SCAN_SPACES.match(text, condition + 3).end()
+                if _scan_keyword(text, condition, 'EXISTS'):
+                    pos = condition + 6
+        name = _scan_identifier(text, pos)
+        if name is None:
+            return None
+        start = _SCAN_SPACES.match(text, name[1]).end()
+        end = text.find(';', start)
+        if end == -1:
+            return None
+        self._add_table(name[0], text[start:end])
+        return end
+
+    @staticmethod
+    def _scan_declare(text, pos):
+        """match the declaration of cursor, its query is skipped"""
+        name = _scan_identifier(text, pos)
+        if name is None:
+            return None
+        pos = _SCAN_SPACES.match(text, name[1]).end()
+        if not _scan_keyword(text, pos, 'CURSOR'):
+            return None
+        pos = _SCAN_SPACES.match(text, pos + 6).end()
+        if not _scan_keyword(text, pos, 'FOR'):
+            return None
+        end = text.find(';', pos + 3)
+        return None if end == -1 else end
+
+    def _scan_select(self, text, pos):
+        """match the select statement"""
+        columns = _scan_list(text, pos, _scan_column)
+        if columns is None:
+            return None
+        pos = columns[1]
+        into = _SCAN_SPACES.match(text, pos).end()
+        into = _scan_keyword(text, into, 'INTO') and _scan_list(text, into + 4, _scan_identifier)
+        if into:
+            pos = into[1]
+        table = ''
+        source = _SCAN_SPACES.match(text, pos).end()
+        if _scan_keyword(text, source, 'FROM'):
+            source = _scan_identifier(text, source + 4)
+            if source is not None:
+                table, pos = source
+        end = text.find(';', pos)
+        if end == -1:
+            return None
+
+        pos = end + 1
+        name = rtype = ''
+        hint = _SCAN_SPACES.match(text, pos).end()
+        if text.startswith('-- >', hint):
+            hint = _SCAN_SPACES.match(text, hint + 4).end()
+            match = _SCAN_ID.match(text, hint)
+            if match is not None:
+                delimiter = _SCAN_SPACES.match(text, match.end()).end()
+                if text.startswith(':', delimiter):
+                    name = match.group()
+                    hint = _SCAN_SPACES.match(text, delimiter + 1).end()
+            for value in ('object', 'array'):
+                if text[hint:hint + len(value)].upper() == value.upper():
+                    rtype = value
+                    pos = hint + len(value)
+                    break
+            else:
+                name = ''
+        if self._current and not into:
+            self._add_select('', table, tuple(columns[0]), name, rtype)
+        return pos
+
+    def _scan_modify(self, text, pos):
+        """match the table of modify statement"""
+        table = _scan_identifier(text, pos)
+        if table is None:
+            return None
+        end = text.find(';', table[1])
+        if end == -1:
+            return None
+        if self._current:
+            self._current.add_write_command('', table[0], [])
+        return end
+
+    def _scan_insert(self, text, pos):
+        """match the insert statement"""
+        pos = _SCAN_SPACES.match(text, pos).end()
+        if not _scan_keyword(text, pos, 'INTO'):
+            return None
+        return self._scan_modify(text, pos + 4)
+
+    _scan_update = _scan_modify
+
+    def _scan_delete(self, text, pos):
+        """match the delete statement"""
+        pos = _SCAN_SPACES.match(text, pos).end()
+        if not _scan_keyword(text, pos, 'FROM'):
+            return None
+        return self._scan_modify(text, pos + 4)
+
+    def _scan_call(self, text, pos):
+        """match the raising of exception or the procedure call"""
+        throw = _SCAN_SPACES.match(text, pos).end()
+        if text.startswith('`', throw):
+            throw = _SCAN_SPACES.match(text, throw + 1).end()
+        if _scan_exact_keyword(text, throw, '__throw'):
+            throw = _SCAN_SPACES.match(text, throw + 7).end()
+            if text.startswith('`', throw):
+                throw += 1
+            arguments = _scan_nested(text, throw, _scan_value)
+            if arguments is not None:
+                # the exception is taken from the first argument, pyparsing handles the call without arguments
+                if arguments is _UNKNOWN or not arguments[0]:
+                    return _UNKNOWN
+                if self._current:
+                    self._current.errors.add(intern(arguments[0][0].strip("'\"")))
+                return arguments[1]
+
+        name = _scan_procedure_name(text, pos)
+        if name is None:
+            return None
+        end = text.find(';', name[1])
+        if end == -1:
+            return None
+        if self._current:
+            self._current.add_child(name[0])
+        return end
+
+    def _scan_comment(self, text, pos):
+        """match the bounds of inlined procedure or the constant"""
+        start = pos
+        pos = _SCAN_SPACES.match(text, pos + 3).end()
+        if _scan_exact_keyword(text, pos, 'BEGIN'):
+            pos = _SCAN_SPACES.match(text, pos + 5).end()
+            name = _scan_exact_keyword(text, pos, 'INLINE') and _scan_procedure_name(text, pos + 6)
+            if name:
+                self._begin_inline(name[0])
+                return name[1]
+        elif _scan_exact_keyword(text, pos, 'END'):
+            pos = _SCAN_SPACES.match(text, pos + 3).end()
+            if _scan_exact_keyword(text, pos, 'INLINE'):
+                if self._inlined:
+                    self._current = self._inlined.pop()
+                return pos + 6
+        elif _scan_exact_keyword(text, pos, 'CONSTANT') and (start == 0 or text[start - 1] == '\n'):
+            name = _SCAN_ID.match(text, _SCAN_SPACES.match(text, pos + 8).end())
+            if name is not None:
+                start = _SCAN_LINE_SPACES.match(text, name.end()).end()
+                end = text.find('\n', start)
+                if end == -1:
+                    # the end of text is the end of line too
+                    self._constants.append((name.group(), text[start:]))
+                    return len(text) + 1
+                self._constants.append((name.group(), text[start:end]))
+                return end + 1
+        return None
+
+    @classmethod
+    def _split(cls, text, count):
+        """split the text to at most count parts before the procedures, the expressions do not cross the splits"""
+        return cls._split_blocks(text, len(text) // count + 1)
+
+    @staticmethod
+    def _split_blocks(text, size):
+        """split the text before the procedures to the parts of at least size characters"""
+        parts = []
+        start = 0
+        for match in _PROCEDURE_START.finditer(text):
+            end = match.start()
+            if end - start < size:
+                continue
+            if _is_finished(text, start, end):
+                parts.append(text[start:end])
+                start = end
+        parts.append(text[start:])
+        return parts
+
+    @staticmethod
+    def _split_buffer(buffer, size):
+        """
+        split the utf8 encoded buffer before the procedures to the parts of at least size bytes,
+        only the parts are decoded, the line ends are translated like in the files opened in the text mode
+        """
+        start = 0
+        for match in _PROCEDURE_START_BYTES.finditer(buffer):
+            end = match.start()
+            if end - start < size:
+                continue
+            part = _decode(buffer[start:end])
+            if _is_finished(part, 0, len(part)):
+                yield part
+                start = end
+                _release(buffer, start)
+        yield _decode(buffer[start:])
+
+    def _parse_parts(self, parts, jobs):
+        """
+        parse the parts independently and merge the results in the source order,
+        the cached parts are not parsed, the others are parsed in the process pool if jobs > 1
+        """
+        results = [None] * len(parts)
+        keys = None
+        if self.cache is not None:
+            keys = [self.cache.digest('procedures', self.engine, x) for x in parts]
+            # the procedures are not changed after parse, so the cached ones are shared
+            results = [self.cache.get(x) for x in keys]
+
+        missing = [i for i, x in enumerate(results) if x is None]
+        if jobs > 1 and len(missing) > 1:
+            from itertools import repeat
+
+            executor = self._executor
+            if executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                executor = ProcessPoolExecutor(jobs)
+                if self._sharing:
+                    self._executor = executor
+            try:
+                parsed = list(executor.map(_parse_part, repeat(type(self)), repeat(self.engine),
+                                           (parts[i] for i in missing)))
+            finally:
+                if executor is not self._executor:
+                    executor.shutdown()
+        else:
+            parsed = [_parse_part(type(self), self.engine, parts[i]) for i in missing]
+
+        for i, result in zip(missing, parsed):
+            results[i] = result
+            # the failed and unfinished parts are not cached, the error should be reported again
+            if keys is not None and result[3] is None and not result[4] and result[5] is None:
+                self.cache.put(keys[i], result)
+
+        if any(x[3] is not None or x[4] for x in results[:-1] if x[5] is None):
+            # the procedure is not finished in the part, so the parts depend on each other
+            self._parse_text(''.join(parts))
+            return
+
+        for procedures, constants, structures, current, inlined, error in results:
+            for procedure in procedures:
+                if procedure.name in self._procedures:
+                    raise ValueError('The procedure %s already defined!' % procedure)
+                self._procedures[procedure.name] = procedure
+            self._constants.extend(constants)
+            self._structures.update(structures)
+            if error is not None:
+                raise error
+            self._current = current
+            self._inlined[:] = inlined
+
+    @contextmanager
+    def _shared_pool(self):
+        """share the process pool by the parts, that are parsed in the block, the pool is started on the first use"""
+        if self._sharing:
+            yield
+            return
+        self._sharing = True
+        try:
+            yield
+        finally:
+            self._sharing = False
+            executor, self._executor = self._executor, None
+            if executor is not None:
+                executor.shutdown()
+
+    def parse_buffer(self, buffer, jobs=1, size=1 << 20):
+        """
+        parse the utf8 encoded text, the buffer is split before the procedures and the parts are parsed one by one,
+        so the memory depends on the size of parts, but not on the size of buffer
+        :param buffer: the bytes-like object, e.g. the memory mapped file
+        :param jobs: the number of processes to parse the procedures in parallel
+        :param size: the minimal size of part in bytes
+        """
+        with self._shared_pool():
+            for part in self._split_buffer(buffer, size):
+                self.parse(part, jobs)
+
+    def parse_chunks(self, chunks, jobs=1):
+        """
+        parse the text by parts, the text is split after the statements, so the memory does not depend on its size
+        :param chunks: the iterable of strings
+        :param jobs: the number of processes to parse the procedures in parallel
+        """
+        tail = ''
+        with self._shared_pool():
+            for chunk in chunks:
+                start = tail.rfind(';')
+                text = tail + chunk
+                end = None
+                # the hint of select may follow, so only the complete lines are checked
+                for end in _STATEMENT_END.finditer(text, len(tail) if start < 0 else start, text.rfind('\n')):
+                    pass
+                if end is None:
+                    tail = text
+                else:
+                    self.parse(text[:end.end()], jobs)
+                    tail = text[end.end():]
+            if tail:
+                self.parse(tail, jobs)
 
     def constants(self):
         """
@@ -503,6 +2004,14 @@ class SQLTokenizer:
         """
         return self._procedures.values()
 
+    def call_graph(self):
+        """
+        :return: the call graph of procedures, it is built once after the parse
+        """
+        if self._graph is None:
+            self._graph = CallGraph(self._procedures)
+        return self._graph
+
     def errors(self, procedure=None):
         """
         get procedure errors recursively
@@ -512,11 +2021,7 @@ class SQLTokenizer:
         """
         if procedure is None:
             return reduce(lambda x, y: x | y.errors, self._procedures.values(), set())
-
-        errors = procedure.errors.copy()
-        for child in set(procedure.children):
-            errors |= self.errors(self._procedures[child])
-        return errors
+        return self.call_graph().errors(procedure.name)
 
     def returns(self, procedure):
         """
@@ -525,10 +2030,15 @@ class SQLTokenizer:
         :return the set of errors
         :rtype set
         """
-        returns = list(procedure.returns)
-        for child in procedure.children:
-            returns.extend(self.returns(self._procedures[child]))
-        return returns
+        return self.call_graph().returns(procedure.name)
+
+    def tables(self, procedure):
+        """
+        recursively collect the tables, that are read and modified in specified procedure
+        :param procedure: the procedure object
+        :return: the tuple of frozensets (read tables, modified tables)
+        """
+        return self.call_graph().tables(procedure.name)
 
     def queries(self, procedure):
         """
@@ -536,20 +2046,8 @@ class SQLTokenizer:
         :param procedure: the procedure object
         :return: the list of all queries
         """
-        queries = procedure.queries[:]
-        for child in (self._procedures[x] for x in procedure.children):
-            queries.extend(self.queries(child))
-        return queries
+        return self.call_graph().queries(procedure.name)
 
     def is_read_only(self, procedure):
         """recursively determine that procedure read-only or not"""
-        if procedure.read_only is not None:
-            return procedure.read_only
-
-        for child in (self._procedures[x] for x in procedure.children):
-            if self.is_read_only(child) is False:
-                procedure.read_only = False
-                return False
-
-        procedure.read_only = True
-        return True
+        return self.call_graph().is_read_only(procedure.name)
@@ -0,0 +1,229 @@
+"""
+This file is part of WSQL-SDK
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__author__ = "@bg"
+
+from bisect import bisect_right
+from collections import defaultdict
+from .grammar import SQLTokenizer, _is_finished, _parse_part
+
+
+class _Block:
+    """the part of text, that is parsed independently, and its procedures"""
+
+    __slots__ = ('text', 'procedures', 'constants', 'structures', 'error', 'unfinished')
+
+    def __init__(self, text, result):
+        self.text = text
+        self.procedures, self.constants, self.structures, current, inlined, self.error = result
+        # the procedure continues in the next block, the failed block is not continued
+        self.unfinished = self.error is None and (current is not None or bool(inlined))
+
+
+class IncrementalTokenizer(SQLTokenizer):
+    """
+    The tokenizer of the text, that is edited, e.g. in the editor.
+    The text is kept as the blocks, that are split before the procedures, the edit parses again only the blocks,
+    that it touches, and the call graph computes again only the closures of changed procedures and of their callers.
+    The errors do not stop the parse, they are reported by diagnostics.
+    """
+
+    # the tokenizer of blocks
+    block_class = SQLTokenizer
+
+    def __init__(self, engine='pyparsing'):
+        """
+        constructor
+        :param engine: the parser engine
+        """
+        super().__init__(engine)
+        self._blocks = list()
+        self._starts = list()
+        self._length = 0
+        # the blocks, that define the procedure, in the source order
+        self._definitions = defaultdict(list)
+        # the indexes of blocks, they are computed on request after the edit
+        self._positions = None
+
+    @property
+    def text(self):
+        """the current text"""
+        return ''.join(x.text for x in self._blocks)
+
+    def reset(self):
+        super().reset()
+        self._blocks.clear()
+        self._starts.clear()
+        self._length = 0
+        self._definitions.clear()
+        self._positions = None
+
+    def parse(self, text, jobs=1):
+        """
+        append the text
+        :param text: the sql statements
+        :param jobs: ignored, the blocks are parsed in the current process
+        """
+        self.edit(self._length, self._length, text)
+
+    def edit(self, start, end, text):
+        """
+        replace the text between the offsets, the blocks, that the edit touches, are parsed again
+        :param start: the offset of the first replaced character
+        :param end: the offset after the last replaced character
+        :param text: the new text
+        :return: the set of names of procedures, that are added, changed or removed
+        """
+        if not 0 <= start <= end <= self._length:
+            raise ValueError('the edit %d:%d is out of the text of %d characters' % (start, end, self._length))
+        # the split before the block depends on the end of previous block, so it is parsed again too
+        first = max(bisect_right(self._starts, start) - 2, 0)
+        last = bisect_right(self._starts, end)
+        offset = self._starts[first] if self._starts else 0
+        old = self._blocks[first:last]
+        region = ''.join(x.text for x in old)
+        region = region[:start - offset] + text + region[end - offset:]
+        # the blocks by text, the same text may repeat, but each block is used once
+        reuse = defaultdict(list)
+        for block in old:
+            reuse[block.text].append(block)
+
+        while True:
+            blocks = self._parse_region(region, reuse)
+            # the next block is split from the region only after the finished statement and procedure
+            if last == len(self._blocks) or not blocks or \
+                    (not blocks[-1].unfinished and _is_finished(blocks[-1].text, 0, len(blocks[-1].text))):
+                break
+            reuse[self._blocks[last].text].append(self._blocks[last])
+            old.append(self._blocks[last])
+            region += self._blocks[last].text
+            last += 1
+
+        delta = len(text) - (end - start)
+        starts = []
+        for block in blocks:
+            starts.append(offset)
+            offset += len(block.text)
+        self._starts[first:] = starts + [x + delta for x in self._starts[last:]]
+        self._blocks[first:last] = blocks
+        self._length += delta
+        self._positions = None
+        return self._update(old, blocks)
+
+    def _parse_region(self, text, reuse):
+        """split the text before the procedures and parse the parts, the unfinished part is joined with the next"""
+        blocks = []
+        # the region may be parsed again after it is extended, so the blocks are taken from the copy
+        reuse = {k: list(v) for k, v in reuse.items()}
+        for part in self._split_blocks(text, 1):
+            if not part:
+                continue
+            if blocks and blocks[-1].unfinished:
+                part = blocks.pop().text + part
+            same = reuse.get(part)
+            if same:
+                block = same.pop(0)
+            else:
+                block = _Block(part, _parse_part(self.block_class, self.engine, part))
+            blocks.append(block)
+        return blocks
+
+    def _update(self, old, new):
+        """update the procedures and the call graph after the blocks are replaced"""
+        kept = set(old) & set(new)
+        changed = set()
+        for block in old:
+            if block not in kept:
+                for procedure in block.procedures:
+                    self._definitions[procedure.name].remove(block)
+                    changed.add(procedure.name)
+        for block in new:
+            if block not in kept:
+                for procedure in block.procedures:
+                    definitions = self._definitions[procedure.name]
+                    definitions.append(block)
+                    if len(definitions) > 1:
+                        definitions.sort(key=self._position)
+                    changed.add(procedure.name)
+
+        for name in list(changed):
+            definitions = self._definitions.get(name)
+            if not definitions:
+                self._definitions.pop(name, None)
+                del self._procedures[name]
+                continue
+            # the first definition wins, like in the text parsed at once
+            procedure = next(x for x in definitions[0].procedures if x.name == name)
+            if self._procedures.get(name) is procedure:
+                changed.discard(name)
+            else:
+                self._procedures[name] = procedure
+
+        if self._graph is not None and changed:
+            self._graph.update(changed)
+        return changed
+
+    def _position(self, block):
+        """get the index of block"""
+        if self._positions is None:
+            self._positions = {x: i for i, x in enumerate(self._blocks)}
+        return self._positions[block]
+
+    def span(self, procedure):
+        """
+        :return: the offsets of the block, that defines the procedure,
+                 the block starts before the procedure, unless the procedure continues the previous statement
+        """
+        block = self._definitions[procedure.name][0]
+        start = self._starts[self._position(block)]
+        return start, start + len(block.text)
+
+    def procedures_at(self, offset):
+        """
+        :return: the list of procedures, that are defined by the block at offset
+        """
+        index = bisect_right(self._starts, offset) - 1
+        if index < 0:
+            return []
+        return list(self._blocks[index].procedures)
+
+    def diagnostics(self):
+        """
+        :return: the list of (start, end, message) of the blocks, that cannot be parsed or define the same procedure
+        """
+        result = []
+        for start, block in zip(self._starts, self._blocks):
+            end = start + len(block.text)
+            if block.error is not None:
+                result.append((start, end, str(block.error)))
+            for procedure in block.procedures:
+                if self._procedures[procedure.name] is not procedure:
+                    result.append((start, end, 'The procedure %s already defined!' % procedure))
+        return result
+
+    def constants(self):
+        """
+        :return: the list of constants
+        """
+        return [x for block in self._blocks for x in block.constants]
+
+    def structures(self, name):
+        """
+        :return: the list of enums
+        """
+        structures = dict()
+        for block in self._blocks:
+            structures.update(block.structures)
+        return structures.get(name)
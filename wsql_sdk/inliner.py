@@ -0,0 +1,256 @@
+"""
+This file is part of WSQL-SDK
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__author__ = "@bg"
+
+from collections import namedtuple
+import re
+
+# the marker of procedure, that should be inlined, it is written by the directive #inline
+MARKER = '-- INLINE\n'
+
+_FLAGS = re.IGNORECASE | re.MULTILINE
+_MARKER = re.compile(r'^-- INLINE\n', re.MULTILINE)
+_PROCEDURE = re.compile(r'^[ \t]*CREATE\s+(DEFINER\s*=\s*\S+\s+)?PROCEDURE\s+`?([\w.:]+)`?\s*\(', _FLAGS)
+_BEGIN = re.compile(r'(?:(\w+)\s*:\s*)?BEGIN\b', _FLAGS)
+_END = re.compile(r'\bEND\s*\$\$', _FLAGS)
+_CALL = re.compile(r'\bCALL\s+`?([\w.:]+)`?\s*\(', _FLAGS)
+_ARGUMENT = re.compile(r'\s*(?:(IN|OUT|INOUT)\s+)?`?(\w+)`?\s+(.+?)\s*\Z', _FLAGS | re.DOTALL)
+_LABEL = re.compile(r'\b(\w+)\s*:\s*(?:BEGIN|LOOP|WHILE|REPEAT)\b', _FLAGS)
+# the strings and the comments, that should not be changed, and the quoted names, that may contain quotes
+_OPAQUE = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`[^`]*`|--(?:[ \t][^\n]*|(?=\n))|#[^\n]*|/\*.*?\*/",
+                     re.DOTALL)
+
+# the start and the end are the bounds of body, the span is the bounds of statement
+_Procedure = namedtuple('_Procedure', ('name', 'arguments', 'label', 'body', 'start', 'end', 'inline', 'secure',
+                                       'span'))
+
+
+def _mask(text):
+    """replace the strings and the comments by spaces, so the keywords inside them are not found"""
+    return _OPAQUE.sub(lambda m: m.group() if m.group().startswith('`') else re.sub(r'[^\n]', ' ', m.group()), text)
+
+
+def _closing(masked, pos):
+    """find the parenthesis, that closes the parenthesis before pos, -1 if it is not found"""
+    depth = 1
+    while pos < len(masked):
+        c = masked[pos]
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return pos
+        pos += 1
+    return -1
+
+
+def _split(text, masked):
+    """split the list by the top-level commas"""
+    parts = []
+    depth = 0
+    start = 0
+    for i, c in enumerate(masked):
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == ',' and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return [] if len(parts) == 1 and not parts[0].strip() else parts
+
+
+def is_internal(name):
+    """check that the procedure is not the part of API"""
+    module, _, name = name.partition('.')
+    return name.startswith('_') or module.startswith('_')
+
+
+def _is_multiline(body):
+    """check that the body contains the strings with the line breaks"""
+    return any('\n' in m.group() for m in _OPAQUE.finditer(body) if m.group()[0] in '\'"')
+
+
+def _statements(body):
+    """count the statements in the body"""
+    return _mask(body).count(';')
+
+
+def procedures(text):
+    """find the procedures in the text"""
+    masked = _mask(text)
+    markers = [m.start() for m in _MARKER.finditer(text)]
+    result = dict()
+    previous = 0
+    for match in _PROCEDURE.finditer(masked):
+        if match.start() < previous:
+            continue
+        close = _closing(masked, match.end())
+        begin = close != -1 and _BEGIN.search(masked, close + 1)
+        end = begin and _END.search(masked, begin.end())
+        if not end:
+            continue
+        head = masked[close + 1:begin.start()]
+        arguments = []
+        for argument in _split(text[match.end():close], masked[match.end():close]):
+            parsed = _ARGUMENT.match(argument)
+            if parsed is None:
+                arguments = None
+                break
+            arguments.append(((parsed.group(1) or 'IN').upper(), parsed.group(2), parsed.group(3)))
+        inline = any(previous <= x < match.start() for x in markers)
+        secure = match.group(1) is not None or re.search(r'\bSQL\s+SECURITY\b', head, re.IGNORECASE) is not None
+        result[match.group(2)] = _Procedure(match.group(2), arguments, begin.group(1), text[begin.end():end.start()],
+                                            begin.end(), end.start(), inline, secure, (match.start(), end.end()))
+        previous = end.end()
+    return result
+
+
+class _Inliner:
+    """replace the calls of small procedures by their bodies"""
+
+    def __init__(self, text, threshold=0):
+        """constructor"""
+        self.procedures = procedures(text)
+        self.threshold = threshold
+        self.counter = 0
+        self.expanded = dict()
+        self.visiting = set()
+
+    def _is_inlined(self, name):
+        """check that calls of procedure should be replaced by its body"""
+        procedure = self.procedures.get(name)
+        if procedure is None or procedure.arguments is None or procedure.secure or name in self.visiting:
+            return False
+        return procedure.inline or \
+            is_internal(name) and self.threshold > 0 and _statements(procedure.body) <= self.threshold
+
+    def expand(self, body):
+        """inline the calls in the body"""
+        masked = _mask(body)
+        buffer = []
+        start = 0
+        for match in _CALL.finditer(masked):
+            if match.start() < start or not self._is_inlined(match.group(1)):
+                continue
+            close = _closing(masked, match.end())
+            if close == -1:
+                continue
+            procedure = self.procedures[match.group(1)]
+            values = _split(body[match.end():close], masked[match.end():close])
+            if len(values) != len(procedure.arguments):
+                continue
+            line = body[body.rfind('\n', 0, match.start()) + 1:match.start()]
+            buffer.append(body[start:match.start()])
+            buffer.append(self._substitute(procedure, [x.strip() for x in values], line[:len(line) - len(line.lstrip())]))
+            start = close + 1
+        buffer.append(body[start:])
+        return ''.join(buffer)
+
+    def _body(self, procedure):
+        """get the body of procedure with the calls inlined"""
+        body = self.expanded.get(procedure.name)
+        if body is None:
+            self.visiting.add(procedure.name)
+            try:
+                body = self.expanded[procedure.name] = self.expand(procedure.body)
+            finally:
+                self.visiting.discard(procedure.name)
+        return body
+
+    def _substitute(self, procedure, values, indent):
+        """make the block, that is equivalent to the call of procedure, the indent is the indent of call"""
+        self.counter += 1
+        prefix = '__inline%d' % self.counter
+        body = self._rename_labels(self._body(procedure), prefix, procedure.label)
+        arguments = procedure.arguments
+        # the arguments are evaluated in the scope of caller and copied to the parameters of procedure,
+        # the OUT parameters are copied back after the body
+        outputs = [(v, a[1]) for v, a in zip(values, arguments) if a[0] != 'IN']
+
+        lines = ['BEGIN', '  -- BEGIN INLINE %s' % procedure.name]
+        if arguments:
+            for value, (direction, name, kind) in zip(values, arguments):
+                default = '' if direction == 'OUT' else ' DEFAULT %s' % value
+                lines.append('  DECLARE %s_%s %s%s;' % (prefix, name, kind, default))
+            lines.append('  BEGIN')
+            for direction, name, kind in arguments:
+                default = '' if direction == 'OUT' else ' DEFAULT %s_%s' % (prefix, name)
+                lines.append('    DECLARE %s %s%s;' % (name, kind, default))
+        depth = '    ' if arguments else '  '
+        lines.append('%s%s: BEGIN' % (depth, prefix))
+        if _is_multiline(body):
+            # the indent cannot be changed, because the strings may be changed
+            lines.append(None)
+        else:
+            lines.extend(depth + x if x.strip() else x for x in body.strip('\n').split('\n'))
+        lines.append('%sEND %s;' % (depth, prefix))
+        if outputs:
+            lines.append('    SET %s;' % ', '.join('%s_%s = %s' % (prefix, x, x) for _, x in outputs))
+        if arguments:
+            lines.append('  END;')
+        if outputs:
+            lines.append('  SET %s;' % ', '.join('%s = %s_%s' % (v, prefix, x) for v, x in outputs))
+        lines.append('  -- END INLINE')
+        lines.append('END')
+        return ('\n' + indent).join(body.strip('\n') if x is None else x for x in lines)
+
+    @staticmethod
+    def _rename_labels(body, prefix, label):
+        """make the labels of body unique, the label of procedure becomes the label of block"""
+        masked = _mask(body)
+        names = {m.group(1).lower() for m in _LABEL.finditer(masked)} - {'end'}
+        mapping = {x: '%s_%s' % (prefix, x) for x in names}
+        if label:
+            mapping[label.lower()] = prefix
+        if not mapping:
+            return body
+        pattern = re.compile(r'\b(?:(%s)(?=\s*:(?!=))|((?:LEAVE|ITERATE|END(?:\s+(?:LOOP|WHILE|REPEAT))?)\s+)(%s)\b)' %
+                             ('|'.join(map(re.escape, mapping)), '|'.join(map(re.escape, mapping))), re.IGNORECASE)
+        buffer = []
+        start = 0
+        for match in pattern.finditer(masked):
+            buffer.append(body[start:match.start()])
+            if match.group(1):
+                buffer.append(mapping[match.group(1).lower()])
+            else:
+                buffer.append(body[match.start(2):match.end(2)] + mapping[match.group(3).lower()])
+            start = match.end()
+        buffer.append(body[start:])
+        return ''.join(buffer)
+
+    def run(self, text):
+        """inline the calls in the bodies of all procedures"""
+        buffer = []
+        start = 0
+        for procedure in sorted(self.procedures.values(), key=lambda x: x.start):
+            buffer.append(text[start:procedure.start])
+            buffer.append(self._body(procedure))
+            start = procedure.end
+        buffer.append(text[start:])
+        return _MARKER.sub('', ''.join(buffer))
+
+
+def inline(text, threshold=0):
+    """
+    replace the calls of procedures marked by #inline by their bodies
+    :param text: the sql statements
+    :param threshold: the internal procedures with at most threshold statements are inlined too
+    :return: the sql statements
+    """
+    return _Inliner(text, threshold).run(text)
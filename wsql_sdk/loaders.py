@@ -0,0 +1,105 @@
+"""
+This file is part of WSQL-SDK
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__author__ = "@bg"
+
+from io import StringIO
+import os
+import posixpath
+import zipfile
+
+
+def _normalize(path):
+    """get the key of path inside the virtual file system"""
+    path = posixpath.normpath(path.replace(os.sep, '/')).lstrip('/')
+    return '' if path == '.' else path
+
+
+class Loader:
+    """the interface to access the sources"""
+
+    def open(self, filename):
+        """open the file for reading text"""
+        raise NotImplementedError
+
+    def listdir(self, dirname):
+        """get the names of files in the directory"""
+        raise NotImplementedError
+
+    def stat(self, dirname):
+        """get the stamp, that changes each time the directory is modified, None if it is unknown"""
+        return None
+
+
+class DirectoryLoader(Loader):
+    """load the sources from the file system, the paths are relative to root if it is specified"""
+
+    def __init__(self, root=None):
+        """constructor"""
+        self.root = root
+
+    def _path(self, path):
+        """get the real path"""
+        if self.root is None:
+            return path
+        return os.path.join(self.root, _normalize(path))
+
+    def open(self, filename):
+        return open(self._path(filename), 'r')
+
+    def listdir(self, dirname):
+        return os.listdir(self._path(dirname))
+
+    def stat(self, dirname):
+        path = self._path(dirname)
+        return os.path.abspath(path), os.stat(path).st_mtime_ns
+
+
+class DictLoader(Loader):
+    """load the sources from the mapping file name to content"""
+
+    def __init__(self, files):
+        """constructor"""
+        self.files = {_normalize(k): v for k, v in files.items()}
+
+    def open(self, filename):
+        try:
+            return StringIO(self.files[_normalize(filename)])
+        except KeyError:
+            raise FileNotFoundError(filename) from None
+
+    def listdir(self, dirname):
+        dirname = _normalize(dirname)
+        names = [posixpath.basename(x) for x in self.files if posixpath.dirname(x) == dirname]
+        if not names and dirname and not any(x.startswith(dirname + '/') for x in self.files):
+            raise FileNotFoundError(dirname)
+        return names
+
+
+class ZipLoader(DictLoader):
+    """load the sources from the zip archive"""
+
+    def __init__(self, archive, encoding='utf8'):
+        """constructor, the archive is the file name, the stream or the zipfile.ZipFile"""
+        if isinstance(archive, zipfile.ZipFile):
+            super().__init__(self._read(archive, encoding))
+        else:
+            with zipfile.ZipFile(archive) as archive:
+                super().__init__(self._read(archive, encoding))
+
+    @staticmethod
+    def _read(archive, encoding):
+        """read the files from archive"""
+        return {x: archive.read(x).decode(encoding) for x in archive.namelist() if not x.endswith('/')}
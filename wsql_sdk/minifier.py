@@ -0,0 +1,145 @@
+"""
+This file is part of WSQL-SDK
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__author__ = "@bg"
+
+import re
+
+_TOKEN = re.compile(r"""('(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*"|`[^`]*`)"""
+                    r"""|(--(?:[ \t][^\n]*|(?=\n)|\Z)|#[^\n]*)"""
+                    r"""|(/\*.*?\*/)"""
+                    r"""|((?:[^'"`#/\-]+|-(?!-(?:[ \t\n]|\Z))|/(?!\*))+)"""
+                    r"""|(.)""", re.DOTALL)
+_LINE_BREAKS = re.compile(r'\s*\n\s*')
+_SPACES = re.compile(r'[^\S\n]+')
+_PARENTHESES = re.compile(r'([()])')
+# the statement is finished, so the comment is not a part of any expression of SQLTokenizer
+_BOUNDARY = re.compile(r'(?:;|\$\$|(?:^|:)[ \t]*BEGIN)\Z', re.IGNORECASE | re.MULTILINE)
+# the comments, that are parsed by SQLTokenizer or by server
+_KEEP = re.compile(r'\A(?:/\*[!+]|--[ \t]*>)|\$\$')
+# the keywords of SQLTokenizer, they are matched after the identifier characters too,
+# the statement may begin inside the comment and continue after it
+_KEYWORD = re.compile(r'(?:SELECT|INSERT|UPDATE|DELETE|CALL|CREATE|END|DECLARE|CONSTANT|INLINE)\b', re.IGNORECASE)
+_HINT = re.compile(r'\s*--[ \t]*>')
+_CONSTANT = re.compile(r'CONSTANT', re.IGNORECASE)
+
+
+class _Minifier:
+    """remove the comments and the whitespaces, that do not change the statements and the codegen"""
+
+    def __init__(self, text):
+        """constructor"""
+        self.text = text
+        self.buffer = []
+        self.depth = 0
+        self.boundary = True
+        self.pending = ''
+        self.line_start = True
+
+    def _flush(self):
+        """write the pending whitespace"""
+        if self.pending == '\n' and self.buffer:
+            self.buffer.append('\n')
+            self.line_start = True
+        elif self.pending and not self.line_start:
+            self.buffer.append(' ')
+        self.pending = ''
+
+    def _emit(self, value):
+        """write the value after the pending whitespace"""
+        self._flush()
+        self.buffer.append(value)
+        self.line_start = value.endswith('\n')
+
+    def _space(self, value):
+        """collapse the whitespace, the line breaks are kept"""
+        if '\n' in value:
+            self.pending = '\n'
+        elif not self.pending:
+            self.pending = ' '
+
+    def _code(self, value):
+        """handle the code outside of literals and comments"""
+        if '(' not in value and ')' not in value:
+            self._text(value)
+            return
+        for part in _PARENTHESES.split(value):
+            if part == '(' or part == ')':
+                self._emit(part)
+                self.depth = max(self.depth + (1 if part == '(' else -1), 0)
+                self.boundary = False
+            elif part:
+                self._text(part)
+
+    def _text(self, value):
+        """handle the code without parentheses"""
+        if self.depth > 0:
+            # the whitespaces inside parentheses are a part of types and expressions of SQLTokenizer
+            self._emit(value)
+            self.boundary = False
+            return
+        words = value.strip()
+        if not words:
+            self._space(value)
+            return
+        head = value[:len(value) - len(value.lstrip())]
+        if head:
+            self._space(head)
+        self._emit(_SPACES.sub(' ', _LINE_BREAKS.sub('\n', words)))
+        tail = value[len(value.rstrip()):]
+        if tail:
+            self._space(tail)
+        self.boundary = _BOUNDARY.search(words, len(words) - 32) is not None
+
+    def _comment(self, match):
+        """drop the comment between statements, unless it is used by SQLTokenizer"""
+        value = match.group()
+        keyword = _KEYWORD.search(value) is not None
+        if self.depth == 0 and self.boundary and not keyword and not _KEEP.search(value) and \
+                not _HINT.match(self.text, match.end()):
+            if value.startswith('/*'):
+                self._space(' ')
+            return
+        if keyword:
+            self.boundary = False
+        self._flush()
+        if self.line_start and match.start() > 0 and self.text[match.start() - 1] != '\n' and _CONSTANT.search(value):
+            # the indented comment is not the constant, so the indent is kept
+            self.buffer.append(' ')
+        self._emit(value)
+
+    def run(self):
+        """minify the text"""
+        for match in _TOKEN.finditer(self.text):
+            literal, comment, block, code, other = match.groups()
+            if comment is not None or block is not None:
+                self._comment(match)
+            elif code is not None:
+                self._code(code)
+            else:
+                self._emit(match.group())
+                self.boundary = False
+        if self.pending == '\n' and self.buffer:
+            self.buffer.append('\n')
+        return ''.join(self.buffer)
+
+
+def minify(text):
+    """
+    remove the comments and collapse the whitespaces outside of string literals
+    :param text: the sql statements
+    :return: the sql statements
+    """
+    return _Minifier(text).run()
@@ -0,0 +1,48 @@
+"""
+This file is part of WSQL-SDK
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__author__ = "@bg"
+
+from contextlib import contextmanager
+
+
+def add_arguments(parser):
+    """add the profiling options to the command line parser"""
+    parser.add_argument('--profile', dest='profile', action='store_const', const='-',
+                        help='write the profile of grammar elements to the standard error')
+    parser.add_argument('--profile-json', dest='profile', metavar='FILE',
+                        help='write the profile of grammar elements to the file as json')
+
+
+def write(args, profile):
+    """write the profile according to the command line arguments"""
+    if args.profile == '-':
+        import sys
+        profile.report(sys.stderr)
+    else:
+        with open(args.profile, 'w') as stream:
+            profile.dump(stream)
+
+
+@contextmanager
+def profile(args):
+    """profile the grammar in the block, if it is requested by the command line arguments"""
+    if not getattr(args, 'profile', None):
+        yield None
+        return
+    from .grammar import GrammarProfile
+    with GrammarProfile() as result:
+        yield result
+    write(args, result)
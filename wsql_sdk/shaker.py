@@ -0,0 +1,70 @@
+"""
+This file is part of WSQL-SDK
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+__author__ = "@bg"
+
+import re
+from .inliner import is_internal, procedures
+
+# the calls, the comments included, because the codegen handles them as calls too,
+# the inlined procedures and the names in strings, that may be used by the dynamic sql
+_REFERENCE = re.compile(r'\bCALL\s+`?([\w.:]+)|^[ \t]*-- BEGIN INLINE\s+`?([\w.:]+)|\'([\w.:]+)\'|"([\w.:]+)"',
+                        re.IGNORECASE | re.MULTILINE)
+
+
+def references(text):
+    """find the names of procedures, that text may call"""
+    return {next(x for x in m.groups() if x) for m in _REFERENCE.finditer(text)}
+
+
+def reachable(text, found=None):
+    """
+    find the procedures, that are reachable from the public procedures and from the statements outside of procedures
+    :param text: the sql statements
+    :param found: the procedures in text, if they are already found
+    :return: the set of names
+    """
+    if found is None:
+        found = procedures(text)
+    outside = []
+    start = 0
+    for procedure in sorted(found.values(), key=lambda x: x.span):
+        outside.append(text[start:procedure.span[0]])
+        start = procedure.span[1]
+    outside.append(text[start:])
+
+    queue = [x for x in found if not is_internal(x)]
+    queue.extend(references(''.join(outside)))
+    names = set()
+    while queue:
+        name = queue.pop()
+        if name not in names and name in found:
+            names.add(name)
+            queue.extend(references(found[name].body))
+    return names
+
+
+def shake(text):
+    """remove the internal procedures, that are not reachable from the public procedures"""
+    found = procedures(text)
+    names = reachable(text, found)
+    buffer = []
+    start = 0
+    for procedure in sorted(found.values(), key=lambda x: x.span):
+        if procedure.name not in names:
+            buffer.append(text[start:procedure.span[0]])
+            start = procedure.span[1] + text.startswith('\n', procedure.span[1])
+    buffer.append(text[start:])
+    return ''.join(buffer)
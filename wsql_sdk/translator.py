@@ -15,35 +15,95 @@ SOFTWARE.
 
 __author__ = "@bg"
 
+from collections import namedtuple
+from io import StringIO
+from itertools import repeat
 import fnmatch
 import os
+import pickle
+import re
 import warnings
+from .cache import Cache
+from . import inliner, minifier, shaker
+from .loaders import DirectoryLoader
+from . import depfile, profiling
 from .grammar import MacrosTokenizer
 
 
+_Record = namedtuple('_Record', ('output', 'warnings', 'dependencies', 'variables', 'functions',
+                                 'conditions_stack', 'suppress', 'includes', 'defined', 'used'))
+
+# the saved macros state, the version should be changed with the format
+_Prelude = namedtuple('_Prelude', ('version', 'defines', 'variables', 'functions', 'includes', 'directories',
+                                   'digests', 'output', 'defined', 'used', 'options'))
+_PRELUDE_VERSION = 4
+
+# the file, that has no preprocessor statements, does not change the macros state
+_DIRECTIVE = re.compile('^#', re.MULTILINE)
+
+# the size of output buffer in the streaming mode
+STREAM_BUFFER_SIZE = 1 << 20
+
+
+def _recorded(log):
+    """get the recorded warnings with their locations, that can be stored and sent from the worker"""
+    return [(str(x.message), x.category, x.filename, x.lineno) for x in log]
+
+
+def _warn(records):
+    """issue the recorded warnings again at their original locations"""
+    for message, category, filename, lineno in records:
+        warnings.warn_explicit(message, category, filename, lineno)
+
+
+def _preprocess(cls, engine, options, variables, functions, files):
+    """expand the macros in the files, that do not change the macros state, by the new translator of class cls"""
+    trans = cls(StringIO(), engine=engine, **dict(options))
+    trans.variables.update(variables)
+    trans.functions.update(functions)
+    results = list()
+    for text in files:
+        trans.output = StringIO()
+        error = None
+        with warnings.catch_warnings(record=True) as log:
+            warnings.simplefilter('always')
+            try:
+                trans.parse(StringIO(text))
+            except Exception as e:
+                error = e
+        results.append((trans.output.getvalue(), _recorded(log), error, set(trans.used)))
+        trans.used.clear()
+    return results
+
+
 class Translator(MacrosTokenizer):
-    def __init__(self, output, close_output=False):
-        super().__init__()
+    # the minimal number of files to preprocess in one job
+    chunk_size = 8
+
+    def __init__(self, output, close_output=False, engine='fast', cache=None, jobs=1, loader=None, inline=False,
+                 fold=False):
+        super().__init__(engine, fold)
         self.output = output
+        self.inline = inline
         self.close_output = close_output
         self.includes = set()
         self.workdir = os.curdir
+        self.cache = cache
+        self.digests = dict()
+        self.dependencies = None
+        self.jobs = jobs
+        self.executor = None
+        self.directories = set()
+        self.loader = loader or DirectoryLoader()
+        self.preloaded = set()
 
     def write(self, raw):
         line = raw.strip('\n')
         if line:
-            self.output.write(line)
-            if raw.endswith('\n'):
-                self.output.write('\n')
-
-    def on_function(self, ast, body, args):
-        start = 0
-        for t in ast:
-            self.write(body[start:t[1]])
-            self.write(args[t[0].getName()])
-            start = t[2]
+            self.output.write(line + '\n' if raw.endswith('\n') else line)
 
-        self.write(body[start:])
+    def on_function(self, name, value):
+        self.write(value)
 
     def on_constant(self, name, value):
         self.write('-- CONSTANT {0} {1}\n'.format(name, value))
@@ -51,36 +111,702 @@ class Translator(MacrosTokenizer):
     def on_variable(self, name, value):
         self.write(value)
 
+    def on_inline(self):
+        # the marker is consumed by the inliner only, so it is written if the inlining is requested
+        if self.inline:
+            self.write(inliner.MARKER)
+
     def on_include(self, filename):
         filename = os.path.join(self.workdir, filename)
         dirname = os.path.dirname(filename)
         before = len(self.includes)
-        for fname in fnmatch.filter(os.listdir(dirname), os.path.basename(filename)):
-            self.include_file(os.path.join(dirname, fname))
-        if before == len(self.includes):
+        pattern = os.path.basename(filename)
+        if self.cache is None:
+            names = fnmatch.filter(self.loader.listdir(dirname), pattern)
+        else:
+            names = fnmatch.filter(self.listdir(dirname), pattern)
+            if self.dependencies is not None:
+                self.dependencies.append(('listdir', dirname, pattern, tuple(names)))
+        self._add_directory(dirname, pattern, names)
+        if self.jobs > 1 and len(names) > 1:
+            self._include_parallel([os.path.join(dirname, x) for x in names])
+        else:
+            for fname in names:
+                self.include_file(os.path.join(dirname, fname))
+        if before == len(self.includes) and not self.preloaded.intersection(os.path.join(dirname, x) for x in names):
             warnings.warn("Not included: %s" % filename)
 
     def nop(self, text):
         self.write(text)
 
+    def _add_directory(self, dirname, pattern, names):
+        """remember the directory, if its listing affects the result"""
+        if not names or any(c in pattern for c in '*?['):
+            self.directories.add(dirname)
+
+    def depends(self):
+        """get the files and directories, that the result depends on"""
+        return sorted(self.includes) + sorted(self.directories - self.includes)
+
+    def listdir(self, dirname):
+        """list the directory, the listing is cached until the directory is modified"""
+        stamp = self.loader.stat(dirname)
+        if stamp is None:
+            return self.loader.listdir(dirname)
+        key = self.cache.digest('listdir', stamp)
+        names = self.cache.get(key)
+        if names is None:
+            names = self.loader.listdir(dirname)
+            self.cache.put(key, names)
+        return names
+
+    def digest(self, filename):
+        """get the digest of file content, the content is read at most once per build"""
+        if filename not in self.digests:
+            with self.loader.open(filename) as stream:
+                self.digests[filename] = Cache.digest(stream.read())
+        return self.digests[filename]
+
+    def _is_actual(self, dependencies):
+        """check that the files and the directories, that record depends on, are not changed"""
+        try:
+            for dependency in dependencies:
+                if dependency[0] == 'file':
+                    if self.digest(dependency[1]) != dependency[2]:
+                        return False
+                elif tuple(fnmatch.filter(self.listdir(dependency[1]), dependency[2])) != dependency[3]:
+                    return False
+        except OSError:
+            return False
+        return True
+
+    def _state(self):
+        """get the macros state and the options, that the included file depends on"""
+        return (sorted(self.variables.items()),
+                sorted((k, list(v.args), v.body) for k, v in self.functions.items()),
+                list(self.conditions_stack), self.suppress, sorted(self.includes), self._options())
+
+    def _options(self):
+        """get the options, that change the output, as the sorted pairs"""
+        return ('fold', self.fold), ('inline', self.inline)
+
+    def _replay(self, record):
+        """apply the record of included file"""
+        self.output.write(record.output)
+        _warn(record.warnings)
+        self.variables.clear()
+        self.variables.update(record.variables)
+        for name in set(self.functions).union(record.functions):
+            if self.functions.get(name) != record.functions.get(name):
+                self.expansions.pop(name, None)
+        self.functions.clear()
+        self.functions.update(record.functions)
+        self.conditions_stack[:] = record.conditions_stack
+        self.suppress = record.suppress
+        self.includes.update(record.includes)
+        self.defined.update(record.defined)
+        self.used.update(record.used)
+        for dependency in record.dependencies:
+            if dependency[0] == 'listdir':
+                self._add_directory(*dependency[1:])
+
+    def _include_cached(self, filename):
+        """include the file, replay the stored record if the file and its includes are not changed"""
+        with self.loader.open(filename) as stream:
+            text = stream.read()
+        digest = Cache.digest(text)
+        self.digests[filename] = digest
+        key = Cache.digest('include', filename, digest, self._state())
+        record = self.cache.get(key)
+        if record is not None and self._is_actual(record.dependencies):
+            self._replay(record)
+        else:
+            output, dependencies = self.output, self.dependencies
+            self.output, self.dependencies = StringIO(), [('file', filename, digest)]
+            workdir = self.workdir
+            self.workdir = os.path.dirname(filename)
+            log = list()
+            try:
+                with warnings.catch_warnings(record=True) as log:
+                    warnings.simplefilter('always')
+                    self.parse(StringIO(text))
+                record = _Record(self.output.getvalue(), _recorded(log),
+                                 self.dependencies, dict(self.variables), dict(self.functions),
+                                 list(self.conditions_stack), self.suppress, set(self.includes),
+                                 dict(self.defined), set(self.used))
+                self.cache.put(key, record)
+            finally:
+                self.workdir = workdir
+                output.write(self.output.getvalue())
+                self.output, self.dependencies = output, dependencies
+                _warn(_recorded(log))
+
+        if self.dependencies is not None:
+            self.dependencies.extend(record.dependencies)
+
+    def _include_parallel(self, filenames):
+        """include the files, the sequences of files without preprocessor statements are expanded in parallel"""
+        batch = list()
+        for filename in filenames:
+            if filename in self.preloaded:
+                continue
+            if filename in self.includes:
+                self._flush(batch)
+                warnings.warn("Already included: %s" % filename)
+                continue
+            with self.loader.open(filename) as stream:
+                text = stream.read()
+            if _DIRECTIVE.search(text) is not None:
+                self._flush(batch)
+                self.include_file(filename)
+                continue
+
+            self.includes.add(filename)
+            if self.cache is None:
+                batch.append((filename, text, None, None))
+                continue
+            digest = self.digests[filename] = Cache.digest(text)
+            if self.dependencies is not None:
+                self.dependencies.append(('file', filename, digest))
+            key = Cache.digest('include', filename, digest, self._state())
+            batch.append((filename, text, key, self.cache.get(key)))
+        self._flush(batch)
+
+    def _flush(self, batch):
+        """expand the batch of files in parallel and write results in the original order"""
+        if not batch:
+            return
+        files = [x[1] for x in batch if x[3] is None]
+        if len(files) < 2:
+            results = _preprocess(type(self), self.engine, self._options(), self.variables, self.functions, files)
+        else:
+            if self.executor is None:
+                # the multiprocessing is the large part of startup time, so it is imported on the first use
+                from concurrent.futures import ProcessPoolExecutor
+                self.executor = ProcessPoolExecutor(self.jobs)
+            size = max(self.chunk_size, len(files) // (self.jobs * 4) + 1)
+            chunks = [files[i:i + size] for i in range(0, len(files), size)]
+            jobs = self.executor.map(_preprocess, repeat(type(self)), repeat(self.engine), repeat(self._options()),
+                                     repeat(self.variables), repeat(self.functions), chunks)
+            results = [x for chunk in jobs for x in chunk]
+
+        results = iter(results)
+        items = list(batch)
+        batch.clear()
+        for filename, _, key, record in items:
+            if record is None:
+                output, log, error, used = next(results)
+                if error is None and key is not None:
+                    self.cache.put(key, _Record(output, log, [], dict(self.variables), dict(self.functions),
+                                                list(self.conditions_stack), self.suppress, {filename}, {}, used))
+            else:
+                output, log, error, used = record.output, record.warnings, None, record.used
+            self.used.update(used)
+            self.output.write(output)
+            _warn(log)
+            if error is not None:
+                raise error
+
     def include_file(self, filename):
+        if filename in self.preloaded:
+            return
         if filename in self.includes:
             warnings.warn("Already included: %s" % filename)
         else:
             self.includes.add(filename)
-            with open(filename, 'r') as stream:
+            if self.cache is not None:
+                self._include_cached(filename)
+                return
+            with self.loader.open(filename) as stream:
                 workdir = self.workdir
                 self.workdir = os.path.dirname(filename)
                 self.parse(stream)
                 self.workdir = workdir
 
     def compile(self, filename):
-        self.include_file(os.path.join(self.workdir, filename))
-        self.output.flush()
-        self.close_output and self.output.close()
+        try:
+            self.include_file(os.path.join(self.workdir, filename))
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+        self.close()
         if len(self.conditions_stack):
             raise ValueError("mismatch if/endif")
 
+    def save(self, stream, defines, output):
+        """save the macros state after the prelude to the binary stream, the defines are the initial variables"""
+        digests = {x: self.digest(x) for x in self.includes}
+        prelude = _Prelude(_PRELUDE_VERSION, dict(defines), dict(self.variables), dict(self.functions),
+                           set(self.includes), set(self.directories), digests, output,
+                           dict(self.defined), set(self.used), self._options())
+        pickle.dump(prelude, stream, pickle.HIGHEST_PROTOCOL)
+
+    def load(self, stream):
+        """load the macros state of the prelude, the includes of the prelude files are skipped"""
+        try:
+            prelude = pickle.load(stream)
+        except Exception as e:
+            raise ValueError("invalid prelude: %s" % e) from None
+        if not isinstance(prelude, _Prelude) or prelude.version != _PRELUDE_VERSION:
+            raise ValueError("invalid prelude: unsupported format")
+        if prelude.defines != self.variables:
+            raise ValueError("the prelude was built with other defines")
+        if prelude.options != self._options():
+            raise ValueError("the prelude was built with other options")
+        for filename, digest in prelude.digests.items():
+            try:
+                actual = self.digest(filename)
+            except OSError:
+                actual = None
+            if actual != digest:
+                raise ValueError("the prelude is out of date: %s was changed" % filename)
+
+        self.variables.update(prelude.variables)
+        self.functions.update(prelude.functions)
+        self.defined.update(prelude.defined)
+        self.used.update(prelude.used)
+        self.includes.update(prelude.includes)
+        self.preloaded.update(prelude.includes)
+        self.directories.update(prelude.directories)
+        self.output.write(prelude.output)
+
+    def close(self):
+        """flush the output and close it, if it is owned by translator"""
+        if self.close_output:
+            self.output.close()
+        else:
+            self.output.flush()
+
+
+# the value of macros, that is not defined in variant
+_MISSING = object()
+
+
+class VariantTranslator(Translator):
+    """
+    translate the sources for several sets of defines in one pass,
+    the macros state is forked only for the names, that have different values in variants
+    """
+
+    def __init__(self, outputs, variants, close_output=False, engine='fast', loader=None, fold=False):
+        super().__init__(None, close_output, engine, loader=loader, fold=fold)
+        self.outputs = list(outputs)
+        self.count = len(self.outputs)
+        if len(variants) != self.count:
+            raise ValueError('expected %d variants, got %d' % (self.count, len(variants)))
+        self.varying_variables = dict()
+        self.varying_functions = dict()
+        self.classes = dict()
+        self.memos = dict()
+        for name in set().union(*variants):
+            self._store(self.variables, self.varying_variables, name, tuple(x.get(name, _MISSING) for x in variants))
+        self.suppressed = [False] * self.count
+        self.stacks = [list() for _ in range(self.count)]
+        self.included = [set() for _ in range(self.count)]
+        self.blocked = frozenset()
+        self.active = ()
+        self.targets = ()
+        self._update()
+
+    def _store(self, common, varying, name, values):
+        """store the values of name in variants"""
+        self.classes.clear()
+        if values.count(values[0]) == len(values):
+            varying.pop(name, None)
+            self._set(common, name, values[0])
+        else:
+            varying[name] = values
+
+    @staticmethod
+    def _view(common, varying, name, variant):
+        """get the value of name in variant"""
+        if name in varying:
+            return varying[name][variant]
+        return common.get(name, _MISSING)
+
+    @staticmethod
+    def _set(common, name, value):
+        """set the value of name in macros state"""
+        if value is _MISSING:
+            common.pop(name, None)
+        else:
+            common[name] = value
+
+    def _set_function(self, name, value):
+        """set the function, the memorized expansions are kept per function"""
+        self._set(self.functions, name, value)
+        if value is _MISSING:
+            self.expansions.pop(name, None)
+        else:
+            self.expansions[name] = self.memos.setdefault(id(value), (value, dict()))[1]
+
+    def _update(self):
+        """update the set of variants, that accept the tokens"""
+        self.active = tuple(v for v in range(self.count) if v not in self.blocked and not self.suppressed[v])
+        self.targets = [self.outputs[v] for v in self.active]
+        self.suppress = not self.active
+
+    def _references(self, text, name=None):
+        """get the varying names, that the text may refer to"""
+        return tuple(x for x in self.varying_variables if x == name or x in text), \
+            tuple(x for x in self.varying_functions if x == name or x in text)
+
+    def _classes(self, variables, functions):
+        """split the active variants to the groups with same values of the names"""
+        key = (variables, functions, self.active)
+        classes = self.classes.get(key)
+        if classes is None:
+            values = [self.varying_variables[x] for x in variables] + [self.varying_functions[x] for x in functions]
+            groups = dict()
+            for v in self.active:
+                groups.setdefault(tuple(x.index(x[v]) for x in values), list()).append(v)
+            classes = self.classes[key] = list(groups.values())
+        return classes
+
+    def _for_each(self, handler, line, token, text, name=None):
+        """
+        call the handler once for each group of active variants, that have same values of names referred by text,
+        the name is the macros that handler may change
+        """
+        variables, functions = self._references(text, name)
+        if name is not None:
+            values = [(self._view(self.variables, self.varying_variables, name, v),
+                       self._view(self.functions, self.varying_functions, name, v)) for v in range(self.count)]
+        try:
+            for group in self._classes(variables, functions):
+                for x in variables:
+                    self._set(self.variables, x, self.varying_variables[x][group[0]])
+                for x in functions:
+                    self._set_function(x, self.varying_functions[x][group[0]])
+                if name is not None:
+                    self._set(self.variables, name, values[group[0]][0])
+                    self._set_function(name, values[group[0]][1])
+                self.targets = [self.outputs[v] for v in group]
+                handler(line, token)
+                if name is not None:
+                    value = (self.variables.get(name, _MISSING), self.functions.get(name, _MISSING))
+                    for v in group:
+                        values[v] = value
+        finally:
+            self.targets = [self.outputs[v] for v in self.active]
+
+        if name is not None:
+            self._store(self.variables, self.varying_variables, name, tuple(x[0] for x in values))
+            self._store(self.functions, self.varying_functions, name, tuple(x[1] for x in values))
+            self.expansions.pop(name, None)
+
+    def _is_shared(self, name, text):
+        """check that the definition has the same effect for all variants"""
+        return len(self.active) == self.count and not any(self._references(text, name))
+
+    def write(self, raw):
+        line = raw.strip('\n')
+        if line:
+            if raw.endswith('\n'):
+                line += '\n'
+            for stream in self.targets:
+                stream.write(line)
+
+    def _dispatch(self, line, current, tokens):
+        """the constant expressions are folded once for each group of variants with same values"""
+        variables, functions = self._references(current)
+        if self.suppress or not (variables or functions) or not self._may_fold(current, tokens):
+            return super()._dispatch(line, current, tokens)
+        active = self.active
+        try:
+            for group in self._classes(variables, functions):
+                for x in variables:
+                    self._set(self.variables, x, self.varying_variables[x][group[0]])
+                for x in functions:
+                    self._set_function(x, self.varying_functions[x][group[0]])
+                self.active = tuple(group)
+                self.targets = [self.outputs[v] for v in group]
+                super()._dispatch(line, current, tokens)
+        finally:
+            self.active = active
+            self.targets = [self.outputs[v] for v in active]
+
+    def _handle_define(self, line, token):
+        if self.suppress:
+            return
+        text = token.body if token.args else token.value
+        if self._is_shared(token.name, text):
+            super()._handle_define(line, token)
+        else:
+            self._for_each(super()._handle_define, line, token, text, token.name)
+
+    def _handle_undefine(self, line, token):
+        if self.suppress:
+            return
+        if self._is_shared(token.name, ''):
+            super()._handle_undefine(line, token)
+        else:
+            self._for_each(super()._handle_undefine, line, token, '', token.name)
+
+    def _handle_expand_function(self, line, token):
+        if self.suppress:
+            return
+        text = token.name + ' ' + ' '.join(map(str, token.args[0]))
+        if any(self._references(text)):
+            self._for_each(super()._handle_expand_function, line, token, text)
+        else:
+            super()._handle_expand_function(line, token)
+
+    def _handle_expand_var(self, line, token):
+        if self.suppress:
+            return
+        if token.name in self.varying_variables:
+            self._for_each(super()._handle_expand_var, line, token, token.name)
+        else:
+            super()._handle_expand_var(line, token)
+
+    def _handle_if(self, _, token):
+        variables = self._references(token.condition)[0]
+        for group in self._classes(variables, ()):
+            for x in variables:
+                self._set(self.variables, x, self.varying_variables[x][group[0]])
+            suppressed = not self._evaluate(token.condition)
+            for v in group:
+                self.stacks[v].append(False)
+                self.suppressed[v] = suppressed
+        self._update()
+
+    def _handle_for(self, line, token):
+        if not self.suppress and any(self._references(token.value, token.name)):
+            raise ValueError("%d: the loop %s depends on the matrix names" % (line, token.name))
+        super()._handle_for(line, token)
+
+    def _handle_else(self, *_):
+        for v in range(self.count):
+            if v not in self.blocked:
+                self.suppressed[v] = not self.suppressed[v]
+        self._update()
+
+    def _handle_endif(self, line, _):
+        for v in range(self.count):
+            if v not in self.blocked:
+                try:
+                    self.suppressed[v] = self.stacks[v].pop()
+                except IndexError:
+                    raise ValueError("%d: mismatch if/endif" % line) from None
+        self._update()
+
+    def on_include(self, filename):
+        filename = os.path.join(self.workdir, filename)
+        dirname = os.path.dirname(filename)
+        pattern = os.path.basename(filename)
+        participants = self.active
+        before = [len(self.included[v]) for v in participants]
+        names = fnmatch.filter(self.loader.listdir(dirname), pattern)
+        self._add_directory(dirname, pattern, names)
+        for fname in names:
+            self._include(os.path.join(dirname, fname), participants)
+        if any(len(self.included[v]) == x for v, x in zip(participants, before)):
+            warnings.warn("Not included: %s" % filename)
+
+    def _include(self, filename, participants):
+        """include the file for the variants"""
+        if any(filename in self.included[v] for v in participants):
+            warnings.warn("Already included: %s" % filename)
+            participants = tuple(v for v in participants if filename not in self.included[v])
+            if not participants:
+                return
+
+        self.includes.add(filename)
+        for v in participants:
+            self.included[v].add(filename)
+        blocked, workdir = self.blocked, self.workdir
+        self.blocked = frozenset(range(self.count)).difference(participants)
+        self._update()
+        try:
+            with self.loader.open(filename) as stream:
+                self.workdir = os.path.dirname(filename)
+                self.parse(stream)
+        finally:
+            self.blocked, self.workdir = blocked, workdir
+            self._update()
+
+    def include_file(self, filename):
+        self._include(filename, self.active)
+
+    def compile(self, filename):
+        self.include_file(os.path.join(self.workdir, filename))
+        self.close()
+        if any(self.stacks):
+            raise ValueError("mismatch if/endif")
+
+    def close(self):
+        for stream in self.outputs:
+            if self.close_output:
+                stream.close()
+            else:
+                stream.flush()
+
+
+def translate(filename, loader=None, output=None, defines=None, **kwargs):
+    """preprocess the file, return the result as string if the output stream is not specified"""
+    stream = StringIO() if output is None else output
+    builder = Translator(stream, loader=loader, **kwargs)
+    builder.variables.update(defines or ())
+    builder.compile(filename)
+    return stream.getvalue() if output is None else output
+
+
+class Watcher:
+    """rebuild the output, when the input or any of its dependencies is changed"""
+
+    def __init__(self, args, cache=None):
+        """constructor"""
+        self.args = args
+        self.cache = cache or Cache()
+        self.stats = dict()
+
+    @staticmethod
+    def stat(path):
+        """get the modification stamp of the path"""
+        try:
+            info = os.stat(path)
+        except OSError:
+            return None
+        return info.st_mtime_ns, info.st_size
+
+    def poll(self):
+        """
+        rebuild the output if any dependency is changed, the unchanged includes are replayed from the cache,
+        the output is replaced after the successful build only, the errors are reported as warnings
+        """
+        if self.stats and all(self.stat(k) == v for k, v in self.stats.items()):
+            return False
+
+        stats = {k: self.stat(k) for k in self.stats}
+        builder = None
+        # the warnings filters are reset, so the same warnings are reported again by each build
+        with warnings.catch_warnings():
+            self.cache.track()
+            try:
+                builder = create_translator(self.args, self.cache)
+                build(self.args, builder)
+                # the records, that are not used by the latest build, are dropped, so the cache does not grow
+                self.cache.evict()
+            except Exception as e:
+                warnings.warn("%s: %s" % (type(e).__name__, e), RuntimeWarning)
+            finally:
+                builder and builder.close_output and builder.close()
+
+        # the prelude, that cannot be loaded, e.g. it is out of date, is watched with the previous dependencies
+        dependencies = builder.depends() if builder is not None else list(stats)
+        dependencies.append(self.args.input[0])
+        if self.args.prelude:
+            dependencies.append(self.args.prelude)
+        self.stats = {k: stats[k] if k in stats else self.stat(k) for k in dependencies}
+        return True
+
+    def run(self, interval):
+        """poll the dependencies until interrupted"""
+        import time
+        while True:
+            self.poll()
+            time.sleep(interval)
+
+
+def get_variants(args):
+    """get the sets of defines for the combinations of the matrix values"""
+    from itertools import product
+    matrix = [(d, v.split(',')) for d, v in map(lambda x: x.split(':', 1), args.matrix)]
+    return [dict(zip((x[0] for x in matrix), values)) for values in product(*(x[1] for x in matrix))]
+
+
+def get_targets(args):
+    """get the output file names"""
+    if args.matrix:
+        return [args.output.format(**x) for x in get_variants(args)]
+    return [args.output or args.input[0]]
+
+
+def open_output(args, filename):
+    """open the output file, in the streaming mode the output is written through the large buffer"""
+    return open(filename, 'w', buffering=STREAM_BUFFER_SIZE if args.stream else -1)
+
+
+def is_buffered(args):
+    """check that the output should be processed after the compilation, in watch mode it is written after the build"""
+    return bool(args.save_prelude or args.inline or args.shake or args.minify or args.watch and not args.matrix)
+
+
+def write_output(filename, output):
+    """write the output through the temporary file, so the file is never left partially written"""
+    temp = filename + '.tmp'
+    try:
+        with open(temp, 'w') as stream:
+            stream.write(output)
+        os.replace(temp, filename)
+    except BaseException:
+        if os.path.exists(temp):
+            os.unlink(temp)
+        raise
+
+
+def create_translator(args, cache=None):
+    """create the translator according to the command line arguments"""
+    defines = dict(map(lambda x: x.split(':', 1), args.defines))
+    if args.matrix:
+        variants = [dict(defines, **x) for x in get_variants(args)]
+        if args.watch:
+            # the outputs are written after the successful build, see build
+            return VariantTranslator([StringIO() for _ in variants], variants, engine=args.engine, fold=args.fold)
+        outputs = [open_output(args, x) for x in get_targets(args)]
+        return VariantTranslator(outputs, variants, True, engine=args.engine, fold=args.fold)
+
+    options = dict(engine=args.engine, cache=cache, jobs=args.jobs, inline=args.inline, fold=args.fold)
+    if is_buffered(args):
+        builder = Translator(StringIO(), **options)
+    elif args.output:
+        builder = Translator(open_output(args, args.output), True, **options)
+    elif args.depfile == '-':
+        builder = Translator(open(os.devnull, 'w'), True, **options)
+    else:
+        import sys
+        builder = Translator(sys.stdout, **options)
+    builder.variables.update(defines)
+    if args.prelude:
+        with open(args.prelude, 'rb') as stream:
+            builder.load(stream)
+    return builder
+
+
+def build(args, builder):
+    """compile the input and write the dependencies"""
+    with profiling.profile(args):
+        builder.compile(args.input[0])
+    if args.matrix and args.watch:
+        for filename, stream in zip(get_targets(args), builder.outputs):
+            write_output(filename, stream.getvalue())
+    if is_buffered(args):
+        output = builder.output.getvalue()
+        if args.save_prelude:
+            with open(args.save_prelude, 'wb') as stream:
+                builder.save(stream, dict(map(lambda x: x.split(':', 1), args.defines)), output)
+        if args.inline:
+            output = inliner.inline(output, args.inline_max or 0)
+        if args.shake:
+            output = shaker.shake(output)
+        if args.minify:
+            output = minifier.minify(output)
+        if args.output:
+            write_output(args.output, output)
+        elif args.depfile != '-':
+            import sys
+            sys.stdout.write(output)
+    if args.unused:
+        for name in builder.unused():
+            warnings.warn("Unused macros: %s" % name)
+    if args.depfile:
+        dependencies = builder.depends()
+        if args.prelude:
+            dependencies.append(args.prelude)
+        depfile.write(args, get_targets(args), dependencies)
+
 
 def parse_arguments(argv=None):
     from argparse import ArgumentParser
@@ -88,21 +814,72 @@ def parse_arguments(argv=None):
     parser.add_argument('input', nargs=1, help='input file')
     parser.add_argument('output', nargs='?', help='output file')
     parser.add_argument('-d', '--define', dest='defines', action='append', help='custom defines', default=list())
-    return parser.parse_args(argv)
+    parser.add_argument('--engine', help='the lexer engine', choices=Translator.engines, default='pyparsing')
+    parser.add_argument('--cache-dir', help='the directory to cache the preprocessed includes')
+    parser.add_argument('-j', '--jobs', help='the number of parallel jobs', type=int, default=1)
+    parser.add_argument('--watch', help='rebuild the output on changes', action='store_true')
+    parser.add_argument('--interval', help='the polling interval for watch mode, in seconds', type=float, default=0.5)
+    parser.add_argument('-m', '--matrix', action='append', default=list(),
+                        help='the values of define for variants, NAME:V1,V2,..., the output should contain {NAME}')
+    parser.add_argument('--prelude', help='load the macros state saved by --save-prelude')
+    parser.add_argument('--save-prelude', help='save the macros state after the input to the file')
+    parser.add_argument('--inline', action='store_true', help='inline the procedures marked by #inline')
+    parser.add_argument('--inline-max', type=int, metavar='N',
+                        help='with --inline, inline also the internal procedures with at most N statements')
+    parser.add_argument('--fold', action='store_true',
+                        help='replace the constant expressions of macros and numeric literals with +, - and * '
+                             'by their values')
+    parser.add_argument('--shake', action='store_true',
+                        help='remove the internal procedures, that are not reachable from the public procedures')
+    parser.add_argument('--minify', action='store_true',
+                        help='remove the comments and the whitespaces, that are not used by codegen')
+    parser.add_argument('--stream', action='store_true',
+                        help='translate with the bounded memory, the output is not kept in memory and is written '
+                             'through the large buffer')
+    parser.add_argument('--unused', action='store_true', help='warn about the macros, that are never expanded')
+    depfile.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.watch and not args.output:
+        parser.error('the output file is required for --watch')
+    if args.stream and (is_buffered(args) or args.cache_dir or args.watch):
+        parser.error('the --stream cannot be used with the options, that keep the output in memory')
+    if args.profile and args.jobs > 1:
+        parser.error('the --profile cannot be used with --jobs, the parallel jobs are not profiled')
+    if args.matrix and (args.prelude or args.save_prelude):
+        parser.error('the prelude cannot be used with --matrix')
+    if args.inline_max is not None and not args.inline:
+        parser.error('the --inline-max requires --inline')
+    if args.matrix and args.inline:
+        parser.error('the --inline cannot be used with --matrix')
+    if args.matrix and args.shake:
+        parser.error('the --shake cannot be used with --matrix')
+    if args.matrix and args.minify:
+        parser.error('the --minify cannot be used with --matrix')
+    if args.matrix:
+        try:
+            count = len(get_variants(args))
+        except ValueError:
+            parser.error('the matrix should be specified as NAME:V1,V2,...')
+        try:
+            targets = get_targets(args) if args.output else ()
+        except (KeyError, ValueError, IndexError):
+            parser.error('the output should contain the placeholders only for the matrix names')
+        if len(set(targets)) != count:
+            parser.error('the output should contain the placeholder for each matrix name')
+    return args
 
 
 def main(argv=None):  # pragma: no cover
     args = parse_arguments(argv)
-    if args.output:
-        builder = Translator(open(args.output, 'w'), True)
+    cache = args.cache_dir and Cache(args.cache_dir) or None
+    if args.watch:
+        try:
+            Watcher(args, cache).run(args.interval)
+        except KeyboardInterrupt:
+            pass
     else:
-        import sys
-        builder = Translator(sys.stdout)
-
-    for d, v in map(lambda x: x.split(':', 1), args.defines):
-        builder.variables[d] = v
-
-    builder.compile(args.input[0])
+        build(args, create_translator(args, cache))
 
 if __name__ == "__main__":
     main()